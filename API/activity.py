@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+
+# Write-behind buffer for last-seen timestamps (user_prefs.lastlogin).
+# Requests only record (user id, time) in memory; a background thread hands
+# the newest time per user to `write` in one batch every `interval` seconds,
+# or as soon as `max_pending` users are waiting. Losing the buffer (a crash)
+# only costs a few seconds of recency, never a login. A batch that fails
+# `max_retries` flushes in a row is dropped for the same reason, instead of
+# being retried forever when the failure is not going away.
+
+class ActivityBuffer:
+    def __init__(self, write, interval=30, max_pending=1000, max_retries=3):
+        self.write = write
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}
+        self._thread = None
+        self._stopped = False
+        self.recorded = 0
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self.dropped = 0
+        self._failed_in_row = 0
+
+    def record(self, user_id, seen_at=None):
+        seen_at = seen_at or time.time()
+        with self._lock:
+            user_id = int(user_id)
+            if seen_at > self._pending.get(user_id, 0):
+                self._pending[user_id] = seen_at
+            self.recorded += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything recorded so far; returns the number of users written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self.write(batch)
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+                    self._failed_in_row += 1
+                    if self._failed_in_row >= self.max_retries:
+                        self._failed_in_row = 0
+                        self.dropped += len(batch)
+                        logging.error(f"Dropping {len(batch)} last-seen times after {self.max_retries} failed flushes")
+                    else:
+                        # Keep the times for the next flush unless newer ones arrived meanwhile
+                        for user_id, seen_at in batch.items():
+                            if seen_at > self._pending.get(user_id, 0):
+                                self._pending[user_id] = seen_at
+                raise
+            with self._lock:
+                self._failed_in_row = 0
+                self.flushes += 1
+                self.written += len(batch)
+            return len(batch)
+
+    def start(self, context):
+        """Run flush() in a daemon thread every interval seconds, or sooner when max_pending is reached."""
+        def run():
+            while not self._stopped:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                try:
+                    with context():
+                        self.flush()
+                except Exception as e:
+                    logging.warning(f"Activity flush failed: {e}")
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=run, name='activity-writer', daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def shutdown(self, context, timeout=10):
+        """Stop the writer thread and flush what is left."""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with context():
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'recorded': self.recorded,
+                'flushes': self.flushes,
+                'written': self.written,
+                'failures': self.failures,
+                'dropped': self.dropped,
+                'interval': self.interval,
+                'max_pending': self.max_pending,
+            }
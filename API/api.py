@@ -1,23 +1,51 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, abort, g, request, jsonify, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from functools import wraps
 import os
+import datetime
+import json
+import math
+import mimetypes
+import random
+import threading
+import time
 import uuid
 from werkzeug.utils import secure_filename
-from PIL import Image
-import pillow_heif
+from werkzeug.security import safe_join
+from werkzeug.exceptions import NotFound
 import logging
-from sqlalchemy.sql import func
+import atexit
+import click
+from sqlalchemy import select
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import func, case, bindparam, and_, or_
+import numpy as np
+import activity
 import db_config
-
-# Register HEIF opener
-pillow_heif.register_heif_opener()
+import db_routing
+import broker
+import geo
+import hobbies
+import image_pipeline
+import metrics
+import migrations
+import profile_cache
+import recommender
+import serialization
+import streaming
 
 app = Flask(__name__)
 
 # Configure Database
 app.config['SQLALCHEMY_DATABASE_URI'] = db_config.get_database_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+engine_options = {**db_config.get_engine_options(), 'poolclass': db_routing.TimedQueuePool}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+# Read replicas as binds replica0..N with the same pool settings (see replica_read)
+REPLICA_BINDS = {f'replica{i}': {'url': uri, **engine_options} for i, uri in enumerate(db_config.get_replica_uris())}
+app.config['SQLALCHEMY_BINDS'] = REPLICA_BINDS
 
 # Configure Upload Folder
 # Configure Upload Folder
@@ -27,19 +55,158 @@ UPLOAD_FOLDER = os.path.join(basedir, 'static', 'uploads')
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Avatar/card/WebP renditions of each upload
+app.config['VARIANTS_FOLDER'] = os.path.join(UPLOAD_FOLDER, 'variants')
+# Apache/lighttpd offload; send_file then only sets the X-Sendfile header
+app.config['USE_X_SENDFILE'] = db_config.PHOTO_OFFLOAD == 'x-sendfile'
+
+db = SQLAlchemy(app, session_options={'class_': db_routing.RoutingSession})
+
+# jsonify through orjson / MessagePack (see serialization.py)
+if db_config.SERIALIZER == 'fast':
+    app.json = serialization.JSONProvider(app)
 
-db = SQLAlchemy(app)
+# Chat push delivery (see /chat/subscribe)
+chat_broker = broker.create_broker(db_config.CHAT_BROKER, db_config.CHAT_BROKER_DIR)
+
+# Hydrated profiles by user id (see hydrate_profiles)
+cached_profiles = profile_cache.create_cache(db_config.PROFILE_CACHE, db_config.PROFILE_CACHE_DIR,
+                                             db_config.PROFILE_CACHE_SIZE, db_config.PROFILE_CACHE_TTL)
 
 # Authentication
+def valid_api_key(key):
+    return bool(key) and key == db_config.API_KEY
+
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if request.headers.get('x-api-key') and request.headers.get('x-api-key') == db_config.API_KEY:
+        if valid_api_key(request.headers.get('x-api-key')):
             return f(*args, **kwargs)
         else:
             abort(401, description="Invalid or missing API key")
     return decorated_function
 
+# Registered before compress_response so it runs after it: the bytes actually sent
+@app.after_request
+def record_response_size(response):
+    if 'request_start' in g and response.content_length is not None:
+        response_bytes.observe(response.content_length, request.method, metrics_route())
+    return response
+
+# Runs after every other after_request hook but record_response_size (they read the plain body)
+@app.after_request
+def compress_response(response):
+    if db_config.COMPRESS_MIN_BYTES:
+        serialization.compress(response, request.accept_encodings, db_config.COMPRESS_MIN_BYTES)
+    return response
+
+# Read-your-writes: users who wrote recently are read from the primary
+recent_writers = db_routing.RecentWriters(db_config.REPLICA_STICKY_SECONDS, db_config.REPLICA_STICKY_DIR)
+# Request body / route / response keys naming the users a write touched
+WRITE_USER_KEYS = ('user_id', 'source_user_id', 'target_user_id', 'sender_id', 'receiver_id',
+                   'user_id_1', 'user_id_2', 'partner_id')
+
+def replica_read(*user_params):
+    """Serve this GET from a read replica unless one of the users it concerns wrote recently.
+
+    user_params name the route or query arguments holding those user ids.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if REPLICA_BINDS:
+                user_ids = [request.view_args[p] if p in request.view_args else request.args.get(p, type=int)
+                            for p in user_params]
+                if not recent_writers.any_recent([u for u in user_ids if u is not None]):
+                    g.db_replica = random.choice(list(REPLICA_BINDS))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+@app.after_request
+def remember_writers(response):
+    if REPLICA_BINDS and request.method != 'GET' and response.status_code < 400:
+        sources = [request.view_args or {}, request.get_json(silent=True), response.get_json(silent=True)]
+        user_ids = {int(source[key]) for source in sources if isinstance(source, dict)
+                    for key in WRITE_USER_KEYS if str(source.get(key, '')).isdigit()}
+        if user_ids:
+            recent_writers.mark(user_ids)
+    return response
+
+# Per-route request metrics (see metrics.py and /metrics)
+metrics.track_sql()
+registry = metrics.Registry()
+request_seconds = registry.add(metrics.Histogram(
+    'http_request_duration_seconds', 'Time to build the response', ('method', 'route', 'status')))
+response_bytes = registry.add(metrics.Histogram(
+    'http_response_size_bytes', 'Response body size as sent, after compression', ('method', 'route'),
+    metrics.SIZE_BUCKETS))
+response_uncompressed_bytes = registry.add(metrics.Histogram(
+    'http_response_uncompressed_size_bytes', 'Response body size before compression', ('method', 'route'),
+    metrics.SIZE_BUCKETS))
+request_statements = registry.add(metrics.Histogram(
+    'http_request_sql_statements', 'SQL statements per request', ('method', 'route'), metrics.COUNT_BUCKETS))
+request_db_seconds = registry.add(metrics.Histogram(
+    'http_request_db_seconds', 'Time spent in SQL per request', ('method', 'route')))
+image_stage_seconds = registry.add(metrics.Histogram(
+    'image_stage_seconds', 'Upload processing time per stage', ('stage',)))
+image_jobs = registry.add(metrics.Counter('image_jobs_total', 'Finished upload jobs', ('result',)))
+IMAGE_STAGES = ('hash', 'decode', 'resize', 'encode', 'variants', 'write')
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+def metrics_route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' not in g:
+        return response
+    # Bound now: a streamed body runs its SQL after this hook, outside the request context
+    stats, method, path = g._get_current_object(), request.method, request.full_path.rstrip('?')
+    route = metrics_route()
+    status = response.status_code
+
+    def observe():
+        seconds = time.perf_counter() - stats.request_start
+        request_seconds.observe(seconds, method, route, str(status))
+        request_statements.observe(stats.sql_count, method, route)
+        request_db_seconds.observe(stats.sql_ms / 1000, method, route)
+        if seconds * 1000 >= db_config.SLOW_REQUEST_MS:
+            statements = ''.join(f"\n  {ms:7.1f}ms {sql}" for sql, ms in stats.sql_statements)
+            logging.warning(f"Slow request: {method} {path} {status} "
+                            f"{seconds * 1000:.0f}ms, {stats.sql_count} SQL statements in {stats.sql_ms:.0f}ms{statements}")
+
+    # Unknown for streamed bodies
+    if response.content_length is not None:
+        response_uncompressed_bytes.observe(response.content_length, method, route)
+    if response.is_streamed:
+        # Counted once the last chunk is sent, so the duration and SQL cover the whole body
+        response.call_on_close(observe)
+    else:
+        observe()
+    return response
+
+def record_image_job(stats):
+    if stats is None:
+        image_jobs.inc('failed')
+        return
+    image_jobs.inc('duplicate' if 'duplicate' in stats else 'encoded')
+    for stage in IMAGE_STAGES:
+        if f'{stage}_ms' in stats:
+            image_stage_seconds.observe(stats[f'{stage}_ms'] / 1000, stage)
+
+# Image processing runs in a process pool (see image_pipeline.py)
+upload_pipeline = image_pipeline.ImagePipeline(
+    UPLOAD_FOLDER, db_config.UPLOAD_QUEUE_DIR,
+    workers=db_config.IMAGE_WORKERS, max_pending=db_config.IMAGE_QUEUE_SIZE,
+    variants_folder=app.config['VARIANTS_FOLDER'], on_done=record_image_job
+)
+atexit.register(upload_pipeline.shutdown)
+UPLOAD_WAIT_TIMEOUT = 60 # Seconds /upload?wait=true blocks for the result
+
 @app.route("/upload", methods=['POST'])
 @require_api_key
 def upload_file():
@@ -51,64 +218,40 @@ def upload_file():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
         
-    if file:
+    try:
+        # Only the raw bytes are written here; decoding and compression happen in the pool
+        job_id = upload_pipeline.submit(file.save)
+    except image_pipeline.PipelineFull:
+        response = jsonify({"error": "Too many uploads in progress, try again shortly"})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    except Exception as e:
+        return jsonify({"error": f"Upload failed: {str(e)}"}), 500
+
+    if request.args.get('wait') == 'true':
         try:
-            # Generate unique filename
-            unique_id = str(uuid.uuid4())
-            unique_filename = f"{unique_id}.jpg" # Always save as jpg
-            final_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            
-            # Save incoming file to a temporary file first to ensure complete download
-            # and avoid "image file is truncated" errors from Pillow
-            import tempfile
-            fd, temp_path = tempfile.mkstemp()
-            os.close(fd)
-            file.save(temp_path)
-            
-            # Open image using Pillow (handles HEIC via pillow_heif register_opener)
-            img = Image.open(temp_path)
-            img = img.convert("RGB") # Convert to RGB for JPEG compatibility
-            
-            # 1. Resize if too large (max 1920px max dimension)
-            max_dimension = 1920
-            if max(img.size) > max_dimension:
-                ratio = max_dimension / max(img.size)
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # 2. Compress loop to get under 100KB
-            quality = 90
-            target_size = 100 * 1024 # 100KB
-            
-            # Save initially
-            img.save(final_path, "JPEG", quality=quality)
-            
-            # If initial save is too big, apply the 50% resize user permitted
-            if os.path.getsize(final_path) > target_size:
-                # Resize to 50%
-                new_size = (int(img.width * 0.5), int(img.height * 0.5))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-                # Reset quality for the loop
-                quality = 90
-                img.save(final_path, "JPEG", quality=quality)
-
-            # Loop quality reduction if STILL too big
-            while os.path.getsize(final_path) > target_size and quality > 30:
-                quality -= 10
-                img.save(final_path, "JPEG", quality=quality)
-            
-            return jsonify({"filename": unique_filename}), 201
-            
+            filename = upload_pipeline.wait(job_id, UPLOAD_WAIT_TIMEOUT)
+            return jsonify({"filename": filename}), 201
+        except TimeoutError:
+            # Still processing; the client polls /upload/status like a wait=false upload
+            pass
         except Exception as e:
-            if 'final_path' in locals() and os.path.exists(final_path):
-                os.remove(final_path)
             return jsonify({"error": f"Image processing failed: {str(e)}"}), 500
-        finally:
-            # Clean up the temporary file
-            if 'temp_path' in locals() and os.path.exists(temp_path):
-                os.remove(temp_path)
+
+    return jsonify({"job_id": job_id, "status": "processing"}), 202
+
+@app.route("/upload/status/<job_id>", methods=['GET'])
+@require_api_key
+def upload_status(job_id):
+    try:
+        job_id = str(uuid.UUID(job_id))
+    except ValueError:
+        return jsonify({"error": "Invalid job id"}), 400
         
-    return jsonify({"error": "Upload failed"}), 500
+    status = upload_pipeline.status(job_id)
+    if status['status'] == 'unknown':
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job_id": job_id, **status}), 200
 
 # Models
 class User(db.Model):
@@ -120,6 +263,10 @@ class User(db.Model):
     dateofbirth = db.Column(db.Date, nullable=False)
     phonenumber = db.Column(db.String(20))
 
+    __table_args__ = (
+        db.Index('ix_user_phonenumber', 'phonenumber'), # login
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -138,6 +285,16 @@ class UserHobbies(db.Model):
     hobby3 = db.Column(db.Integer)
     hobby4 = db.Column(db.Integer)
     hobby5 = db.Column(db.Integer)
+    # Bit h-1 set for hobby h
+    hobbymask = db.Column(db.Integer().with_variant(mysql.INTEGER(unsigned=True), 'mysql'),
+                          nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_user_hobbies_userid', 'userid'),
+    )
+
+    def sync_mask(self):
+        self.hobbymask = hobbies.mask_of([self.hobby1, self.hobby2, self.hobby3, self.hobby4, self.hobby5])
 
     def to_dict(self):
         return {
@@ -156,6 +313,12 @@ class UserPhotos(db.Model):
     photo4 = db.Column(db.String(255))
     photo5 = db.Column(db.String(255))
 
+    __table_args__ = (
+        db.Index('ix_user_photos_userid', 'userid'),
+        # Reference counts of shared (content addressed) photo files
+        *(db.Index(f'ix_user_photos_photo{i}', f'photo{i}') for i in range(1, 6)),
+    )
+
     def to_dict(self):
         return {
             'photo1': self.photo1, 'photo2': self.photo2,
@@ -170,6 +333,13 @@ class UserLike(db.Model):
     wholikesid = db.Column(db.Integer) # Source User
     likedate = db.Column(db.Date) # Date of like
 
+    __table_args__ = (
+        db.Index('ix_user_like_target', 'userid', 'wholikesid'), # Who liked me, duplicate check
+        db.Index('ix_user_like_liker', 'wholikesid', 'userid'), # Who I liked (explore exclusions)
+        db.Index('ix_user_like_target_date', 'userid', 'likedate', 'wholikesid'), # Liked me feed, newest first
+        db.Index('ix_user_like_liker_date', 'wholikesid', 'likedate', 'userid'), # My likes feed, newest first
+    )
+
 class ChatHistory(db.Model):
     __tablename__ = 'chat_history'
     id = db.Column(db.Integer, primary_key=True)
@@ -178,6 +348,12 @@ class ChatHistory(db.Model):
     message = db.Column(db.String(255))
     datetime = db.Column(db.DateTime, default=func.now())
 
+    __table_args__ = (
+        # Either direction of a pair, paged by id (history is keyset paginated on id)
+        db.Index('ix_chat_history_pair', 'userid1', 'userid2', 'id'),
+        db.Index('ix_chat_history_pair_rev', 'userid2', 'userid1', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -187,6 +363,31 @@ class ChatHistory(db.Model):
             'datetime': self.datetime.isoformat() if self.datetime else None
         }
 
+class Conversation(db.Model):
+    # One summary row per chat pair, kept up to date by send_message/start_chat
+    # so /chat/list is a single indexed query instead of scanning chat_history
+    __tablename__ = 'conversation'
+    id = db.Column(db.Integer, primary_key=True)
+    userid1 = db.Column(db.Integer, nullable=False) # Lower user id of the pair
+    userid2 = db.Column(db.Integer, nullable=False) # Higher user id of the pair
+    lastmessageid = db.Column(db.Integer)
+    lastmessage = db.Column(db.String(255))
+    lastmessagetime = db.Column(db.DateTime)
+    unread1 = db.Column(db.Integer, nullable=False, default=0) # Unread by userid1
+    unread2 = db.Column(db.Integer, nullable=False, default=0) # Unread by userid2
+
+    __table_args__ = (
+        db.UniqueConstraint('userid1', 'userid2', name='uq_conversation_pair'),
+        db.Index('ix_conversation_user1_time', 'userid1', 'lastmessagetime'),
+        db.Index('ix_conversation_user2_time', 'userid2', 'lastmessagetime'),
+    )
+
+    def partner_of(self, user_id):
+        return self.userid2 if self.userid1 == user_id else self.userid1
+
+    def unread_for(self, user_id):
+        return self.unread1 if self.userid1 == user_id else self.unread2
+
 class UserPrefs(db.Model):
     __tablename__ = 'user_prefs'
     id = db.Column(db.Integer, primary_key=True)
@@ -208,6 +409,10 @@ class UserPrefs(db.Model):
     lastlogin = db.Column(db.DateTime)
     bondedwith = db.Column(db.Integer) # ID of the user they are bonded with (Exclusive)
 
+    __table_args__ = (
+        db.Index('uq_user_prefs_userid', 'userid', unique=True),
+    )
+
     # Handling spatial POINT can be complex. 
     # For now we'll imply it is managed/inserted via raw API or added later. 
     # To fully support it, we'd need GeoAlchemy2.
@@ -226,36 +431,306 @@ class UserPrefs(db.Model):
             'bondedwith': self.bondedwith
         }
 
+class UserVersion(db.Model):
+    # Per-user change counters behind the ETags of /users/<id>, /chat/list and /matches.
+    # Bumped in the same transaction as the write (see bump_versions).
+    __tablename__ = 'user_version'
+    userid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    profile = db.Column(db.Integer, nullable=False, default=0) # User, prefs, hobbies, photos, bond
+    chats = db.Column(db.Integer, nullable=False, default=0) # Conversations and unread counts
+    likes = db.Column(db.Integer, nullable=False, default=0) # Likes given and received
+
+# Conditional GETs
+# Reads answer If-None-Match from one query over user_version; the response
+# is only built (and hydrated) when the client's copy is out of date.
+VERSION_KINDS = ('profile', 'chats', 'likes')
+
+# The statements are shared with the async app (asgi.py), which runs them on its own sessions.
+def version_bump(kind, user_ids):
+    return UserVersion.__table__.update().where(UserVersion.userid.in_(user_ids)).values(
+        {kind: getattr(UserVersion, kind) + 1})
+
+def new_version_rows(kind, user_ids, existing):
+    # Users created before user_version (or by bulk loads) get their row on the first bump
+    return [{**dict.fromkeys(VERSION_KINDS, 0), 'userid': u, kind: 1} for u in user_ids if u not in existing]
+
+def bump_versions(kind, *user_ids):
+    """Add one to the kind counter of each user; part of the caller's transaction."""
+    user_ids = sorted({int(u) for u in user_ids if u})
+    for chunk in _chunks(user_ids):
+        if db.session.execute(version_bump(kind, chunk)).rowcount < len(chunk):
+            existing = set(db.session.scalars(select(UserVersion.userid).where(UserVersion.userid.in_(chunk))))
+            rows = new_version_rows(kind, chunk, existing)
+            if rows:
+                db.session.execute(UserVersion.__table__.insert(), rows)
+
+def user_versions_select(user_id):
+    # The bonded partner's name is part of the profile response, so their version is too
+    partner_version = aliased(UserVersion)
+    return (select(UserVersion.profile, partner_version.profile).select_from(User)
+            .outerjoin(UserVersion, UserVersion.userid == User.id)
+            .outerjoin(UserPrefs, UserPrefs.userid == User.id)
+            .outerjoin(partner_version, partner_version.userid == UserPrefs.bondedwith)
+            .where(User.id == user_id))
+
+def chat_list_versions_select(user_id):
+    # My chats version plus the profile versions of everyone I chat with
+    partner = case((Conversation.userid1 == user_id, Conversation.userid2), else_=Conversation.userid1)
+    partner_version = aliased(UserVersion)
+    own = select(UserVersion.chats).where(UserVersion.userid == user_id).scalar_subquery()
+    return (select(own, func.sum(partner_version.profile)).select_from(Conversation)
+            .join(partner_version, partner_version.userid == partner).where(user_conversations(user_id)))
+
+def matches_versions_select(user_id, limit):
+    # My likes version plus the profile versions of everyone on the two first pages
+    versions = [select(UserVersion.likes).where(UserVersion.userid == user_id).scalar_subquery()]
+    for feed, (_, other) in LIKE_FEEDS.items():
+        page = like_feed_select(feed, user_id).limit(limit).subquery()
+        versions.append(select(func.sum(UserVersion.profile)).select_from(page)
+                        .join(UserVersion, UserVersion.userid == page.c[other.key]).scalar_subquery())
+    return select(*versions)
+
+def version_etag(*parts, msgpack=None):
+    # The same versions serialize differently as MessagePack
+    if msgpack is None:
+        msgpack = serialization.wants_msgpack()
+    if msgpack:
+        parts += ('msgpack',)
+    return '-'.join('0' if p is None else str(p) for p in parts)
+
+def not_modified(etag):
+    """A 304 response when the request's If-None-Match already names etag, else None."""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(app.response_class(status=304), etag)
+
+def with_etag(response, etag):
+    if etag is None:
+        return response
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Profile hydration
+# Card dicts (user + hobbies + photos + prefs) are built for a whole set of ids
+# at once: one IN query per table instead of three lookups per user.
+HYDRATION_BATCH_SIZE = 500
+
+def _chunks(ids, size=HYDRATION_BATCH_SIZE):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+def _first_by_userid(model, user_ids):
+    # Same row that .filter_by(userid=...).first() would pick (lowest id)
+    rows = {}
+    for chunk in _chunks(user_ids):
+        for row in model.query.filter(model.userid.in_(chunk)).order_by(model.id.asc()):
+            rows.setdefault(row.userid, row)
+    return rows
+
+PROFILE_RELATED = ('hobbies', 'photos', 'prefs')
+
+def _build_profiles(user_ids, users=None):
+    if users is None:
+        users = []
+        for chunk in _chunks(user_ids):
+            users.extend(User.query.filter(User.id.in_(chunk)).all())
+    related = {
+        'hobbies': _first_by_userid(UserHobbies, user_ids),
+        'photos': _first_by_userid(UserPhotos, user_ids),
+        'prefs': _first_by_userid(UserPrefs, user_ids),
+    }
+    return assemble_profiles(user_ids, users, related)
+
+def assemble_profiles(user_ids, users, related):
+    """{user id: card dict} from loaded User rows and {table key: {user id: row}}."""
+    users_by_id = {u.id: u for u in users}
+    built = {}
+    for uid in user_ids:
+        user = users_by_id.get(uid)
+        if not user:
+            continue
+        u_dict = user.to_dict()
+        for key, rows in related.items():
+            row = rows.get(uid)
+            if row: u_dict[key] = row.to_dict()
+        built[uid] = u_dict
+    return built
+
+def hydrate_profiles(user_ids, users=None, include=PROFILE_RELATED):
+    """Return card dicts for user_ids (in the given order), skipping unknown ids.
+
+    Full profiles are read through the profile cache; `include` only picks
+    which related tables end up in the result. Pass already loaded User rows
+    as `users` to avoid fetching them again on a miss.
+    """
+    user_ids = list(dict.fromkeys(int(i) for i in user_ids))
+    if not user_ids:
+        return []
+
+    states = profile_states(user_ids)
+    found = fresh_profiles(user_ids, states)
+    missing = [uid for uid in user_ids if uid not in found]
+    if missing:
+        built = _build_profiles(missing, users)
+        if not g.get('db_replica'):
+            # A lagging replica must not refill the cache a recent writer reads through
+            cache_profiles(built, states)
+        found.update(built)
+
+    return profile_views(user_ids, found, include)
+
+# Cache entries are {'version': user_version.profile, 'profile': card dict}.
+# The versions are read before a miss is built, so a write committed while
+# it is being built leaves an entry that is already behind and gets rebuilt.
+# Every worker compares against the database, which keeps per-process
+# (memory) caches correct too; invalidate() only frees an entry early.
+# prefs.lastlogin only bumps the version once per LAST_SEEN_RESOLUTION window
+# (see write_last_seen): it is read with the version and patched into cached profiles.
+
+def profile_states_select(user_ids):
+    return (select(UserVersion.userid, UserVersion.profile, UserPrefs.lastlogin)
+            .outerjoin(UserPrefs, UserPrefs.userid == UserVersion.userid)
+            .where(UserVersion.userid.in_(user_ids)))
+
+def profile_state_rows(rows):
+    return {uid: (version, lastlogin) for uid, version, lastlogin in rows}
+
+def profile_states(user_ids):
+    """{user id: (profile version, lastlogin)}; nothing to check against when the cache is off."""
+    states = {}
+    if cached_profiles.max_entries:
+        for chunk in _chunks(user_ids):
+            states.update(profile_state_rows(db.session.execute(profile_states_select(chunk))))
+    return states
+
+def fresh_profiles(user_ids, states):
+    """{user id: card dict} of cached profiles still at their current version, with current lastlogin."""
+    if not states:
+        return {}
+    found = {}
+    for uid, entry in cached_profiles.get_many([uid for uid in user_ids if uid in states]).items():
+        version, lastlogin = states[uid]
+        if entry.get('version') != version:
+            continue
+        profile = entry['profile']
+        if profile.get('prefs'):
+            profile = {**profile, 'prefs': {**profile['prefs'],
+                                            'lastlogin': lastlogin.isoformat() if lastlogin else None}}
+        found[uid] = profile
+    return found
+
+def cache_profiles(built, states):
+    cached_profiles.set_many({uid: {'version': states[uid][0], 'profile': profile}
+                              for uid, profile in built.items() if uid in states})
+
+def profile_views(user_ids, found, include):
+    results = []
+    for uid in user_ids:
+        profile = found.get(uid)
+        if profile is None:
+            continue
+        # Copies, callers add their own keys (distance_km, bonded_partner_name...)
+        results.append({key: dict(value) if isinstance(value, dict) else value
+                        for key, value in profile.items()
+                        if key not in PROFILE_RELATED or key in include})
+    return results
+
 # Routes
 @app.route("/users", methods=['GET'])
 @require_api_key
 def get_users():
+    # NDJSON (?format=ndjson) lists every user, streamed for bulk consumers
+    if streaming.wants_ndjson():
+        return streaming.stream((u.to_dict() for u in User.query.order_by(User.id).yield_per(streaming.CHUNK_ROWS)),
+                                as_ndjson=True)
     users = User.query.limit(20).all()
     return jsonify([u.to_dict() for u in users])
 
 @app.route("/users/<int:user_id>", methods=['GET'])
 @require_api_key
+@replica_read('user_id')
 def get_user(user_id):
-    user = User.query.get(user_id)
-    if not user:
+    versions = db.session.execute(user_versions_select(user_id)).first()
+    etag = version_etag('user', user_id, *versions) if versions else None
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    profiles = hydrate_profiles([user_id])
+    if not profiles:
         return jsonify({"error": "User not found"}), 404
     
-    # Optional: fetch related data
-    hobbies = UserHobbies.query.filter_by(userid=user_id).first()
-    photos = UserPhotos.query.filter_by(userid=user_id).first()
-    prefs = UserPrefs.query.filter_by(userid=user_id).first()
+    data = profiles[0]
+    prefs = data.get('prefs')
+    if prefs and prefs['bondedwith']:
+        partner = User.query.get(prefs['bondedwith'])
+        if partner:
+            data['bonded_partner_name'] = partner.name
     
-    data = user.to_dict()
-    if hobbies: data['hobbies'] = hobbies.to_dict()
-    if photos: data['photos'] = photos.to_dict()
-    if prefs: 
-        data['prefs'] = prefs.to_dict()
-        if prefs.bondedwith:
-            partner = User.query.get(prefs.bondedwith)
-            if partner:
-                data['bonded_partner_name'] = partner.name
-    
-    return jsonify(data)
+    return with_etag(jsonify(data), etag)
+
+# Last seen times, written behind in batches instead of on every request
+def last_seen_window(seen):
+    return int(seen.timestamp() // db_config.LAST_SEEN_RESOLUTION)
+
+def write_last_seen(batch):
+    """UPDATE user_prefs.lastlogin for {user_id: unix time}.
+
+    Users without a prefs row (not onboarded, or deleted since) are skipped.
+    The profile version is only bumped when lastlogin moves into a new
+    LAST_SEEN_RESOLUTION window, so ETags showing lastlogin (/users/<id>,
+    /matches) change that often at most, and a 304 carries a lastlogin about
+    one window old at worst. hydrate_profiles patches the current value into
+    cached profiles.
+    """
+    from datetime import datetime
+    updates = [{'uid': user_id, 'seen': datetime.fromtimestamp(t)} for user_id, t in sorted(batch.items())]
+    moved = []
+    for chunk in _chunks(updates):
+        stored = dict(db.session.execute(select(UserPrefs.userid, UserPrefs.lastlogin)
+                                         .where(UserPrefs.userid.in_([u['uid'] for u in chunk]))).all())
+        moved += [u['uid'] for u in chunk if u['uid'] in stored
+                  and (stored[u['uid']] is None or last_seen_window(stored[u['uid']]) < last_seen_window(u['seen']))]
+        db.session.execute(
+            UserPrefs.__table__.update()
+            .where(UserPrefs.userid == bindparam('uid'),
+                   or_(UserPrefs.lastlogin.is_(None), UserPrefs.lastlogin < bindparam('seen')))
+            .values(lastlogin=bindparam('seen')),
+            chunk)
+    bump_versions('profile', *moved)
+    db.session.commit()
+
+activity_buffer = activity.ActivityBuffer(write_last_seen, db_config.ACTIVITY_FLUSH_INTERVAL,
+                                          db_config.ACTIVITY_FLUSH_SIZE)
+atexit.register(activity_buffer.shutdown, app.app_context)
+# Request keys naming the user making the call
+ACTIVE_USER_KEYS = ('current_user_id', 'source_user_id', 'sender_id', 'user_id')
+
+def record_activity(user_id):
+    activity_buffer.start(app.app_context)
+    activity_buffer.record(user_id)
+
+def active_user(sources):
+    """The user making the call, from the first of sources (query args, JSON body, route args) naming one."""
+    for source in sources:
+        if not hasattr(source, 'get'):
+            continue
+        user_id = next((source.get(key) for key in ACTIVE_USER_KEYS if str(source.get(key, '')).isdigit()), None)
+        if user_id is not None:
+            return user_id
+    return None
+
+@app.after_request
+def remember_activity(response):
+    if response.status_code < 400 and request.endpoint not in ('login', 'delete_user'):
+        sources = [request.args, request.get_json(silent=True)]
+        if request.method != 'GET':
+            sources.append(request.view_args or {})
+        user_id = active_user(sources)
+        if user_id is not None:
+            record_activity(user_id)
+    return response
 
 @app.route("/login", methods=['POST'])
 @require_api_key
@@ -275,16 +750,8 @@ def login():
         pwd_hash = hashlib.sha512(password.encode('utf-8')).digest()
         
         if pwd_hash == user.passwordhash:
-             # Update Last Login
-             from datetime import datetime
-             prefs = UserPrefs.query.filter_by(userid=user.id).first()
-             if prefs:
-                 prefs.lastlogin = datetime.now()
-             else:
-                 prefs = UserPrefs(userid=user.id, lastlogin=datetime.now())
-                 db.session.add(prefs)
-             
-             db.session.commit()
+             # Last login is written in the background (see write_last_seen)
+             record_activity(user.id)
 
              return jsonify({
                 "message": "Login successful", 
@@ -295,18 +762,21 @@ def login():
     else:
         return jsonify({"error": "User not found"}), 404
 
-@app.route("/explore", methods=['GET'])
-@require_api_key
-def explore_users():
-    current_user_id = request.args.get('current_user_id')
-    if not current_user_id:
-        return jsonify({"error": "Missing current_user_id"}), 400
-    
-    # Check if I am bonded
-    my_prefs = UserPrefs.query.filter_by(userid=current_user_id).first()
-    if my_prefs and my_prefs.bondedwith:
-        return jsonify({"message": "You are bonded!", "users": []}), 200 # Return empty list if bonded
-    
+EXPLORE_LIMIT = 30 # Cards per deck
+EXPLORE_DEFAULT_RADIUS_KM = 100 # Used for sort=distance without radius_km
+EXPLORE_MAX_RADIUS_KM = 500
+LOCATION_INDEX_TTL = 300 # Seconds before the grid index is reloaded from user_prefs
+
+# Grid index for radius queries on databases without spatial support
+location_index = geo.GridIndex()
+
+def get_location_index():
+    # Rebuilt periodically so locations written by other workers show up
+    if location_index.built_at is None or time.monotonic() - location_index.built_at > LOCATION_INDEX_TTL:
+        location_index.rebuild(db.session.query(UserPrefs.userid, UserPrefs.latitude, UserPrefs.longitude))
+    return location_index
+
+def explore_exclusions(current_user_id):
     # Logic: Get users who I haven't liked yet, and exclude myself
     # Access: userid (Target), wholikesid (Me)
     
@@ -319,41 +789,297 @@ def explore_users():
     received_from = db.session.query(ChatHistory.userid1).filter(ChatHistory.userid2 == current_user_id)
     
     # Subquery: Users who are BONDED (exclude them)
-    bonded_users = db.session.query(UserPrefs.userid).filter(UserPrefs.bondedwith != None)
+    # Correlated, so each candidate is one user_prefs.userid index lookup
+    # instead of collecting every bonded user first
+    bonded = db.exists().where(UserPrefs.userid == User.id, UserPrefs.bondedwith != None)
     
-    # Query: Users NOT in liked_subquery AND NOT in chat history AND NOT me AND NOT bonded
-    users = User.query.filter(
+    # Users NOT in liked_subquery AND NOT in chat history AND NOT me AND NOT bonded
+    return [
         User.id != current_user_id,
         ~User.id.in_(liked_subquery),
         ~User.id.in_(sent_to),
         ~User.id.in_(received_from),
-        ~User.id.in_(bonded_users)
-    ).order_by(func.random()).limit(30).all() # Limit to prevent overload
+        ~bonded
+    ]
+
+EXPLORE_SAMPLE_PROBES = 6 # Random pivots per deck, see explore_random_sample
+
+def explore_random_sample(exclusions, limit=EXPLORE_LIMIT):
+    """Random eligible users without ORDER BY RAND().
+
+    Picks random pivots in the primary key range and reads a short run of
+    eligible users from each (an index range scan), so the cost grows with
+    the deck size rather than with the user count. Users right after id gaps
+    are slightly favoured.
+    """
+    # Separate statements: a lone MIN()/MAX() is answered from the primary key
+    lo = db.session.query(func.min(User.id)).scalar()
+    hi = db.session.query(func.max(User.id)).scalar()
+    if lo is None:
+        return []
+    run = -(-limit // EXPLORE_SAMPLE_PROBES)
+
+    picked = {}
+    for _ in range(EXPLORE_SAMPLE_PROBES * 2):
+        if len(picked) >= limit:
+            break
+        pivot = random.randint(lo, hi)
+        rows = User.query.filter(User.id >= pivot, *exclusions).order_by(User.id).limit(run).all()
+        if len(rows) < run:
+            # Wrap around to the start of the id range
+            rows += User.query.filter(User.id < pivot, *exclusions).order_by(User.id).limit(run - len(rows)).all()
+        for user in rows:
+            picked.setdefault(user.id, user)
+
+    if len(picked) < limit:
+        # Few eligible users left (probes keep hitting the same ones): take whatever remains
+        rest = User.query.filter(*exclusions, ~User.id.in_(list(picked))).limit(limit - len(picked)).all()
+        for user in rest:
+            picked[user.id] = user
+
+    users = list(picked.values())[:limit]
+    random.shuffle(users)
+    return users
+
+# Recommendation queues
+def load_recommendation_rows(user_ids=None):
+    query = db.session.query(
+        User.id, UserPrefs.gender, UserPrefs.genderinterest, UserPrefs.relationshipinterest,
+        UserPrefs.religion, UserPrefs.is_smoke, UserPrefs.is_drink,
+        UserPrefs.latitude, UserPrefs.longitude, UserPrefs.lastlogin, UserPrefs.bondedwith,
+        UserHobbies.hobbymask
+    ).outerjoin(UserPrefs, UserPrefs.userid == User.id).outerjoin(UserHobbies, UserHobbies.userid == User.id)
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+
+    rows = {}
+    for r in query.order_by(User.id, UserPrefs.id, UserHobbies.id):
+        rows.setdefault(r[0], tuple(r))
+    return list(rows.values())
+
+def load_recommendation_exclusions(user_id):
+    liked = db.session.query(UserLike.userid).filter(UserLike.wholikesid == user_id)
+    sent_to = db.session.query(ChatHistory.userid2).filter(ChatHistory.userid1 == user_id)
+    received_from = db.session.query(ChatHistory.userid1).filter(ChatHistory.userid2 == user_id)
+    return {r[0] for r in liked.union(sent_to, received_from)}
+
+recommendations = recommender.RecommendationQueues(load_recommendation_rows, load_recommendation_exclusions)
+_recommendation_worker = None
+_recommendation_worker_lock = threading.Lock()
+
+def ensure_recommendation_worker():
+    global _recommendation_worker
+    with _recommendation_worker_lock:
+        if _recommendation_worker is None:
+            _recommendation_worker = recommendations.start(app.app_context, db_config.RECOMMENDER_INTERVAL)
+
+def explore_recommended(exclusions, current_user_id):
+    """Next cards from the user's ranked queue, topped up with random users while it builds."""
+    ensure_recommendation_worker()
+    ids = recommendations.pop(current_user_id, EXPLORE_LIMIT)
+    # Queued ids can be stale (liked or bonded since), so the exclusions still apply
+    users = User.query.filter(User.id.in_(ids), *exclusions).all() if ids else []
+    order = {uid: i for i, uid in enumerate(ids)}
+    users.sort(key=lambda u: order[u.id])
+    if len(users) < EXPLORE_LIMIT:
+        seen = [u.id for u in users]
+        users += explore_random_sample(exclusions + [~User.id.in_(seen)], EXPLORE_LIMIT - len(users))
+    return users
+
+HOBBY_MATRIX_TTL = 300 # Seconds before hobby masks are reloaded from user_hobbies
+
+# Every user's hobby mask, for min_shared_hobbies / sort=hobbies
+hobby_matrix = hobbies.HobbyMatrix()
+
+def get_hobby_matrix():
+    if hobby_matrix.built_at is None or time.monotonic() - hobby_matrix.built_at > HOBBY_MATRIX_TTL:
+        # Users without a user_hobbies row get mask 0, so min_shared_hobbies=0 still finds them
+        hobby_matrix.rebuild(db.session.query(User.id, UserHobbies.hobbymask)
+                             .outerjoin(UserHobbies, UserHobbies.userid == User.id).order_by(UserHobbies.id))
+    return hobby_matrix
+
+def eligible_users(candidate_ids, exclusions, limit=EXPLORE_LIMIT):
+    """Users among candidate_ids (best first) that pass the exclusions, at most limit, in the same order."""
+    users = []
+    for chunk in _chunks(candidate_ids):
+        found = {u.id: u for u in User.query.filter(User.id.in_(chunk), *exclusions)}
+        users.extend(found[uid] for uid in chunk if uid in found)
+        if len(users) >= limit:
+            break
+    return users[:limit]
+
+def explore_by_hobbies(exclusions, my_mask, min_shared, by_hobbies, nearby=None):
+    """[(User, shared count)] sharing at least min_shared hobbies, best Jaccard first when by_hobbies.
+
+    nearby ({user_id: distance_km}) restricts the candidates to a radius.
+    """
+    ids, shared, jaccard = get_hobby_matrix().similar(my_mask, min_shared)
+    if nearby is not None:
+        inside = np.isin(ids, list(nearby))
+        ids, shared, jaccard = ids[inside], shared[inside], jaccard[inside]
+    if by_hobbies:
+        order = np.lexsort((-shared, -jaccard))
+    else:
+        order = np.random.permutation(len(ids))
+    shared_by_id = dict(zip(ids.tolist(), shared.tolist()))
+    users = eligible_users(ids[order].tolist(), exclusions)
+    return [(u, shared_by_id[u.id]) for u in users]
+
+# user_prefs.geolocation is a MySQL POINT (migration 7) the models cannot
+# declare without GeoAlchemy2, so user_prefs rows are written through these.
+def insert_prefs(rows):
+    """Insert user_prefs rows (dicts of column values); on MySQL geolocation comes from latitude/longitude."""
+    columns = sorted({key for row in rows for key in row})
+    rows = [{**dict.fromkeys(columns), **row} for row in rows]
+    if db.engine.dialect.name != 'mysql':
+        db.session.execute(UserPrefs.__table__.insert(), rows)
+        return
+    # One multi-row INSERT: the driver cannot batch an executemany with a function in VALUES
+    values, params = [], {}
+    for n, row in enumerate(rows):
+        values.append(f"({', '.join(f':{c}_{n}' for c in columns)}, ST_GeomFromText(:pt_{n}, 4326))")
+        params.update({f'{c}_{n}': row[c] for c in columns})
+        params[f'pt_{n}'] = geo.point_wkt(row.get('latitude') or 0.0, row.get('longitude') or 0.0)
+    db.session.execute(db.text(f"INSERT INTO user_prefs ({', '.join(columns)}, geolocation) VALUES {', '.join(values)}"),
+                       params)
+
+def update_geolocation(user_id, lat, lon):
+    if db.engine.dialect.name == 'mysql':
+        db.session.execute(db.text("UPDATE user_prefs SET geolocation = ST_GeomFromText(:pt, 4326) WHERE userid = :userid"),
+                           {'pt': geo.point_wkt(lat or 0.0, lon or 0.0), 'userid': user_id})
+
+def spatial_within(lat, lon, radius_km):
+    """(distance_km expression, filters) on user_prefs for MySQL's SPATIAL index.
+
+    The index on geolocation narrows to the bounding box, then exact sphere distance.
+    SRID 4326 points are stored as POINT(lat lon), see create_user.
+    """
+    min_lat, min_lon, max_lat, max_lon = geo.bounding_box(lat, lon, radius_km)
+    box = f'POLYGON(({min_lat} {min_lon}, {max_lat} {min_lon}, {max_lat} {max_lon}, ' \
+          f'{min_lat} {max_lon}, {min_lat} {min_lon}))'
+    geolocation = db.literal_column('user_prefs.geolocation')
+    distance = func.ST_Distance_Sphere(geolocation, func.ST_GeomFromText(geo.point_wkt(lat, lon), 4326)) / 1000
+    return distance, (func.MBRContains(func.ST_GeomFromText(box, 4326), geolocation), distance <= radius_km)
+
+def users_within(lat, lon, radius_km):
+    """{user_id: distance_km} of everyone within radius_km of (lat, lon)."""
+    if db.engine.dialect.name == 'mysql':
+        distance, filters = spatial_within(lat, lon, radius_km)
+        return {uid: float(d) for uid, d in db.session.query(UserPrefs.userid, distance).filter(*filters)}
+    return dict(get_location_index().within(lat, lon, radius_km))
+
+def explore_nearby(exclusions, lat, lon, radius_km, by_distance):
+    """[(User, distance_km)] within radius_km of (lat, lon), at most EXPLORE_LIMIT."""
+    if db.engine.dialect.name == 'mysql':
+        distance, filters = spatial_within(lat, lon, radius_km)
+        query = db.session.query(User, distance).join(UserPrefs, UserPrefs.userid == User.id) \
+            .filter(*exclusions, *filters)
+        query = query.order_by(distance if by_distance else func.random())
+        return [(user, float(d)) for user, d in query.limit(EXPLORE_LIMIT)]
+
+    # Grid index: candidates come back nearest first, the DB only applies the exclusions
+    candidates = get_location_index().within(lat, lon, radius_km)
+    distances = dict(candidates)
+    ids = [uid for uid, _ in candidates]
+    if not by_distance:
+        random.shuffle(ids)
+    return [(u, distances[u.id]) for u in eligible_users(ids, exclusions)]
+
+@app.route("/explore", methods=['GET'])
+@require_api_key
+@replica_read('current_user_id')
+def explore_users():
+    current_user_id = request.args.get('current_user_id')
+    if not current_user_id:
+        return jsonify({"error": "Missing current_user_id"}), 400
+    if not current_user_id.isdigit():
+        return jsonify({"error": "Invalid current_user_id"}), 400
+    current_user_id = int(current_user_id)
     
-    results = []
-    for user in users:
-        # Construct full profile for card
-        hobbies = UserHobbies.query.filter_by(userid=user.id).first()
-        photos = UserPhotos.query.filter_by(userid=user.id).first()
-        prefs = UserPrefs.query.filter_by(userid=user.id).first()
-        
-        u_dict = user.to_dict()
-        if hobbies: u_dict['hobbies'] = hobbies.to_dict()
-        if photos: u_dict['photos'] = photos.to_dict()
-        if prefs: u_dict['prefs'] = prefs.to_dict()
-        results.append(u_dict)
+    # Check if I am bonded
+    my_prefs = UserPrefs.query.filter_by(userid=current_user_id).first()
+    if my_prefs and my_prefs.bondedwith:
+        return jsonify({"message": "You are bonded!", "users": []}), 200 # Return empty list if bonded
+
+    # Optional location mode: radius_km and/or sort=distance
+    radius_km = request.args.get('radius_km', type=float)
+    # float() also takes nan and inf, which would slip past the cap below
+    if radius_km is not None and not (math.isfinite(radius_km) and radius_km > 0):
+        return jsonify({"error": "radius_km must be positive"}), 400
+    by_distance = request.args.get('sort') == 'distance'
+    my_location = (my_prefs.latitude, my_prefs.longitude) if my_prefs else (None, None)
+    # Optional hobby mode: min_shared_hobbies and/or sort=hobbies
+    min_shared = request.args.get('min_shared_hobbies', type=int)
+    by_hobbies = request.args.get('sort') == 'hobbies'
+    
+    exclusions = explore_exclusions(current_user_id)
+    
+    if radius_km is not None or by_distance:
+        if not geo.has_location(*my_location):
+            return jsonify({"error": "Your location is not set"}), 400
+        radius_km = min(radius_km if radius_km is not None else EXPLORE_DEFAULT_RADIUS_KM, EXPLORE_MAX_RADIUS_KM)
+    
+    distances = {}
+    shared_hobbies = {}
+    if min_shared is not None or by_hobbies:
+        my_hobbies = UserHobbies.query.filter_by(userid=current_user_id).first()
+        my_mask = my_hobbies.hobbymask if my_hobbies else 0
+        nearby = None
+        if radius_km is not None:
+            nearby = users_within(my_location[0], my_location[1], radius_km)
+            distances = nearby
+        matches = explore_by_hobbies(exclusions, my_mask, max(min_shared or 0, 0), by_hobbies, nearby)
+        users = [u for u, _ in matches]
+        shared_hobbies = {u.id: n for u, n in matches}
+    elif radius_km is not None:
+        nearby = explore_nearby(exclusions, my_location[0], my_location[1], radius_km, by_distance)
+        users = [u for u, _ in nearby]
+        distances = {u.id: d for u, d in nearby}
+    elif db_config.RECOMMENDER_ENABLED and request.args.get('sort') != 'random':
+        users = explore_recommended(exclusions, current_user_id)
+    else:
+        users = explore_random_sample(exclusions)
+    
+    # Construct full profile for each card
+    results = hydrate_profiles([u.id for u in users], users=users)
+    for card in results:
+        distance = distances.get(card['id'])
+        prefs = card.get('prefs')
+        if distance is None and prefs and geo.has_location(*my_location) \
+                and geo.has_location(prefs['latitude'], prefs['longitude']):
+            distance = geo.haversine_km(my_location[0], my_location[1], prefs['latitude'], prefs['longitude'])
+        if distance is not None:
+            card['distance_km'] = round(distance, 1)
+        if card['id'] in shared_hobbies:
+            card['shared_hobbies'] = shared_hobbies[card['id']]
         
     return jsonify(results), 200
 
+# Request body ids, shared with the async app (asgi.py)
+def body_ids(data, keys, missing):
+    """Ints for keys of a JSON body; raises ValueError with the 400 message for a missing or non-numeric id."""
+    values = [data.get(key) for key in keys] if isinstance(data, dict) else [None] * len(keys)
+    if not all(values):
+        raise ValueError(missing)
+    if not all(str(v).isdigit() for v in values):
+        raise ValueError(f"Invalid {' or '.join(keys)}")
+    return [int(v) for v in values]
+
+def like_ids(data):
+    """(target_user_id, source_user_id) of a /like or /like/remove body."""
+    return body_ids(data, ('target_user_id', 'source_user_id'), "Missing IDs")
+
+def chat_read_ids(data):
+    """(user_id, partner_id) of a /chat/read body."""
+    return body_ids(data, ('user_id', 'partner_id'), "Missing user ids")
+
 @app.route("/like", methods=['POST'])
 @require_api_key
 def like_user():
-    data = request.json
-    target_id = data.get('target_user_id')
-    source_id = data.get('source_user_id')
-    
-    if not target_id or not source_id:
-        return jsonify({"error": "Missing IDs"}), 400
+    try:
+        target_id, source_id = like_ids(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
         
     # Check if target is bonded
     target_prefs = UserPrefs.query.filter_by(userid=target_id).first()
@@ -382,10 +1108,106 @@ def like_user():
     else:
         new_like = UserLike(userid=target_id, wholikesid=source_id, likedate=func.current_date())
         db.session.add(new_like)
+        bump_versions('likes', source_id, target_id)
         db.session.commit()
+        recommendations.discard(source_id, target_id)
     
     return jsonify({"message": "Liked", "match": False}), 200
 
+LIKE_BATCH_MAX = 200
+
+@app.route("/like/batch", methods=['POST'])
+@require_api_key
+def like_batch():
+    """Apply many swipes at once: {"source_user_id", "swipes": [{"target_user_id", "action": "like"|"pass"}]}.
+
+    Same outcomes as /like per target, resolved with set-based queries in one
+    transaction. Results come back in request order.
+    """
+    data = request.json or {}
+    source_id = data.get('source_user_id')
+    swipes = data.get('swipes')
+    if not source_id or not isinstance(swipes, list):
+        return jsonify({"error": "Missing source_user_id or swipes"}), 400
+    if len(swipes) > LIKE_BATCH_MAX:
+        return jsonify({"error": f"At most {LIKE_BATCH_MAX} swipes per batch"}), 400
+    if not str(source_id).isdigit():
+        return jsonify({"error": "Invalid source_user_id"}), 400
+    source_id = int(source_id)
+
+    results, pending, seen = [], {}, set()
+    for swipe in swipes:
+        target_id = swipe.get('target_user_id') if isinstance(swipe, dict) else None
+        action = swipe.get('action', 'like') if isinstance(swipe, dict) else None
+        if not str(target_id).isdigit() or int(target_id) == source_id or action not in ('like', 'pass'):
+            results.append({"target_user_id": target_id, "result": "invalid"})
+            continue
+        target_id = int(target_id)
+        result = {"target_user_id": target_id}
+        results.append(result)
+        # Offline queues can replay a swipe; the first one for a target counts
+        if target_id in seen:
+            result["result"] = "duplicate"
+            continue
+        seen.add(target_id)
+        if action == 'pass':
+            result["result"] = "passed"
+        else:
+            pending[target_id] = result
+
+    # 1. Existence and bonded status of everyone involved
+    bonded = dict(db.session.query(User.id, UserPrefs.bondedwith)
+                  .outerjoin(UserPrefs, UserPrefs.userid == User.id)
+                  .filter(User.id.in_([source_id, *pending])).all())
+    if bonded.get(source_id):
+        return jsonify({"error": "You are bonded"}), 403
+
+    # 2. Likes between the source and the targets, both directions
+    liked, liked_back = set(), set()
+    if pending:
+        for userid, wholikesid in db.session.query(UserLike.userid, UserLike.wholikesid).filter(
+            ((UserLike.wholikesid == source_id) & UserLike.userid.in_(list(pending))) |
+            ((UserLike.userid == source_id) & UserLike.wholikesid.in_(list(pending)))
+        ):
+            if wholikesid == source_id:
+                liked.add(userid)
+            else:
+                liked_back.add(wholikesid)
+
+    new_likes = []
+    for target_id, result in pending.items():
+        if target_id not in bonded:
+            result["result"] = "not_found"
+        elif bonded[target_id]:
+            result["result"] = "bonded"
+        elif target_id in liked:
+            result["result"] = "already_liked"
+        elif target_id in liked_back:
+            # Like /like: no row is written, the client starts the chat
+            result["result"] = "match"
+        else:
+            result["result"] = "liked"
+            new_likes.append({'userid': target_id, 'wholikesid': source_id})
+
+    # 3. One multi-row insert, one commit
+    if new_likes:
+        db.session.execute(UserLike.__table__.insert().values(likedate=func.current_date()), new_likes)
+        bump_versions('likes', source_id, *(like['userid'] for like in new_likes))
+        db.session.commit()
+    for swipe in results:
+        if swipe.get("result") in ("liked", "passed", "match"):
+            recommendations.discard(source_id, swipe["target_user_id"])
+
+    return jsonify({
+        "results": results,
+        "matches": [r["target_user_id"] for r in results if r.get("result") == "match"],
+    }), 200
+
+def likes_between(user1, user2):
+    # Either direction
+    return (((UserLike.userid == user1) & (UserLike.wholikesid == user2)) |
+            ((UserLike.userid == user2) & (UserLike.wholikesid == user1)))
+
 @app.route("/chat/start", methods=['POST'])
 @require_api_key
 def start_chat():
@@ -398,10 +1220,7 @@ def start_chat():
          
     try:
         # 1. Delete Likes (Mutual)
-        UserLike.query.filter(
-            ((UserLike.userid == user1) & (UserLike.wholikesid == user2)) |
-            ((UserLike.userid == user2) & (UserLike.wholikesid == user1))
-        ).delete()
+        UserLike.query.filter(likes_between(user1, user2)).delete()
         
         # 2. Insert Initial System Message (Optional, but establishes the thread)
         # Or we rely on frontend sending the first msg.
@@ -410,8 +1229,13 @@ def start_chat():
         
         first_msg = ChatHistory(userid1=user1, userid2=user2, message="Matcheed! Say Hi!", datetime=func.now())
         db.session.add(first_msg)
+        db.session.flush()
+        record_conversation_message(first_msg)
+        bump_versions('likes', user1, user2)
+        bump_versions('chats', user1, user2)
         
         db.session.commit()
+        publish_message(first_msg)
         return jsonify({"message": "Chat started", "chat_id": first_msg.id}), 200
     except Exception as e:
         db.session.rollback()
@@ -423,12 +1247,10 @@ def start_chat():
 @app.route("/like/remove", methods=['POST'])
 @require_api_key
 def remove_like():
-    data = request.json
-    target_id = data.get('target_user_id')
-    source_id = data.get('source_user_id')
-    
-    if not target_id or not source_id:
-        return jsonify({"error": "Missing IDs"}), 400
+    try:
+        target_id, source_id = like_ids(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
         
     try:
         # Delete like where userid=target (me) and wholikesid=source (them)
@@ -437,68 +1259,219 @@ def remove_like():
         # So I want to remove the record where userid=Me, wholikesid=Them.
         
         UserLike.query.filter_by(userid=target_id, wholikesid=source_id).delete()
+        bump_versions('likes', target_id, source_id)
         db.session.commit()
         return jsonify({"message": "Like removed"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+def user_conversations(user_id):
+    return (Conversation.userid1 == user_id) | (Conversation.userid2 == user_id)
+
 @app.route("/chat/list", methods=['GET'])
 @require_api_key
+@replica_read('current_user_id')
 def get_chat_list():
-    current_user_id = request.args.get('current_user_id')
+    current_user_id = request.args.get('current_user_id', type=int)
     if not current_user_id:
         return jsonify({"error": "Missing current_user_id"}), 400
-        
-    # Find distinct users I have chatted with
-    # userid1 = me OR userid2 = me
-    
-    sent_to = db.session.query(ChatHistory.userid2).filter(ChatHistory.userid1 == current_user_id).distinct()
-    received_from = db.session.query(ChatHistory.userid1).filter(ChatHistory.userid2 == current_user_id).distinct()
-    
-    chat_partner_ids = set()
-    for r in sent_to: chat_partner_ids.add(r[0])
-    for r in received_from: chat_partner_ids.add(r[0])
+
+    versions = db.session.execute(chat_list_versions_select(current_user_id)).one()
+    etag = version_etag('chats', current_user_id, *versions)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    # Conversations I am part of, most recent first
+    conversations = Conversation.query.filter(user_conversations(current_user_id)) \
+        .order_by(Conversation.lastmessagetime.desc()).all()
+    by_partner = {c.partner_of(current_user_id): c for c in conversations}
     
-    # Fetch User Details
-    users = User.query.filter(User.id.in_(chat_partner_ids)).all()
-    results = []
-    for user in users:
-         # Get last message?
-         last_msg = ChatHistory.query.filter(
-            ((ChatHistory.userid1 == current_user_id) & (ChatHistory.userid2 == user.id)) |
-            ((ChatHistory.userid1 == user.id) & (ChatHistory.userid2 == current_user_id))
-         ).order_by(ChatHistory.datetime.desc()).first()
-         
-         u_dict = user.to_dict()
-         
-         # Need main photo for avatar
-         photos = UserPhotos.query.filter_by(userid=user.id).first()
-         if photos: u_dict['photos'] = photos.to_dict()
-         
-         if last_msg:
-             u_dict['last_message'] = last_msg.message
-             u_dict['last_message_time'] = last_msg.datetime.isoformat()
-             
-         results.append(u_dict)
-         
-    return jsonify(results), 200
+    # Fetch User Details (need main photo for avatar)
+    results = [chat_list_entry(u_dict, by_partner[u_dict['id']], current_user_id)
+               for u_dict in hydrate_profiles(list(by_partner), include=('photos',))]
+    return with_etag(jsonify(results), etag), 200
+
+def chat_list_entry(u_dict, conv, user_id):
+    if conv.lastmessageid:
+        u_dict['last_message'] = conv.lastmessage
+        u_dict['last_message_time'] = conv.lastmessagetime.isoformat()
+    u_dict['unread_count'] = conv.unread_for(user_id)
+    return u_dict
+
+@app.route("/chat/read", methods=['POST'])
+@require_api_key
+def mark_chat_read():
+    try:
+        user_id, partner_id = chat_read_ids(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+        
+    low, high = sorted((user_id, partner_id))
+    unread_col = 'unread1' if user_id == low else 'unread2'
+    Conversation.query.filter_by(userid1=low, userid2=high).update({unread_col: 0})
+    bump_versions('chats', user_id)
+    db.session.commit()
+    return jsonify({"message": "Marked as read"}), 200
+
+CHAT_HISTORY_DEFAULT_LIMIT = 50
+CHAT_HISTORY_MAX_LIMIT = 200
+CHAT_SUBSCRIBE_TIMEOUT = 25 # Seconds a long-poll is held open
+CHAT_SUBSCRIBE_MAX_TIMEOUT = 60
+CHAT_SSE_SESSION_SECONDS = 300 # An event stream is closed after this; EventSource reconnects with Last-Event-ID
+
+def conversation_filter(user1, user2):
+    return (((ChatHistory.userid1 == user1) & (ChatHistory.userid2 == user2)) |
+            ((ChatHistory.userid1 == user2) & (ChatHistory.userid2 == user1)))
+
+def conversation_query(user1, user2):
+    return ChatHistory.query.filter(conversation_filter(user1, user2))
+
+def conversation_channel(user1, user2):
+    # Same channel whichever side is asking
+    a, b = sorted((int(user1), int(user2)))
+    return f"{a}-{b}"
+
+def record_conversation_message(msg):
+    # Call after flushing msg and before committing, so the summary row is
+    # written in the same transaction as the message itself
+    low, high = sorted((int(msg.userid1), int(msg.userid2)))
+    conv = Conversation.query.filter_by(userid1=low, userid2=high).with_for_update().first()
+    if not conv:
+        try:
+            with db.session.begin_nested():
+                conv = Conversation(userid1=low, userid2=high, unread1=0, unread2=0)
+                db.session.add(conv)
+        except IntegrityError:
+            # A concurrent first message created the row; lock that one instead
+            conv = Conversation.query.filter_by(userid1=low, userid2=high).with_for_update().one()
+    update_conversation(conv, msg)
+
+def update_conversation(conv, msg):
+    conv.lastmessageid = msg.id
+    conv.lastmessage = msg.message
+    conv.lastmessagetime = func.now()
+    if int(msg.userid2) == conv.userid1:
+        conv.unread1 = Conversation.unread1 + 1
+    else:
+        conv.unread2 = Conversation.unread2 + 1
+
+def publish_message(msg):
+    try:
+        chat_broker.publish(conversation_channel(msg.userid1, msg.userid2), msg.to_dict())
+    except Exception as e:
+        # Delivery is best effort; the message is committed and clients catch up via /chat/history
+        logging.warning(f"Chat publish failed: {e}")
+
+def chat_history_window(args):
+    """(after_id, before_id, limit) of a /chat/history request; limit None means the whole conversation.
+
+    Keyset pagination on the message id (ids grow with time):
+      after_id / since_id -> only messages newer than N (polling)
+      before_id           -> the page of older messages right before N (scroll back)
+      limit               -> page size; without any of these the whole conversation is returned
+    """
+    after_id = args.get('after_id', type=int)
+    if after_id is None:
+        after_id = args.get('since_id', type=int)
+    before_id = args.get('before_id', type=int)
+    limit = args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, CHAT_HISTORY_MAX_LIMIT))
+    elif after_id is not None or before_id is not None:
+        limit = CHAT_HISTORY_DEFAULT_LIMIT
+    return after_id, before_id, limit
+
+def subscribe_window(args, headers):
+    """(after_id, timeout) of a /chat/subscribe request."""
+    after_id = args.get('after_id', type=int)
+    if after_id is None:
+        after_id = headers.get('Last-Event-ID', 0, type=int)
+    timeout = args.get('timeout', CHAT_SUBSCRIBE_TIMEOUT, type=float)
+    return after_id, max(0, min(timeout, CHAT_SUBSCRIBE_MAX_TIMEOUT))
+
+def sse_event(message):
+    return f"id: {message['id']}\ndata: {json.dumps(message)}\n\n"
 
 @app.route("/chat/history", methods=['GET'])
 @require_api_key
+@replica_read('user1', 'user2')
 def get_chat_history():
     user1 = request.args.get('user1')
     user2 = request.args.get('user2')
     
     if not user1 or not user2:
         return jsonify({"error": "Missing user ids"}), 400
-        
-    messages = ChatHistory.query.filter(
-        ((ChatHistory.userid1 == user1) & (ChatHistory.userid2 == user2)) |
-        ((ChatHistory.userid1 == user2) & (ChatHistory.userid2 == user1))
-    ).order_by(ChatHistory.datetime.asc()).all()
-    
-    return jsonify([m.to_dict() for m in messages]), 200
+
+    after_id, before_id, limit = chat_history_window(request.args)
+    query = conversation_query(user1, user2)
+    if after_id is not None:
+        query = query.filter(ChatHistory.id > after_id)
+    if before_id is not None:
+        query = query.filter(ChatHistory.id < before_id)
+
+    if after_id is not None:
+        # Oldest first so the client can keep polling from the last id it got
+        messages = query.order_by(ChatHistory.id.asc()).limit(limit).all()
+    elif limit is not None:
+        # Latest page, returned in chronological order
+        messages = query.order_by(ChatHistory.id.desc()).limit(limit).all()
+        messages.reverse()
+    else:
+        # Whole conversation (export): streamed from a server-side cursor
+        messages = query.order_by(ChatHistory.id.asc()).yield_per(streaming.CHUNK_ROWS)
+        return streaming.stream(m.to_dict() for m in messages)
+
+    # Tell the client whether another page may exist in the direction it is paging
+    has_more = 'true' if len(messages) == limit else 'false'
+    if streaming.wants_ndjson():
+        return streaming.stream((m.to_dict() for m in messages), as_ndjson=True, headers={'X-Has-More': has_more})
+    response = jsonify([m.to_dict() for m in messages])
+    response.headers['X-Has-More'] = has_more
+    return response, 200
+
+@app.route("/chat/subscribe", methods=['GET'])
+@require_api_key
+def subscribe_chat():
+    # Long-poll (default) or Server-Sent Events (Accept: text/event-stream).
+    # The request is held until send_message/start_chat publishes a message
+    # newer than after_id, instead of the client polling /chat/history.
+    user1 = request.args.get('user1', type=int)
+    user2 = request.args.get('user2', type=int)
+    if not user1 or not user2:
+        return jsonify({"error": "Missing user ids"}), 400
+
+    after_id, timeout = subscribe_window(request.args, request.headers)
+    channel = conversation_channel(user1, user2)
+
+    # One keyset read to catch anything sent before we started listening;
+    # the wait below touches only the broker.
+    missed = conversation_query(user1, user2).filter(ChatHistory.id > after_id) \
+        .order_by(ChatHistory.id.asc()).limit(CHAT_HISTORY_MAX_LIMIT).all()
+    missed = [m.to_dict() for m in missed]
+    db.session.remove()
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        def stream(last_id, pending):
+            deadline = time.monotonic() + CHAT_SSE_SESSION_SECONDS
+            while True:
+                for m in pending:
+                    last_id = max(last_id, m['id'])
+                    yield sse_event(m)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                pending = chat_broker.wait(channel, last_id, min(timeout or CHAT_SUBSCRIBE_TIMEOUT, remaining))
+                if not pending:
+                    yield ": keepalive\n\n"
+
+        return Response(stream(after_id, missed), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if missed:
+        return jsonify(missed), 200
+    return jsonify(chat_broker.wait(channel, after_id, timeout)), 200
 
 @app.route("/chat/send", methods=['POST'])
 @require_api_key
@@ -513,43 +1486,118 @@ def send_message():
          
     new_msg = ChatHistory(userid1=sender, userid2=receiver, message=message, datetime=func.now())
     db.session.add(new_msg)
+    db.session.flush()
+    record_conversation_message(new_msg)
+    bump_versions('chats', sender, receiver)
     db.session.commit()
+    publish_message(new_msg)
     return jsonify(new_msg.to_dict()), 200
 
+MATCHES_DEFAULT_LIMIT = 50
+MATCHES_MAX_LIMIT = 200
+
+# Like feeds: (column holding the feed owner, column holding the other user).
+# Both are read newest first through (owner, likedate, other) indexes.
+LIKE_FEEDS = {
+    'liked_me': (UserLike.userid, UserLike.wholikesid),
+    'my_likes': (UserLike.wholikesid, UserLike.userid),
+}
+
+def encode_like_cursor(likedate, other_id):
+    return f"{likedate.isoformat() if likedate else 'none'}:{other_id}"
+
+def decode_like_cursor(cursor):
+    """(likedate or None, other user id); raises ValueError for a malformed cursor."""
+    date, _, other_id = cursor.partition(':')
+    return (None if date == 'none' else datetime.date.fromisoformat(date)), int(other_id)
+
+def like_feed_select(feed, user_id, cursor=None):
+    """(likedate, other user id) rows of one like feed, newest first, after cursor."""
+    owner, other = LIKE_FEEDS[feed]
+    query = select(UserLike.likedate, other).where(owner == user_id)
+    if cursor is not None:
+        date, other_id = cursor
+        # Likes without a date sort last
+        if date is None:
+            query = query.where(UserLike.likedate.is_(None), other < other_id)
+        else:
+            query = query.where(or_(UserLike.likedate < date, UserLike.likedate.is_(None),
+                                    and_(UserLike.likedate == date, other < other_id)))
+    return query.order_by(UserLike.likedate.desc(), other.desc())
+
+def like_feed_result(rows, limit):
+    """(other user ids, next cursor or None) from up to limit + 1 feed rows."""
+    next_cursor = encode_like_cursor(*rows[limit - 1]) if len(rows) > limit else None
+    return [r[1] for r in rows[:limit]], next_cursor
+
+def like_feed_page(feed, user_id, limit, cursor=None):
+    """Other user ids of one like feed, newest first by (likedate, other id); returns (ids, next cursor or None)."""
+    return like_feed_result(db.session.execute(like_feed_select(feed, user_id, cursor).limit(limit + 1)).all(), limit)
+
+def matches_limit(args):
+    limit = args.get('limit', MATCHES_DEFAULT_LIMIT, type=int)
+    return max(1, min(limit, MATCHES_MAX_LIMIT))
+
 @app.route("/matches", methods=['GET'])
 @require_api_key
+@replica_read('current_user_id')
 def get_matches():
-    current_user_id = request.args.get('current_user_id')
+    # First page of both feeds; continue with /matches/<feed>?cursor=<*_next>
+    current_user_id = request.args.get('current_user_id', type=int)
     if not current_user_id:
         return jsonify({"error": "Missing current_user_id"}), 400
-        
-    # 1. Liked Me (People who liked current_user)
-    liked_me_ids = db.session.query(UserLike.wholikesid).filter(UserLike.userid == current_user_id).all()
-    liked_me_ids = [i[0] for i in liked_me_ids]
-    
-    # 2. My Likes (People current_user liked)
-    my_likes_ids = db.session.query(UserLike.userid).filter(UserLike.wholikesid == current_user_id).all()
-    my_likes_ids = [i[0] for i in my_likes_ids]
-    
-    def fetch_users(user_ids):
-        users = User.query.filter(User.id.in_(user_ids)).all()
-        results = []
-        for user in users:
-             hobbies = UserHobbies.query.filter_by(userid=user.id).first()
-             photos = UserPhotos.query.filter_by(userid=user.id).first()
-             prefs = UserPrefs.query.filter_by(userid=user.id).first()
-             
-             u_dict = user.to_dict()
-             if hobbies: u_dict['hobbies'] = hobbies.to_dict()
-             if photos: u_dict['photos'] = photos.to_dict()
-             if prefs: u_dict['prefs'] = prefs.to_dict()
-             results.append(u_dict)
-        return results
+    limit = matches_limit(request.args)
 
-    return jsonify({
-        "liked_me": fetch_users(liked_me_ids),
-        "my_likes": fetch_users(my_likes_ids)
-    })
+    versions = db.session.execute(matches_versions_select(current_user_id, limit)).one()
+    etag = version_etag('matches', current_user_id, limit, *versions)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    liked_me_ids, liked_me_next = like_feed_page('liked_me', current_user_id, limit)
+    my_likes_ids, my_likes_next = like_feed_page('my_likes', current_user_id, limit)
+
+    return with_etag(jsonify({
+        "liked_me": hydrate_profiles(liked_me_ids),
+        "my_likes": hydrate_profiles(my_likes_ids),
+        "liked_me_next": liked_me_next,
+        "my_likes_next": my_likes_next,
+    }), etag)
+
+@app.route("/matches/counts", methods=['GET'])
+@require_api_key
+@replica_read('current_user_id')
+def get_match_counts():
+    # Badge numbers, counted from the index alone
+    current_user_id = request.args.get('current_user_id', type=int)
+    if not current_user_id:
+        return jsonify({"error": "Missing current_user_id"}), 400
+
+    row = db.session.execute(match_counts_select(current_user_id)).one()
+    return jsonify(dict(zip(LIKE_FEEDS, row))), 200
+
+def match_counts_select(user_id):
+    """One row: the size of each like feed, in LIKE_FEEDS order."""
+    return select(*(select(func.count()).select_from(UserLike).where(owner == user_id).scalar_subquery()
+                    for owner, _ in LIKE_FEEDS.values()))
+
+@app.route("/matches/<feed>", methods=['GET'])
+@require_api_key
+@replica_read('current_user_id')
+def get_match_feed(feed):
+    if feed not in LIKE_FEEDS:
+        return jsonify({"error": "Unknown feed"}), 404
+    current_user_id = request.args.get('current_user_id', type=int)
+    if not current_user_id:
+        return jsonify({"error": "Missing current_user_id"}), 400
+    cursor = request.args.get('cursor')
+    try:
+        cursor = decode_like_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    ids, next_cursor = like_feed_page(feed, current_user_id, matches_limit(request.args), cursor)
+    return jsonify({"users": hydrate_profiles(ids), "next_cursor": next_cursor}), 200
 
 @app.route("/delete_user", methods=['POST'])
 @require_api_key
@@ -560,19 +1608,33 @@ def delete_user():
         return jsonify({"error": "Missing user_id"}), 400
         
     try:
+        # Everyone whose /matches or /chat/list showed this user
+        like_partners = {u for row in db.session.query(UserLike.userid, UserLike.wholikesid).filter(
+            (UserLike.userid == user_id) | (UserLike.wholikesid == user_id)) for u in row} - {int(user_id)}
+        chat_partners = [c.partner_of(int(user_id)) for c in Conversation.query.filter(user_conversations(user_id))]
+        bump_versions('likes', *like_partners)
+        bump_versions('chats', *chat_partners)
+
         # Cascade Delete
         # 1. UserLike (where user is target OR source)
         UserLike.query.filter((UserLike.userid == user_id) | (UserLike.wholikesid == user_id)).delete()
         
         # 2. Related Tables
+        photos = UserPhotos.query.filter_by(userid=user_id).first()
+        released = [getattr(photos, c) for c in PHOTO_COLUMNS] if photos else []
         UserPhotos.query.filter_by(userid=user_id).delete()
         UserHobbies.query.filter_by(userid=user_id).delete()
         UserPrefs.query.filter_by(userid=user_id).delete()
+        UserVersion.query.filter_by(userid=user_id).delete()
         
         # 3. User Table
         User.query.filter_by(id=user_id).delete()
         
         db.session.commit()
+        location_index.remove(int(user_id))
+        hobby_matrix.remove(int(user_id))
+        cached_profiles.invalidate(int(user_id))
+        release_photos(released)
         return jsonify({"message": "User deleted successfully"}), 200
     except Exception as e:
         db.session.rollback()
@@ -605,14 +1667,130 @@ def change_password():
     
     try:
         db.session.commit()
+        cached_profiles.invalidate(user.id)
         return jsonify({"message": "Password changed successfully"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+@app.route("/stats", methods=['GET'])
+@require_api_key
+def get_stats():
+    # Counters for sizing the profile cache, DB pools and the upload pool
+    return jsonify({
+        "profile_cache": cached_profiles.stats(),
+        "db_pool": db_routing.pool_metrics(db.engines),
+        "upload_pipeline": upload_pipeline.stats(),
+        "activity": activity_buffer.stats(),
+    }), 200
+
+def numeric_stats(stats, *labels):
+    return {(*labels, key): value for key, value in stats.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+# The /stats numbers, read when /metrics is scraped
+registry.add(metrics.Gauge('db_pool', 'Connection pool state and checkout totals', ('bind', 'stat'), lambda: {
+    key: value for bind, stats in db_routing.pool_metrics(db.engines).items()
+    for key, value in numeric_stats(stats, bind).items()}))
+registry.add(metrics.Gauge('profile_cache', 'Profile cache size and counters', ('stat',),
+                           lambda: numeric_stats(cached_profiles.stats())))
+registry.add(metrics.Gauge('upload_pipeline', 'Upload pool queue and totals', ('stat',),
+                           lambda: numeric_stats(upload_pipeline.stats())))
+registry.add(metrics.Gauge('activity_buffer', 'Last seen write-behind buffer', ('stat',),
+                           lambda: numeric_stats(activity_buffer.stats())))
+
+@app.route("/metrics", methods=['GET'])
+@require_api_key
+def get_metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Upload names are never rewritten, so clients and proxies may keep them forever
+PHOTO_MAX_AGE = 365 * 24 * 3600
+# The original served in place of a variant that is not generated yet; the URL gets the real variant later
+PHOTO_FALLBACK_MAX_AGE = 60
+
+def serve_photo(folder, name, max_age=PHOTO_MAX_AGE, immutable=True):
+    if db_config.PHOTO_OFFLOAD == 'x-accel':
+        path = safe_join(folder, name)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        # nginx serves the body and handles ETag/If-None-Match and Range itself
+        relative = os.path.relpath(path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        response = Response(mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = db_config.PHOTO_ACCEL_PREFIX.rstrip('/') + '/' + relative
+    else:
+        # conditional=True: strong ETag + Last-Modified, 304s and Range/206
+        response = send_from_directory(folder, name, conditional=True, etag=True, max_age=max_age)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = immutable
+    return response
+
+# Uploads are content addressed and may be shared, so a file is deleted only
+# once no user_photos row references it
+PHOTO_COLUMNS = ('photo1', 'photo2', 'photo3', 'photo4', 'photo5')
+# Unreferenced uploads younger than this are kept: uploaded, profile not saved yet
+PHOTO_GC_GRACE = 3600
+
+def photo_refcounts(filenames):
+    """{filename: number of user_photos references} for the given filenames."""
+    counts = dict.fromkeys({f for f in filenames if f}, 0)
+    if not counts:
+        return counts
+    # One indexed lookup per column; an OR across the columns scans the table
+    lookups = [db.select(getattr(UserPhotos, c)).where(getattr(UserPhotos, c).in_(list(counts)))
+               for c in PHOTO_COLUMNS]
+    for (filename,) in db.session.execute(db.union_all(*lookups)):
+        counts[filename] += 1
+    return counts
+
+def referenced_photos():
+    referenced = set()
+    columns = [getattr(UserPhotos, c) for c in PHOTO_COLUMNS]
+    for row in db.session.query(*columns).yield_per(HYDRATION_BATCH_SIZE):
+        referenced.update(f for f in row if f)
+    return referenced
+
+def release_photos(filenames):
+    # Called after commit with photos a profile stopped using
+    cutoff = time.time() - PHOTO_GC_GRACE
+    for filename, refs in photo_refcounts(filenames).items():
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if refs or secure_filename(filename) != filename or not os.path.isfile(path) \
+                or os.path.getmtime(path) > cutoff:
+            continue
+        try:
+            image_pipeline.remove_photo(app.config['UPLOAD_FOLDER'], app.config['VARIANTS_FOLDER'], filename,
+                                        cutoff=cutoff)
+        except OSError as e:
+            logging.warning(f"Could not delete photo {filename}: {e}")
+
 @app.route('/uploads/<filename>')
 def get_photo(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # ?size=avatar|card|full and ?format=jpeg|webp; without format, WebP is
+    # served to clients that Accept it
+    size = request.args.get('size', 'full')
+    fmt = request.args.get('format')
+    if size != 'full' and size not in image_pipeline.VARIANT_SIZES:
+        return jsonify({"error": "Unknown size"}), 400
+    if fmt is not None and fmt not in image_pipeline.VARIANT_FORMATS:
+        return jsonify({"error": "Unknown format"}), 400
+    negotiated = fmt is None
+    if negotiated:
+        fmt = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+
+    name = image_pipeline.variant_name(filename, size, fmt)
+    if name == filename:
+        response = serve_photo(app.config['UPLOAD_FOLDER'], filename)
+    elif not os.path.exists(os.path.join(app.config['VARIANTS_FOLDER'], secure_filename(name))):
+        # Variants not generated yet: the original, cached only briefly under this URL
+        response = serve_photo(app.config['UPLOAD_FOLDER'], filename,
+                               max_age=PHOTO_FALLBACK_MAX_AGE, immutable=False)
+    else:
+        response = serve_photo(app.config['VARIANTS_FOLDER'], name)
+    if negotiated:
+        response.vary.add('Accept')
+    return response
 
 @app.route("/users", methods=['POST'])
 @require_api_key
@@ -637,6 +1815,7 @@ def create_user():
         )
         db.session.add(new_user)
         db.session.flush() # flush to get new_user.id
+        db.session.add(UserVersion(userid=new_user.id))
         
         # 2. Related data if provided
         if 'hobbies' in data:
@@ -647,6 +1826,7 @@ def create_user():
                 hobby3=h.get('hobby3'), hobby4=h.get('hobby4'),
                 hobby5=h.get('hobby5')
             )
+            new_hobbies.sync_mask()
             db.session.add(new_hobbies)
             
         if 'photos' in data:
@@ -660,8 +1840,6 @@ def create_user():
             db.session.add(new_photos)
             
         if 'prefs' in data:
-            pr = data['prefs']
-            # Use raw SQL to insert UserPrefs with geolocation
             pr = data['prefs']
             lat = pr.get('latitude')
             if lat is None:
@@ -671,22 +1849,7 @@ def create_user():
             if lon is None:
                 lon = 0.0
             
-            sql = """
-            INSERT INTO user_prefs (
-                userid, gender, height, genderinterest, relationshipinterest, 
-                is_smoke, is_drink, religion, bio, openingmove, geolocation,
-                latitude, longitude
-            ) VALUES (
-                :userid, :gender, :height, :genderinterest, :relationshipinterest,
-                :is_smoke, :is_drink, :religion, :bio, :openingmove,
-                ST_GeomFromText(:pt, 4326),
-                :latitude, :longitude
-            )
-            """
-            
-            pt_str = f'POINT({lat} {lon})'
-            
-            db.session.execute(db.text(sql), {
+            insert_prefs([{
                 'userid': new_user.id,
                 'gender': pr.get('gender'),
                 'height': pr.get('height'),
@@ -697,13 +1860,15 @@ def create_user():
                 'religion': pr.get('religion'),
                 'bio': pr.get('bio'),
                 'openingmove': pr.get('openingmove'),
-                'pt': pt_str,
                 'latitude': lat,
                 'longitude': lon
-            })
+            }])
                 
         
         db.session.commit()
+        if 'prefs' in data:
+            location_index.update(new_user.id, lat, lon)
+        hobby_matrix.update(new_user.id, new_hobbies.hobbymask if 'hobbies' in data else 0)
         return jsonify({"message": "User created", "user_id": new_user.id}), 201
         
     except Exception as e:
@@ -730,8 +1895,8 @@ def update_user(user_id):
             prefs = UserPrefs.query.filter_by(userid=user_id).first()
             if not prefs:
                 # Create if not exists (should theoretically exist)
-                prefs = UserPrefs(userid=user_id)
-                db.session.add(prefs)
+                insert_prefs([{'userid': int(user_id)}])
+                prefs = UserPrefs.query.filter_by(userid=user_id).first()
             
             # Map fields
             if 'bio' in user_prefs_data: prefs.bio = user_prefs_data['bio']
@@ -745,6 +1910,8 @@ def update_user(user_id):
             if 'is_drink' in user_prefs_data: prefs.is_drink = user_prefs_data['is_drink']
             if 'latitude' in user_prefs_data: prefs.latitude = user_prefs_data['latitude']
             if 'longitude' in user_prefs_data: prefs.longitude = user_prefs_data['longitude']
+            if 'latitude' in user_prefs_data or 'longitude' in user_prefs_data:
+                update_geolocation(user_id, prefs.latitude, prefs.longitude)
 
         # 3. Update Photos
         if 'photos' in data:
@@ -754,6 +1921,9 @@ def update_user(user_id):
                 user_photos = UserPhotos(userid=user_id)
                 db.session.add(user_photos)
             
+            replaced = [getattr(user_photos, c) for c in PHOTO_COLUMNS
+                        if c in photos_data and getattr(user_photos, c) != photos_data[c]]
+
             # Update specific keys provided in map
             if 'photo1' in photos_data: user_photos.photo1 = photos_data['photo1']
             if 'photo2' in photos_data: user_photos.photo2 = photos_data['photo2']
@@ -784,8 +1954,19 @@ def update_user(user_id):
                 user_hobbies.hobby3 = hobbies_map.get('hobby3', None)
                 user_hobbies.hobby4 = hobbies_map.get('hobby4', None)
                 user_hobbies.hobby5 = hobbies_map.get('hobby5', None)
+                user_hobbies.sync_mask()
 
+        bump_versions('profile', user_id)
         db.session.commit()
+        cached_profiles.invalidate(user_id)
+        if 'prefs' in data:
+            location_index.update(user_id, prefs.latitude, prefs.longitude)
+        if 'hobbies' in data:
+            hobby_matrix.update(user_id, user_hobbies.hobbymask)
+        if 'prefs' in data or 'hobbies' in data:
+            recommendations.mark_changed(user_id)
+        if 'photos' in data:
+            release_photos(replaced)
         return jsonify({"message": "User updated successfully"}), 200
 
     except Exception as e:
@@ -814,7 +1995,10 @@ def confirm_bond():
         
     p1.bondedwith = user2
     p2.bondedwith = user1
+    bump_versions('profile', user1, user2)
     db.session.commit()
+    cached_profiles.invalidate(int(user1), int(user2))
+    recommendations.mark_changed(int(user1), int(user2))
     
     return jsonify({"message": "Bond confirmed!"}), 200
 
@@ -837,9 +2021,80 @@ def break_bond():
     prefs.bondedwith = None
     if partner_prefs:
         partner_prefs.bondedwith = None
+    bump_versions('profile', userid, partner_id)
         
     db.session.commit()
+    cached_profiles.invalidate(int(userid), int(partner_id))
+    recommendations.mark_changed(int(userid), int(partner_id))
     return jsonify({"message": "Bond broken"}), 200
 
+# CLI commands (flask --app api <command>)
+@app.cli.command("migrate")
+@click.option('--status', is_flag=True, help="List migrations and whether they are applied.")
+def migrate(status):
+    """Bring the database schema up to date with the models."""
+    if status:
+        applied = migrations.applied_versions(db.engine)
+        for version, description, _ in migrations.MIGRATIONS:
+            print(f"{'x' if version in applied else ' '} {version:>3} {description}")
+        return
+    applied = migrations.migrate(db.engine, db.metadata)
+    print(f"Applied migrations: {', '.join(map(str, applied))}" if applied else "Schema is up to date")
+
+@app.cli.command("backfill-conversations")
+def backfill_conversations():
+    """Rebuild the conversation table from chat_history."""
+    migrations.migrate(db.engine, db.metadata, target=1) # Creates the table if missing
+    Conversation.query.delete()
+
+    # Latest message id per unordered pair
+    low = case((ChatHistory.userid1 < ChatHistory.userid2, ChatHistory.userid1), else_=ChatHistory.userid2)
+    high = case((ChatHistory.userid1 < ChatHistory.userid2, ChatHistory.userid2), else_=ChatHistory.userid1)
+    last_ids = db.session.query(func.max(ChatHistory.id)).group_by(low, high)
+
+    count = 0
+    for msg in ChatHistory.query.filter(ChatHistory.id.in_(last_ids)).yield_per(1000):
+        pair = sorted((msg.userid1, msg.userid2))
+        db.session.add(Conversation(
+            userid1=pair[0], userid2=pair[1],
+            lastmessageid=msg.id, lastmessage=msg.message, lastmessagetime=msg.datetime,
+            unread1=0, unread2=0
+        ))
+        count += 1
+    db.session.commit()
+    print(f"Backfilled {count} conversations")
+
+@app.cli.command("backfill-hobby-masks")
+def backfill_hobby_masks():
+    """Fill user_hobbies.hobbymask from hobby1..hobby5."""
+    migrations.migrate(db.engine, db.metadata, target=2) # Adds the column if missing
+
+    count = 0
+    for row in UserHobbies.query.yield_per(1000):
+        row.sync_mask()
+        count += 1
+    db.session.commit()
+    print(f"Backfilled {count} hobby masks")
+
+@app.cli.command("backfill-photo-variants")
+def backfill_photo_variants():
+    """Generate avatar/card/WebP variants for uploads that predate them."""
+    created, failed = image_pipeline.backfill_variants(
+        app.config['UPLOAD_FOLDER'], app.config['VARIANTS_FOLDER'], db_config.IMAGE_WORKERS)
+    print(f"Generated variants for {created} photos ({failed} failed)")
+
+@app.cli.command("gc-photos")
+@click.option('--dry-run', is_flag=True, help="Only report what would be deleted.")
+def gc_photos(dry_run):
+    """Delete uploads (and their variants) that no user_photos row references."""
+    removed, freed = image_pipeline.collect_garbage(
+        app.config['UPLOAD_FOLDER'], app.config['VARIANTS_FOLDER'], referenced_photos(),
+        grace=PHOTO_GC_GRACE, dry_run=dry_run)
+    if dry_run:
+        print(f"Would remove {len(removed)} photos ({freed / 1024 / 1024:.1f}MB)")
+        return
+    pruned = upload_pipeline.prune()
+    print(f"Removed {len(removed)} photos ({freed / 1024 / 1024:.1f}MB), pruned {pruned} finished upload jobs")
+
 if __name__ == "__main__":
     app.run(debug=True, threaded=True, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,505 @@
+import random
+import time
+from functools import wraps
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, abort, has_request_context, jsonify, request
+from quart.wrappers.response import DataBody
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.sql import func
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import RequestRedirect
+
+import api
+import db_config
+import serialization
+import streaming
+from api import ChatHistory, Conversation, LIKE_FEEDS, User, UserHobbies, UserLike, UserPhotos, UserPrefs, UserVersion
+
+# Async entry point: hypercorn asgi:app --bind 0.0.0.0:5000
+# Routes that spend their time waiting on the database or the chat broker
+# (chat, profiles, likes, matches) run here on an event loop with an async
+# driver (aiomysql/asyncmy, or aiosqlite for sqlite URLs), so a held
+# long-poll or a slow query costs a coroutine instead of a server thread.
+# Models, query builders, validation, ETags and serialization come from
+# api.py. Every other route (uploads, photos, explore, login, admin) is
+# handed to the Flask app, which runs in the server's thread pool; /metrics
+# only counts requests served by the Flask app.
+# Needs: pip install quart hypercorn aiomysql aiosqlite
+
+quart_app = Quart(__name__, static_folder=None) # /static is the Flask app's
+quart_app.config['RESPONSE_TIMEOUT'] = None # SSE subscriptions stay open
+
+
+class JSONProvider(serialization.JSONProvider):
+    def wants_msgpack(self):
+        return has_request_context() and serialization.accepts_msgpack(request.accept_mimetypes)
+
+if db_config.SERIALIZER == 'fast':
+    quart_app.json = JSONProvider(quart_app)
+
+# Same pool settings as the sync engines, per worker process
+engine = create_async_engine(db_config.get_async_database_uri(), **db_config.get_engine_options())
+replica_engines = [create_async_engine(uri, **db_config.get_engine_options())
+                   for uri in db_config.get_async_replica_uris()]
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+def read_session(*user_ids):
+    """Session for a read about user_ids: a replica unless one of them wrote recently (see api.replica_read)."""
+    if replica_engines and not api.recent_writers.any_recent([int(u) for u in user_ids if u]):
+        return Session(bind=random.choice(replica_engines))
+    return Session()
+
+def remember_writers(*user_ids):
+    if replica_engines:
+        api.recent_writers.mark({int(u) for u in user_ids if u})
+
+@quart_app.after_serving
+async def close_engines():
+    for e in [engine, *replica_engines]:
+        await e.dispose()
+
+# Authentication
+def require_api_key(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if api.valid_api_key(request.headers.get('x-api-key')):
+            return await f(*args, **kwargs)
+        abort(401, description="Invalid or missing API key")
+    return decorated_function
+
+# Registered first so it runs after every other after_request hook, as in api.py
+@quart_app.after_request
+async def compress_response(response):
+    if (not db_config.COMPRESS_MIN_BYTES or not isinstance(response.response, DataBody)
+            or not serialization.compressible(response)):
+        return response
+    response.vary.add('Accept-Encoding')
+    body, encoding = serialization.encode_body(await response.get_data(), request.accept_encodings,
+                                               db_config.COMPRESS_MIN_BYTES)
+    if encoding is not None:
+        response.set_data(body)
+        serialization.mark_encoded(response, encoding)
+    return response
+
+@quart_app.after_request
+async def remember_activity(response):
+    if response.status_code < 400:
+        sources = [request.args]
+        if request.method != 'GET':
+            sources += [await request.get_json(silent=True), request.view_args or {}]
+        user_id = api.active_user(sources)
+        if user_id is not None:
+            api.record_activity(user_id)
+    return response
+
+# Conditional GETs (see api.version_etag)
+def version_etag(*parts):
+    return api.version_etag(*parts, msgpack=serialization.accepts_msgpack(request.accept_mimetypes))
+
+def not_modified(etag):
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return api.with_etag(quart_app.response_class(b'', status=304), etag)
+
+async def bump_versions(session, kind, *user_ids):
+    user_ids = sorted({int(u) for u in user_ids if u})
+    for chunk in api._chunks(user_ids):
+        if (await session.execute(api.version_bump(kind, chunk))).rowcount < len(chunk):
+            existing = set(await session.scalars(select(UserVersion.userid).where(UserVersion.userid.in_(chunk))))
+            rows = api.new_version_rows(kind, chunk, existing)
+            if rows:
+                await session.execute(UserVersion.__table__.insert(), rows)
+
+# Profile hydration, through the same profile cache as api.hydrate_profiles
+async def _first_by_userid(session, model, user_ids):
+    rows = {}
+    for chunk in api._chunks(user_ids):
+        for row in await session.scalars(select(model).where(model.userid.in_(chunk)).order_by(model.id.asc())):
+            rows.setdefault(row.userid, row)
+    return rows
+
+async def hydrate_profiles(session, user_ids, include=api.PROFILE_RELATED):
+    user_ids = list(dict.fromkeys(int(i) for i in user_ids))
+    if not user_ids:
+        return []
+
+    states = {}
+    if api.cached_profiles.max_entries:
+        for chunk in api._chunks(user_ids):
+            states.update(api.profile_state_rows(await session.execute(api.profile_states_select(chunk))))
+    found = api.fresh_profiles(user_ids, states)
+    missing = [uid for uid in user_ids if uid not in found]
+    if missing:
+        users = []
+        for chunk in api._chunks(missing):
+            users.extend(await session.scalars(select(User).where(User.id.in_(chunk))))
+        related = {
+            'hobbies': await _first_by_userid(session, UserHobbies, missing),
+            'photos': await _first_by_userid(session, UserPhotos, missing),
+            'prefs': await _first_by_userid(session, UserPrefs, missing),
+        }
+        built = api.assemble_profiles(missing, users, related)
+        if session.bind not in replica_engines:
+            api.cache_profiles(built, states)
+        found.update(built)
+    return api.profile_views(user_ids, found, include)
+
+# Streamed bodies (see streaming.py), fed from a server-side cursor
+async def stream_rows(rows, as_ndjson):
+    batch, first = [], True
+    async for row in rows:
+        batch.append(row.to_dict())
+        if len(batch) == streaming.CHUNK_ROWS:
+            yield encode_chunk(batch, first, as_ndjson)
+            batch, first = [], False
+    if batch:
+        yield encode_chunk(batch, first, as_ndjson)
+    elif first and not as_ndjson:
+        yield '['
+    if not as_ndjson:
+        yield ']'
+
+def encode_chunk(batch, first, as_ndjson):
+    if as_ndjson:
+        return streaming.ndjson_chunk(batch, quart_app.json)
+    return ('[' if first else '') + streaming.array_chunk(batch, first, quart_app.json)
+
+def wants_ndjson():
+    return streaming.accepts_ndjson(request.args, request.accept_mimetypes)
+
+# Routes
+@quart_app.route("/users/<int:user_id>", methods=['GET'])
+@require_api_key
+async def get_user(user_id):
+    async with read_session(user_id) as session:
+        versions = (await session.execute(api.user_versions_select(user_id))).first()
+        etag = version_etag('user', user_id, *versions) if versions else None
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        profiles = await hydrate_profiles(session, [user_id])
+        if not profiles:
+            return jsonify({"error": "User not found"}), 404
+        data = profiles[0]
+        prefs = data.get('prefs')
+        if prefs and prefs['bondedwith']:
+            partner = await session.get(User, prefs['bondedwith'])
+            if partner:
+                data['bonded_partner_name'] = partner.name
+    return api.with_etag(jsonify(data), etag)
+
+@quart_app.route("/like", methods=['POST'])
+@require_api_key
+async def like_user():
+    try:
+        target_id, source_id = api.like_ids(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async with Session() as session:
+        bonded = dict((await session.execute(select(UserPrefs.userid, UserPrefs.bondedwith)
+                                             .where(UserPrefs.userid.in_([target_id, source_id])))).all())
+        if bonded.get(target_id):
+            return jsonify({"error": "User is bonded"}), 403
+        if bonded.get(source_id):
+            return jsonify({"error": "You are bonded"}), 403
+
+        likes = set((await session.execute(select(UserLike.userid, UserLike.wholikesid)
+                                           .where(api.likes_between(target_id, source_id)))).all())
+        if (target_id, source_id) in likes:
+            return jsonify({"message": "Already liked"}), 200
+        if (source_id, target_id) in likes:
+            # Frontend handles "Start Chat" which will delete likes and start chat
+            return jsonify({"message": "Match", "match": True}), 200
+
+        session.add(UserLike(userid=target_id, wholikesid=source_id, likedate=func.current_date()))
+        await bump_versions(session, 'likes', source_id, target_id)
+        await session.commit()
+    api.recommendations.discard(source_id, target_id)
+    remember_writers(source_id, target_id)
+    return jsonify({"message": "Liked", "match": False}), 200
+
+@quart_app.route("/like/remove", methods=['POST'])
+@require_api_key
+async def remove_like():
+    try:
+        target_id, source_id = api.like_ids(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        async with Session() as session:
+            await session.execute(delete(UserLike).where(UserLike.userid == target_id,
+                                                         UserLike.wholikesid == source_id))
+            await bump_versions(session, 'likes', target_id, source_id)
+            await session.commit()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    remember_writers(source_id, target_id)
+    return jsonify({"message": "Like removed"}), 200
+
+@quart_app.route("/chat/start", methods=['POST'])
+@require_api_key
+async def start_chat():
+    data = await request.get_json()
+    user1 = data.get('user_id_1')
+    user2 = data.get('user_id_2')
+    if not user1 or not user2:
+        return jsonify({"error": "Missing user ids"}), 400
+
+    try:
+        async with Session() as session:
+            await session.execute(delete(UserLike).where(api.likes_between(user1, user2)))
+            first_msg = ChatHistory(userid1=user1, userid2=user2, message="Matcheed! Say Hi!", datetime=func.now())
+            session.add(first_msg)
+            await session.flush()
+            await record_conversation_message(session, first_msg)
+            await bump_versions(session, 'likes', user1, user2)
+            await bump_versions(session, 'chats', user1, user2)
+            await session.commit()
+            await session.refresh(first_msg)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    api.publish_message(first_msg)
+    remember_writers(user1, user2)
+    return jsonify({"message": "Chat started", "chat_id": first_msg.id}), 200
+
+@quart_app.route("/chat/list", methods=['GET'])
+@require_api_key
+async def get_chat_list():
+    current_user_id = request.args.get('current_user_id', type=int)
+    if not current_user_id:
+        return jsonify({"error": "Missing current_user_id"}), 400
+
+    async with read_session(current_user_id) as session:
+        versions = (await session.execute(api.chat_list_versions_select(current_user_id))).one()
+        etag = version_etag('chats', current_user_id, *versions)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        conversations = await session.scalars(select(Conversation).where(api.user_conversations(current_user_id))
+                                              .order_by(Conversation.lastmessagetime.desc()))
+        by_partner = {c.partner_of(current_user_id): c for c in conversations}
+        results = [api.chat_list_entry(u_dict, by_partner[u_dict['id']], current_user_id)
+                   for u_dict in await hydrate_profiles(session, list(by_partner), include=('photos',))]
+    return api.with_etag(jsonify(results), etag), 200
+
+@quart_app.route("/chat/read", methods=['POST'])
+@require_api_key
+async def mark_chat_read():
+    try:
+        user_id, partner_id = api.chat_read_ids(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    low, high = sorted((user_id, partner_id))
+    unread_col = 'unread1' if user_id == low else 'unread2'
+    async with Session() as session:
+        await session.execute(update(Conversation).where(Conversation.userid1 == low, Conversation.userid2 == high)
+                              .values({unread_col: 0}))
+        await bump_versions(session, 'chats', user_id)
+        await session.commit()
+    remember_writers(user_id)
+    return jsonify({"message": "Marked as read"}), 200
+
+async def record_conversation_message(session, msg):
+    # Same as api.record_conversation_message, on an async session
+    low, high = sorted((int(msg.userid1), int(msg.userid2)))
+    conv = (await session.scalars(select(Conversation).filter_by(userid1=low, userid2=high).with_for_update())).first()
+    if not conv:
+        try:
+            async with session.begin_nested():
+                conv = Conversation(userid1=low, userid2=high, unread1=0, unread2=0)
+                session.add(conv)
+        except IntegrityError:
+            conv = (await session.scalars(select(Conversation).filter_by(userid1=low, userid2=high)
+                                          .with_for_update())).one()
+    api.update_conversation(conv, msg)
+
+@quart_app.route("/chat/history", methods=['GET'])
+@require_api_key
+async def get_chat_history():
+    user1 = request.args.get('user1')
+    user2 = request.args.get('user2')
+    if not user1 or not user2:
+        return jsonify({"error": "Missing user ids"}), 400
+
+    after_id, before_id, limit = api.chat_history_window(request.args)
+    query = select(ChatHistory).where(api.conversation_filter(user1, user2))
+    if after_id is not None:
+        query = query.where(ChatHistory.id > after_id)
+    if before_id is not None:
+        query = query.where(ChatHistory.id < before_id)
+
+    if limit is None:
+        # Whole conversation (export): streamed from a server-side cursor, the session closes with the body
+        as_ndjson = wants_ndjson()
+        async def body():
+            async with read_session(user1, user2) as session:
+                rows = await session.stream_scalars(query.order_by(ChatHistory.id.asc())
+                                                    .execution_options(yield_per=streaming.CHUNK_ROWS))
+                async for chunk in stream_rows(rows, as_ndjson):
+                    yield chunk
+        return quart_app.response_class(body(), mimetype=streaming.NDJSON if as_ndjson else 'application/json')
+
+    async with read_session(user1, user2) as session:
+        if after_id is not None:
+            # Oldest first so the client can keep polling from the last id it got
+            messages = list(await session.scalars(query.order_by(ChatHistory.id.asc()).limit(limit)))
+        else:
+            # Latest page, returned in chronological order
+            messages = list(await session.scalars(query.order_by(ChatHistory.id.desc()).limit(limit)))
+            messages.reverse()
+
+    has_more = 'true' if len(messages) == limit else 'false'
+    if wants_ndjson():
+        return quart_app.response_class(streaming.ndjson_chunk([m.to_dict() for m in messages], quart_app.json),
+                                        mimetype=streaming.NDJSON, headers={'X-Has-More': has_more})
+    response = jsonify([m.to_dict() for m in messages])
+    response.headers['X-Has-More'] = has_more
+    return response, 200
+
+@quart_app.route("/chat/subscribe", methods=['GET'])
+@require_api_key
+async def subscribe_chat():
+    # Long-poll or SSE as in api.subscribe_chat; a waiting client holds no thread and no DB connection
+    user1 = request.args.get('user1', type=int)
+    user2 = request.args.get('user2', type=int)
+    if not user1 or not user2:
+        return jsonify({"error": "Missing user ids"}), 400
+
+    after_id, timeout = api.subscribe_window(request.args, request.headers)
+    channel = api.conversation_channel(user1, user2)
+    async with Session() as session:
+        missed = await session.scalars(select(ChatHistory)
+                                       .where(api.conversation_filter(user1, user2), ChatHistory.id > after_id)
+                                       .order_by(ChatHistory.id.asc()).limit(api.CHAT_HISTORY_MAX_LIMIT))
+        missed = [m.to_dict() for m in missed]
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        async def stream(last_id, pending):
+            deadline = time.monotonic() + api.CHAT_SSE_SESSION_SECONDS
+            while True:
+                for m in pending:
+                    last_id = max(last_id, m['id'])
+                    yield api.sse_event(m)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                pending = await api.chat_broker.wait_async(channel, last_id,
+                                                           min(timeout or api.CHAT_SUBSCRIBE_TIMEOUT, remaining))
+                if not pending:
+                    yield ": keepalive\n\n"
+
+        return quart_app.response_class(stream(after_id, missed), mimetype='text/event-stream',
+                                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if missed:
+        return jsonify(missed), 200
+    return jsonify(await api.chat_broker.wait_async(channel, after_id, timeout)), 200
+
+@quart_app.route("/chat/send", methods=['POST'])
+@require_api_key
+async def send_message():
+    data = await request.get_json()
+    sender = data.get('sender_id')
+    receiver = data.get('receiver_id')
+    message = data.get('message')
+    if not sender or not receiver or not message:
+        return jsonify({"error": "Missing data"}), 400
+
+    async with Session() as session:
+        new_msg = ChatHistory(userid1=sender, userid2=receiver, message=message, datetime=func.now())
+        session.add(new_msg)
+        await session.flush()
+        await record_conversation_message(session, new_msg)
+        await bump_versions(session, 'chats', sender, receiver)
+        await session.commit()
+        await session.refresh(new_msg) # datetime is set by the database
+    api.publish_message(new_msg)
+    remember_writers(sender, receiver)
+    return jsonify(new_msg.to_dict()), 200
+
+async def like_feed_page(session, feed, user_id, limit, cursor=None):
+    rows = (await session.execute(api.like_feed_select(feed, user_id, cursor).limit(limit + 1))).all()
+    return api.like_feed_result(rows, limit)
+
+@quart_app.route("/matches", methods=['GET'])
+@require_api_key
+async def get_matches():
+    current_user_id = request.args.get('current_user_id', type=int)
+    if not current_user_id:
+        return jsonify({"error": "Missing current_user_id"}), 400
+    limit = api.matches_limit(request.args)
+
+    async with read_session(current_user_id) as session:
+        versions = (await session.execute(api.matches_versions_select(current_user_id, limit))).one()
+        etag = version_etag('matches', current_user_id, limit, *versions)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        liked_me_ids, liked_me_next = await like_feed_page(session, 'liked_me', current_user_id, limit)
+        my_likes_ids, my_likes_next = await like_feed_page(session, 'my_likes', current_user_id, limit)
+        body = {
+            "liked_me": await hydrate_profiles(session, liked_me_ids),
+            "my_likes": await hydrate_profiles(session, my_likes_ids),
+            "liked_me_next": liked_me_next,
+            "my_likes_next": my_likes_next,
+        }
+    return api.with_etag(jsonify(body), etag)
+
+@quart_app.route("/matches/counts", methods=['GET'])
+@require_api_key
+async def get_match_counts():
+    current_user_id = request.args.get('current_user_id', type=int)
+    if not current_user_id:
+        return jsonify({"error": "Missing current_user_id"}), 400
+
+    async with read_session(current_user_id) as session:
+        row = (await session.execute(api.match_counts_select(current_user_id))).one()
+    return jsonify(dict(zip(LIKE_FEEDS, row))), 200
+
+@quart_app.route("/matches/<feed>", methods=['GET'])
+@require_api_key
+async def get_match_feed(feed):
+    if feed not in LIKE_FEEDS:
+        return jsonify({"error": "Unknown feed"}), 404
+    current_user_id = request.args.get('current_user_id', type=int)
+    if not current_user_id:
+        return jsonify({"error": "Missing current_user_id"}), 400
+    cursor = request.args.get('cursor')
+    try:
+        cursor = api.decode_like_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    async with read_session(current_user_id) as session:
+        ids, next_cursor = await like_feed_page(session, feed, current_user_id, api.matches_limit(request.args), cursor)
+        users = await hydrate_profiles(session, ids)
+    return jsonify({"users": users, "next_cursor": next_cursor}), 200
+
+
+# Everything quart_app does not route goes to the Flask app, in a thread pool
+flask_app = AsyncioWSGIMiddleware(api.app, max_body_size=api.app.config.get('MAX_CONTENT_LENGTH') or 64 * 1024 * 1024)
+
+def handled_here(scope):
+    try:
+        quart_app.url_map.bind('').match(scope['path'], method=scope['method'])
+    except (NotFound, MethodNotAllowed):
+        return False
+    except RequestRedirect:
+        pass # Quart answers with the redirect
+    return True
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope['type'] == 'http' and not handled_here(scope):
+        await flask_app(scope, receive, send)
+    else:
+        await quart_app(scope, receive, send)
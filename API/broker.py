@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Pub-sub for chat delivery.
+# A channel is one conversation; every published message is a dict with an
+# increasing 'id' (the chat_history id). Subscribers wait for ids newer than
+# the last one they have, so nothing is lost between a DB read and a wait.
+# wait_async is the same wait for the asyncio app (asgi.py), which must not
+# hold a thread per subscriber.
+
+class Broker:
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def wait(self, channel, after_id, timeout):
+        """Block until messages with id > after_id exist (or timeout). Returns a list."""
+        raise NotImplementedError
+
+    async def wait_async(self, channel, after_id, timeout):
+        # Fallback for brokers without a native one: a worker thread per waiter
+        return await asyncio.to_thread(self.wait, channel, after_id, timeout)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Channel:
+    def __init__(self, buffer_size):
+        self.cond = threading.Condition()
+        self.buffer = deque(maxlen=buffer_size)
+        self.waiters = set()
+        self.users = 0
+        self.touched = time.monotonic()
+
+
+class MemoryBroker(Broker):
+    """Single process broker: a small ring buffer plus a Condition per channel.
+
+    Async waiters park a future instead; publish() (from any thread) resolves
+    it on the waiter's event loop. Channels nobody has used for idle_ttl
+    seconds are dropped; a subscriber reads anything older from chat_history
+    before waiting, so the lost buffer costs nothing.
+    """
+
+    def __init__(self, buffer_size=100, idle_ttl=600):
+        self.buffer_size = buffer_size
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._swept = time.monotonic()
+
+    @contextmanager
+    def _channel(self, channel):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._swept > self.idle_ttl:
+                self._swept = now
+                idle = [k for k, c in self._channels.items() if not c.users and now - c.touched > self.idle_ttl]
+                for k in idle:
+                    del self._channels[k]
+            ch = self._channels.get(channel)
+            if ch is None:
+                ch = self._channels[channel] = _Channel(self.buffer_size)
+            ch.users += 1
+        try:
+            yield ch
+        finally:
+            with self._lock:
+                ch.users -= 1
+                ch.touched = time.monotonic()
+
+    def publish(self, channel, message):
+        with self._channel(channel) as ch, ch.cond:
+            ch.buffer.append(message)
+            ch.cond.notify_all()
+            for loop, future in ch.waiters:
+                loop.call_soon_threadsafe(_wake, future)
+
+    def wait(self, channel, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        with self._channel(channel) as ch, ch.cond:
+            while True:
+                newer = [m for m in ch.buffer if m['id'] > after_id]
+                remaining = deadline - time.monotonic()
+                if newer or remaining <= 0:
+                    return newer
+                ch.cond.wait(remaining)
+
+    async def wait_async(self, channel, after_id, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        with self._channel(channel) as ch:
+            while True:
+                with ch.cond:
+                    newer = [m for m in ch.buffer if m['id'] > after_id]
+                    remaining = deadline - loop.time()
+                    if newer or remaining <= 0:
+                        return newer
+                    waiter = (loop, loop.create_future())
+                    ch.waiters.add(waiter)
+                try:
+                    await asyncio.wait_for(waiter[1], remaining)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with ch.cond:
+                        ch.waiters.discard(waiter)
+
+
+class FileBroker(Broker):
+    """Local multi-worker stand-in: one append-only JSON lines file per channel.
+
+    Every worker on the host shares the spool directory. Waiters only stat()
+    the file until it changes, so an idle subscription costs no DB queries.
+    """
+
+    def __init__(self, directory, buffer_size=100, poll_interval=0.05):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, channel):
+        return os.path.join(self.directory, f"{channel}.jsonl")
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        messages = []
+        for line in lines:
+            # A line still being appended by another worker is skipped until complete
+            if line.endswith('\n'):
+                messages.append(json.loads(line))
+        return messages
+
+    def publish(self, channel, message):
+        path = self._path(channel)
+        line = (json.dumps(message) + '\n').encode('utf-8')
+        # A single O_APPEND write keeps concurrent publishers from interleaving
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+        # Compact to the last buffer_size messages once the file grows.
+        # A message appended by another worker mid-compaction can be dropped
+        # from the file; it is still in chat_history and the next poll gets it.
+        if os.path.getsize(path) > self.buffer_size * 1024:
+            tail = self._read(path)[-self.buffer_size:]
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(m) + '\n' for m in tail)
+            os.replace(tmp_path, path)
+
+    def _poll(self, path, after_id, last_stat):
+        """(messages newer than after_id, file stat); the file is only read when its stat changed."""
+        try:
+            st = os.stat(path)
+            stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            return [], None
+        if stat == last_stat:
+            return [], stat
+        return [m for m in self._read(path) if m['id'] > after_id], stat
+
+    def wait(self, channel, after_id, timeout):
+        path = self._path(channel)
+        deadline = time.monotonic() + timeout
+        last_stat = None
+        while True:
+            newer, last_stat = self._poll(path, after_id, last_stat)
+            if newer:
+                return newer
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            time.sleep(min(self.poll_interval, remaining))
+
+    async def wait_async(self, channel, after_id, timeout):
+        path = self._path(channel)
+        deadline = time.monotonic() + timeout
+        last_stat = None
+        while True:
+            newer, last_stat = self._poll(path, after_id, last_stat)
+            if newer:
+                return newer
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+
+def create_broker(kind, directory=None):
+    if kind == 'memory':
+        return MemoryBroker()
+    if kind == 'file':
+        return FileBroker(directory)
+    raise ValueError(f"Unknown chat broker: {kind}")
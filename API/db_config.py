@@ -1,5 +1,6 @@
 import os
 import configparser
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,7 +17,75 @@ DB_NAME = os.getenv('DB_NAME', 'datingapp')
 # API Key for authentication
 API_KEY = os.getenv('API_KEY', "CHANGE_ME_TO_SECURE_KEY")
 
+# Chat push delivery: 'memory' (single process) or 'file' (workers on one host)
+CHAT_BROKER = os.getenv('CHAT_BROKER', 'memory')
+CHAT_BROKER_DIR = os.getenv('CHAT_BROKER_DIR', os.path.join(tempfile.gettempdir(), 'datingapp_chat'))
+
+# Upload processing pool: worker processes (default: CPU count) and max queued uploads
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 0)) or None
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', 64))
+UPLOAD_QUEUE_DIR = os.getenv('UPLOAD_QUEUE_DIR', os.path.join(tempfile.gettempdir(), 'datingapp_upload_queue'))
+
+# Background-ranked /explore queues (see recommender.py)
+RECOMMENDER_ENABLED = os.getenv('RECOMMENDER_ENABLED', '1') == '1'
+RECOMMENDER_INTERVAL = int(os.getenv('RECOMMENDER_INTERVAL', 30))
+
+# Profile read-through cache: 'memory' (per process LRU), 'file' (shared by
+# workers on one host) or 'off'; size bound in entries, TTL in seconds.
+# Entries are checked against user_version on every read, so 'memory' stays
+# correct with several workers; 'file' only saves each worker its own rebuilds.
+PROFILE_CACHE = os.getenv('PROFILE_CACHE', 'memory')
+PROFILE_CACHE_DIR = os.getenv('PROFILE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'datingapp_profiles'))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', 10000))
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 300))
+
+# Photo transfer offload: '' (Flask streams the file), 'x-accel' (nginx) or
+# 'x-sendfile' (Apache/lighttpd). For x-accel, nginx needs an internal location
+# mapping PHOTO_ACCEL_PREFIX to API/static/uploads/, e.g.
+#   location /protected-uploads/ { internal; alias /srv/datingapp/API/static/uploads/; }
+PHOTO_OFFLOAD = os.getenv('PHOTO_OFFLOAD', '')
+PHOTO_ACCEL_PREFIX = os.getenv('PHOTO_ACCEL_PREFIX', '/protected-uploads/')
+
+# Last seen (user_prefs.lastlogin) write-behind: flushed every interval
+# seconds, or once this many users are waiting
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', 30))
+ACTIVITY_FLUSH_SIZE = int(os.getenv('ACTIVITY_FLUSH_SIZE', 1000))
+# A flush bumps a user's profile version (and so the ETags showing their
+# lastlogin) only when lastlogin moves into a new window of this many seconds
+LAST_SEEN_RESOLUTION = int(os.getenv('LAST_SEEN_RESOLUTION', 300))
+
+# Response bodies: 'fast' (orjson, MessagePack on Accept: application/msgpack)
+# or 'json' (Flask's stdlib encoder). Bodies of at least COMPRESS_MIN_BYTES
+# are gzip/brotli compressed when the client accepts it; 0 turns that off.
+SERIALIZER = os.getenv('SERIALIZER', 'fast')
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+
+# Requests slower than this are logged with the SQL they issued
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+
+# Connection pool, per engine and per worker process
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10)) # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800)) # Below MySQL wait_timeout and proxy idle limits
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+# Read replicas: comma separated host[:port], same credentials and database as the primary
+DB_REPLICA_HOSTS = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+# Reads concerning a user who wrote within this many seconds go to the primary
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+# Shared by the workers on one host so a write in one is seen by the reads of
+# all of them; set it empty to keep recent writes per process (single worker only)
+REPLICA_STICKY_DIR = os.getenv('REPLICA_STICKY_DIR', os.path.join(tempfile.gettempdir(), 'datingapp_recent_writers')) or None
+
+# Full SQLAlchemy URL override (e.g. sqlite:///datingapp.db for local benchmarks)
+DATABASE_URL = os.getenv('DATABASE_URL')
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+
 def get_database_uri():
+    if DATABASE_URL:
+        return DATABASE_URL
+
     user = DB_USER
     password = DB_PASSWORD
     host = DB_HOST
@@ -24,3 +93,39 @@ def get_database_uri():
     
 
     return f"mysql+pymysql://{user}:{password}@{host}:{port}/{DB_NAME}"
+
+def get_replica_uris():
+    if DATABASE_REPLICA_URLS:
+        return DATABASE_REPLICA_URLS
+
+    uris = []
+    for replica in DB_REPLICA_HOSTS:
+        host, _, port = replica.partition(':')
+        uris.append(f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{host}:{port or DB_PORT}/{DB_NAME}")
+    return uris
+
+# Async app (asgi.py): MySQL driver, 'aiomysql' or 'asyncmy'; sqlite URLs use aiosqlite
+ASYNC_MYSQL_DRIVER = os.getenv('ASYNC_MYSQL_DRIVER', 'aiomysql')
+
+def to_async_uri(uri):
+    backend, sep, rest = uri.partition('://')
+    dialect = backend.split('+')[0]
+    driver = {'mysql': ASYNC_MYSQL_DRIVER, 'sqlite': 'aiosqlite'}.get(dialect)
+    if driver is None:
+        raise ValueError(f"No async driver configured for {dialect}")
+    return f"{dialect}+{driver}{sep}{rest}"
+
+def get_async_database_uri():
+    return to_async_uri(get_database_uri())
+
+def get_async_replica_uris():
+    return [to_async_uri(uri) for uri in get_replica_uris()]
+
+def get_engine_options():
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+
+# Read replica routing and connection pool metrics.
+# A request that opted in (see api.replica_read) sets g.db_replica to a
+# replica bind key; RoutingSession then sends its plain SELECTs there.
+# Writes, SELECT ... FOR UPDATE, raw SQL and anything outside a request
+# (CLI, background workers) always use the primary.
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self.timeouts += 1
+            raise
+        waited = (time.perf_counter() - start) * 1000
+        with self._metrics_lock:
+            self.checkouts += 1
+            self.wait_ms_total += waited
+            self.wait_ms_max = max(self.wait_ms_max, waited)
+        return conn
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                'size': self.size(),
+                'in_use': self.checkedout(),
+                'idle': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms_avg': round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_ms_max': round(self.wait_ms_max, 3),
+            }
+
+def pool_metrics(engines):
+    """Pool metrics per bind ('primary' for the default engine)."""
+    return {('primary' if key is None else key): engine.pool.metrics()
+            for key, engine in engines.items() if isinstance(engine.pool, TimedQueuePool)}
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context():
+            replica = g.get('db_replica')
+            if replica and isinstance(clause, Select) and clause._for_update_arg is None:
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class RecentWriters:
+    """User ids that wrote within the last `window` seconds (read-your-writes).
+
+    Kept in memory, or as one empty file per user in `directory` (mtime is
+    the last write) so every worker on the host sees the same writes.
+    """
+
+    def __init__(self, window, directory=None):
+        self.window = window
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._writes = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def mark(self, user_ids):
+        if self.directory:
+            for user_id in user_ids:
+                path = os.path.join(self.directory, str(int(user_id)))
+                with open(path, 'a'):
+                    os.utime(path)
+            return
+        now = time.time()
+        with self._lock:
+            for user_id in user_ids:
+                self._writes[int(user_id)] = now
+            if len(self._writes) > 10000:
+                cutoff = now - self.window
+                self._writes = {u: t for u, t in self._writes.items() if t >= cutoff}
+
+    def any_recent(self, user_ids):
+        cutoff = time.time() - self.window
+        for user_id in user_ids:
+            if self.directory:
+                try:
+                    written = os.path.getmtime(os.path.join(self.directory, str(int(user_id))))
+                except FileNotFoundError:
+                    continue
+            else:
+                written = self._writes.get(int(user_id), 0)
+            if written >= cutoff:
+                return True
+        return False
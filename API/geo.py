@@ -0,0 +1,94 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+# Distance helpers and an in-process grid index over user_prefs latitude/longitude.
+# MySQL answers radius queries with the SPATIAL index on user_prefs.geolocation;
+# the grid index covers databases without spatial support (e.g. SQLite).
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.195
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def haversine_km_array(lat, lon, lats, lons):
+    """haversine_km from one point to arrays of points (NaN where a point has no location)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, min_lon, max_lat, max_lon) enclosing the circle; not wrapped at the antimeridian."""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    return (max(-90.0, lat - dlat), max(-180.0, lon - dlon),
+            min(90.0, lat + dlat), min(180.0, lon + dlon))
+
+def point_wkt(lat, lon):
+    # SRID 4326 takes latitude first
+    return f'POINT({lat} {lon})'
+
+def has_location(lat, lon):
+    # create_user stores 0.0/0.0 when the client sent no location
+    return lat is not None and lon is not None and (lat, lon) != (0.0, 0.0)
+
+
+class GridIndex:
+    """Users bucketed into cell_deg x cell_deg cells for radius lookups."""
+
+    def __init__(self, cell_deg=0.5):
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._points = {}
+        self.built_at = None
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def rebuild(self, rows):
+        """rows: iterable of (user_id, latitude, longitude)."""
+        cells, points = {}, {}
+        for user_id, lat, lon in rows:
+            if has_location(lat, lon):
+                points[user_id] = (lat, lon)
+                cells.setdefault(self._cell(lat, lon), set()).add(user_id)
+        with self._lock:
+            self._cells, self._points = cells, points
+            self.built_at = time.monotonic()
+
+    def remove(self, user_id):
+        with self._lock:
+            point = self._points.pop(user_id, None)
+            if point:
+                self._cells.get(self._cell(*point), set()).discard(user_id)
+
+    def update(self, user_id, lat, lon):
+        self.remove(user_id)
+        if has_location(lat, lon):
+            with self._lock:
+                self._points[user_id] = (lat, lon)
+                self._cells.setdefault(self._cell(lat, lon), set()).add(user_id)
+
+    def within(self, lat, lon, radius_km):
+        """[(user_id, distance_km)] inside radius_km, nearest first."""
+        min_lat, min_lon, max_lat, max_lon = bounding_box(lat, lon, radius_km)
+        lat_cells = range(math.floor(min_lat / self.cell_deg), math.floor(max_lat / self.cell_deg) + 1)
+        lon_cells = range(math.floor(min_lon / self.cell_deg), math.floor(max_lon / self.cell_deg) + 1)
+        found = []
+        with self._lock:
+            for cy in lat_cells:
+                for cx in lon_cells:
+                    for user_id in self._cells.get((cy, cx), ()):
+                        distance = haversine_km(lat, lon, *self._points[user_id])
+                        if distance <= radius_km:
+                            found.append((user_id, distance))
+        found.sort(key=lambda item: item[1])
+        return found
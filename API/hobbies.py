@@ -0,0 +1,94 @@
+import threading
+import time
+
+import numpy as np
+
+# Hobbies as bitmasks: hobby id h (1..32) is bit h-1 of user_hobbies.hobbymask.
+# Shared hobbies between two users are popcount(a & b), so one user can be
+# compared against every candidate in a single NumPy pass.
+
+def mask_of(hobby_ids):
+    mask = 0
+    for h in hobby_ids:
+        if h:
+            mask |= 1 << (int(h) - 1)
+    return mask
+
+def ids_of(mask):
+    return [bit + 1 for bit in range(32) if mask >> bit & 1]
+
+def popcount(masks):
+    masks = np.asarray(masks, dtype=np.uint32)
+    as_bytes = masks.astype('>u4').view(np.uint8).reshape(-1, 4)
+    return np.unpackbits(as_bytes, axis=1).sum(axis=1)
+
+def similarity(mask, masks):
+    """(shared counts, Jaccard index) of mask against every entry of masks."""
+    masks = np.asarray(masks, dtype=np.uint32)
+    shared = popcount(masks & np.uint32(mask))
+    union = popcount(masks | np.uint32(mask))
+    jaccard = np.divide(shared, union, out=np.zeros(len(masks)), where=union > 0)
+    return shared, jaccard
+
+
+class HobbyMatrix:
+    """In-process copy of every user's hobby mask.
+
+    Rows live in buffers that double when full, so a signup appends in
+    amortized O(1); ids and masks are views of the filled part.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = np.array([], dtype=np.int64)
+        self._masks = np.array([], dtype=np.uint32)
+        self._size = 0
+        self._index = {}
+        self.built_at = None
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def masks(self):
+        return self._masks[:self._size]
+
+    def rebuild(self, rows):
+        """rows: iterable of (user_id, mask); the first row per user wins."""
+        rows = list({r[0]: r for r in reversed(list(rows))}.values())
+        with self._lock:
+            self._ids = np.array([r[0] for r in rows], dtype=np.int64)
+            self._masks = np.array([r[1] or 0 for r in rows], dtype=np.uint32)
+            self._size = len(rows)
+            self._index = {int(uid): i for i, uid in enumerate(self._ids)}
+            self.built_at = time.monotonic()
+
+    def update(self, user_id, mask):
+        with self._lock:
+            i = self._index.get(user_id)
+            if i is not None:
+                self._masks[i] = mask
+                return
+            if self._size == len(self._ids):
+                # New buffers, so views already handed out by similar() stay intact
+                capacity = max(16, 2 * self._size)
+                self._ids = np.resize(self._ids, capacity)
+                self._masks = np.resize(self._masks, capacity)
+            i = self._index[user_id] = self._size
+            self._ids[i] = user_id
+            self._masks[i] = mask
+            self._size += 1
+
+    def remove(self, user_id):
+        # Zeroed rather than deleted so row positions stay valid
+        if user_id in self._index:
+            self.update(user_id, 0)
+
+    def similar(self, mask, min_shared=0):
+        """(ids, shared, jaccard) of users sharing at least min_shared hobbies with mask."""
+        with self._lock:
+            ids, masks = self.ids, self.masks
+        shared, jaccard = similarity(mask, masks)
+        keep = shared >= min_shared
+        return ids[keep], shared[keep], jaccard[keep]
@@ -0,0 +1,542 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+import pillow_heif
+
+# Upload processing off the request thread.
+# /upload stores the raw bytes as <job_id>.upload in the queue folder and
+# returns; a process pool decodes, resizes and re-encodes them into the
+# upload folder. Job state lives in the file system, so any worker can
+# answer /upload/status:
+#   <job_id>.upload in queue folder -> processing
+#   <job_id>.done in queue folder   -> done (holds the filename)
+#   <job_id>.error in queue folder  -> failed (holds the message)
+# Avatar/card sizes and WebP copies are written to the variants folder
+# before the final .jpg, so a finished job always has its variants.
+#
+# Storage is content addressed: a photo is named <sha256 of the JPEG>.jpg, so
+# identical results share one file. raw_index/<sha256 of the raw upload>
+# remembers what a raw file was encoded to, and re-uploading the exact same
+# bytes skips decoding and encoding entirely.
+
+# Register HEIF opener (also runs in each pool process)
+pillow_heif.register_heif_opener()
+
+# Pool processes are spawned, not forked: the app forks from a process that
+# already runs request, flush and recommendation threads, and a forked child
+# can inherit a lock one of them was holding.
+_spawn = multiprocessing.get_context('spawn')
+
+class PipelineFull(Exception):
+    pass
+
+# Extra renditions written next to every upload, in <upload folder>/variants:
+#   <stem>_avatar.jpg/.webp (96px square), <stem>_card.jpg/.webp (480px), <stem>.webp (full)
+VARIANT_SIZES = {'avatar': 96, 'card': 480}
+VARIANT_FORMATS = {'jpeg': 'jpg', 'webp': 'webp'}
+VARIANT_QUALITY = {'jpeg': 80, 'webp': 75}
+
+def variant_name(filename, size='full', fmt='jpeg'):
+    stem = os.path.splitext(filename)[0]
+    suffix = '' if size == 'full' else f"_{size}"
+    return f"{stem}{suffix}.{VARIANT_FORMATS[fmt]}"
+
+def _atomic_save(img, path, fmt, **params):
+    tmp_path = f"{path}.tmp"
+    img.save(tmp_path, fmt.upper(), **params)
+    os.replace(tmp_path, path)
+
+def write_variants(img, full_jpeg, variants_folder, filename):
+    """Write every size/format variant; img is the source, full_jpeg the final full-size bytes."""
+    os.makedirs(variants_folder, exist_ok=True)
+    # Full size WebP from the same pixels as the JPEG that was kept
+    full = Image.open(io.BytesIO(full_jpeg))
+    _atomic_save(full, os.path.join(variants_folder, variant_name(filename, 'full', 'webp')),
+                 'webp', quality=VARIANT_QUALITY['webp'])
+
+    for size, pixels in VARIANT_SIZES.items():
+        if size == 'avatar':
+            # Centre square crop, avatars are shown in circles
+            side = min(img.size)
+            left, top = (img.width - side) // 2, (img.height - side) // 2
+            variant = img.crop((left, top, left + side, top + side))
+            variant = variant.resize((pixels, pixels), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        else:
+            variant = img.copy()
+            variant.thumbnail((pixels, pixels), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for fmt in VARIANT_FORMATS:
+            _atomic_save(variant, os.path.join(variants_folder, variant_name(filename, size, fmt)),
+                         fmt, quality=VARIANT_QUALITY[fmt])
+
+RAW_INDEX = 'raw_index'
+
+def content_name(data):
+    return f"{hashlib.sha256(data).hexdigest()}.jpg"
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+def _atomic_write(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+MAX_DIMENSION = 1920
+TARGET_SIZE = 100 * 1024 # 100KB
+MAX_QUALITY = 90
+QUALITY_FLOOR = 60 # Below this, shrinking the image looks better than lowering quality
+MIN_QUALITY = 30 # Last resort once the image is at MIN_DIMENSION
+MIN_DIMENSION = 320 # Never shrink below this to hit the target
+
+def encode_jpeg(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+def fit_quality(img, target_size, floor, stats):
+    """Highest quality in [floor, MAX_QUALITY] whose JPEG fits target_size (binary search).
+
+    When even floor does not fit, returns the floor encode so the caller can resize.
+    """
+    data = encode_jpeg(img, MAX_QUALITY)
+    stats['encode_attempts'] += 1
+    if len(data) <= target_size:
+        return data, MAX_QUALITY
+
+    # If even the floor quality is too big, searching is wasted work
+    best = encode_jpeg(img, floor)
+    stats['encode_attempts'] += 1
+    if len(best) > target_size:
+        return best, floor
+
+    best_quality = floor
+    lo, hi = floor + 1, MAX_QUALITY - 1
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        data = encode_jpeg(img, quality)
+        stats['encode_attempts'] += 1
+        if len(data) <= target_size:
+            best, best_quality = data, quality
+            lo = quality + 1
+        else:
+            hi = quality - 1
+    return best, best_quality
+
+def encode_image(raw_path, target_size=TARGET_SIZE):
+    """Decode the raw upload and encode it as a JPEG under target_size.
+
+    Returns (JPEG bytes, the decoded image before any fitting resize, stats).
+    """
+    stats = {'encode_attempts': 0, 'resizes': 0}
+    t = time.perf_counter()
+
+    # Open image using Pillow (handles HEIC via pillow_heif register_opener)
+    img = Image.open(raw_path)
+    # JPEG sources can be decoded at 1/2, 1/4 or 1/8 scale directly, as long
+    # as the result stays at least MAX_DIMENSION (no-op for other formats)
+    if max(img.size) > MAX_DIMENSION:
+        ratio = MAX_DIMENSION / max(img.size)
+        img.draft('RGB', (int(img.width * ratio), int(img.height * ratio)))
+    img = img.convert("RGB") # Convert to RGB for JPEG compatibility
+    stats['decode_ms'] = (time.perf_counter() - t) * 1000
+
+    # 1. Resize if too large (max 1920px max dimension)
+    t = time.perf_counter()
+    if max(img.size) > MAX_DIMENSION:
+        ratio = MAX_DIMENSION / max(img.size)
+        img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        stats['resizes'] += 1
+    resize_ms = (time.perf_counter() - t) * 1000
+
+    # 2. Encode in memory, binary searching quality; shrink only when
+    #    QUALITY_FLOOR does not fit, by the factor the size overshoot suggests
+    #    (JPEG size is roughly proportional to pixel count)
+    encode_ms = 0
+    base, scale = img, 1.0
+    while True:
+        at_min = min(img.size) <= MIN_DIMENSION
+        t = time.perf_counter()
+        data, quality = fit_quality(img, target_size, MIN_QUALITY if at_min else QUALITY_FLOOR, stats)
+        encode_ms += (time.perf_counter() - t) * 1000
+        if len(data) <= target_size or at_min:
+            break
+        t = time.perf_counter()
+        # Always resample from the base image so repeated steps do not compound blur
+        scale *= min(0.9, 0.95 * (target_size / len(data)) ** 0.5)
+        scale = max(scale, MIN_DIMENSION / min(base.size))
+        img = base.resize((int(base.width * scale), int(base.height * scale)), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        stats['resizes'] += 1
+        resize_ms += (time.perf_counter() - t) * 1000
+    stats['resize_ms'] = resize_ms
+    stats['encode_ms'] = encode_ms
+    stats.update({'quality': quality, 'bytes': len(data), 'width': img.width, 'height': img.height})
+    return data, base, stats
+
+def store_image(data, base, final_path, variants_folder, stats):
+    # Variants first (from the base image), so final_path existing means complete
+    if variants_folder:
+        t = time.perf_counter()
+        write_variants(base, data, variants_folder, os.path.basename(final_path))
+        stats['variants_ms'] = (time.perf_counter() - t) * 1000
+
+    # Single atomic write: readers never see a partial JPEG
+    t = time.perf_counter()
+    _atomic_write(final_path, data)
+    stats['write_ms'] = (time.perf_counter() - t) * 1000
+
+def process_image(raw_path, final_path, target_size=TARGET_SIZE, variants_folder=None):
+    """Convert the raw upload to a JPEG under target_size at final_path; returns per-stage stats.
+
+    With variants_folder, the avatar/card/WebP variants are written there first.
+    """
+    data, base, stats = encode_image(raw_path, target_size)
+    store_image(data, base, final_path, variants_folder, stats)
+    return stats
+
+def _claim(path):
+    # Bump mtime so garbage collection spares a file just handed out again;
+    # False when it is already gone and has to be stored again
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def run_job(raw_path, done_path, error_path, upload_folder, variants_folder=None):
+    # Runs in a pool process; the raw file is removed last so "done" is only
+    # visible once the JPEG is complete
+    final_path = None
+    try:
+        t = time.perf_counter()
+        raw_hash = file_sha256(raw_path)
+        index_path = os.path.join(upload_folder, RAW_INDEX, raw_hash)
+        filename = None
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as f:
+                filename = f.read().strip()
+
+        if filename and _claim(os.path.join(upload_folder, filename)):
+            # Exact same bytes seen before
+            stats = {'duplicate': 'raw', 'hash_ms': (time.perf_counter() - t) * 1000}
+        else:
+            data, base, stats = encode_image(raw_path)
+            filename = content_name(data)
+            final_path = os.path.join(upload_folder, filename)
+            if _claim(final_path):
+                # Different input, identical output
+                stats.update({'duplicate': 'output', 'write_ms': 0.0})
+            else:
+                store_image(data, base, final_path, variants_folder, stats)
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            _atomic_write(index_path, filename.encode())
+        _atomic_write(done_path, filename.encode())
+    except Exception as e:
+        if final_path and os.path.exists(f"{final_path}.tmp"):
+            os.remove(f"{final_path}.tmp")
+        with open(error_path, 'w', encoding='utf-8') as f:
+            f.write(str(e))
+        raise
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    return filename, stats
+
+
+def backfill_variant(upload_folder, variants_folder, filename):
+    # Variants for an upload processed before they existed; returns False if already there
+    wanted = [variant_name(filename, size, fmt) for size in ['full', *VARIANT_SIZES] for fmt in VARIANT_FORMATS]
+    if all(os.path.exists(os.path.join(variants_folder, v)) for v in wanted if v != filename):
+        return False
+    path = os.path.join(upload_folder, filename)
+    with open(path, 'rb') as f:
+        data = f.read()
+    write_variants(Image.open(io.BytesIO(data)).convert("RGB"), data, variants_folder, filename)
+    return True
+
+def backfill_variants(upload_folder, variants_folder, workers=None):
+    """Generate missing variants for every JPEG in upload_folder; returns (created, failed)."""
+    filenames = [f for f in os.listdir(upload_folder) if f.endswith('.jpg')]
+    created = failed = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_spawn) as executor:
+        futures = [executor.submit(backfill_variant, upload_folder, variants_folder, f) for f in filenames]
+        for filename, future in zip(filenames, futures):
+            try:
+                created += future.result()
+            except Exception as e:
+                failed += 1
+                logging.warning(f"Variant backfill failed for {filename}: {e}")
+    return created, failed
+
+
+def photo_of_variant(name):
+    # a1b2..._card.webp -> a1b2....jpg
+    stem = name.split('.', 1)[0]
+    base, _, size = stem.rpartition('_')
+    return f"{base if size in VARIANT_SIZES else stem}.jpg"
+
+def remove_photo(upload_folder, variants_folder, filename, dry_run=False, cutoff=None):
+    """Delete an upload and its variants; returns the bytes freed.
+
+    With cutoff, files modified after it are kept. The upload is first moved
+    aside and its mtime checked again, so a job that claimed it between the
+    caller's check and the delete (run_job dedupe) gets it back.
+    """
+    path = os.path.join(upload_folder, filename)
+    variants = [os.path.join(variants_folder, variant_name(filename, size, fmt))
+                for size in ['full', *VARIANT_SIZES] for fmt in VARIANT_FORMATS]
+    if dry_run:
+        return sum(os.path.getsize(p) for p in [path, *variants] if os.path.isfile(p))
+
+    freed = 0
+    aside = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            if cutoff is not None and os.path.getmtime(aside) > cutoff:
+                os.replace(aside, path)
+                return 0
+            freed += os.path.getsize(aside)
+            os.remove(aside)
+        except FileNotFoundError:
+            # Swept as a stale .tmp by a concurrent collect_garbage
+            pass
+
+    for variant in variants:
+        # Fresh variants belong to a job that is storing the photo again
+        try:
+            if cutoff is None or os.path.getmtime(variant) <= cutoff:
+                freed += os.path.getsize(variant)
+                os.remove(variant)
+        except FileNotFoundError:
+            pass
+    return freed
+
+def collect_garbage(upload_folder, variants_folder, referenced, grace=3600, dry_run=False):
+    """Delete uploads not in referenced, with their variants and raw index entries.
+
+    Files modified within grace seconds are kept: they may have just been
+    handed to a client that has not saved them to its profile yet.
+    Returns (removed filenames, bytes freed).
+    """
+    cutoff = time.time() - grace
+    removed, freed = [], 0
+    for name in os.listdir(upload_folder):
+        path = os.path.join(upload_folder, name)
+        if not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+            continue
+        if name.endswith('.jpg') and name not in referenced:
+            size = remove_photo(upload_folder, variants_folder, name, dry_run, cutoff)
+            if size:
+                freed += size
+                removed.append(name)
+        elif name.endswith('.tmp'):
+            # Left behind by a crashed job
+            freed += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+
+    # Variants whose photo was deleted by other means
+    gone = set(removed)
+    if os.path.isdir(variants_folder):
+        for name in os.listdir(variants_folder):
+            path = os.path.join(variants_folder, name)
+            photo = photo_of_variant(name)
+            # A .tmp is a variant a crashed job never finished
+            if photo not in gone and os.path.getmtime(path) <= cutoff \
+                    and (name.endswith('.tmp') or not os.path.exists(os.path.join(upload_folder, photo))):
+                freed += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+
+    index_folder = os.path.join(upload_folder, RAW_INDEX)
+    if os.path.isdir(index_folder) and not dry_run:
+        for name in os.listdir(index_folder):
+            path = os.path.join(index_folder, name)
+            if name.endswith('.tmp'):
+                if os.path.getmtime(path) <= cutoff:
+                    os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                target = f.read().strip()
+            if not os.path.exists(os.path.join(upload_folder, target)):
+                os.remove(path)
+    return removed, freed
+
+
+class ImagePipeline:
+    def __init__(self, upload_folder, queue_folder, workers=None, max_pending=64, variants_folder=None, on_done=None,
+                 job_timeout=600):
+        self.upload_folder = upload_folder
+        self.queue_folder = queue_folder
+        self.variants_folder = variants_folder
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        # Seconds after which a job still "processing" is reported failed: its
+        # worker, or the process that queued it, died before it could finish
+        self.job_timeout = job_timeout
+        # Called with each finished job's stats (None when it failed), e.g. for metrics
+        self.on_done = on_done
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._futures = {}
+        # Running totals over finished jobs, see stats()
+        self._totals = {'jobs': 0, 'failed': 0, 'duplicates': 0, 'encode_attempts': 0, 'resizes': 0,
+                        'decode_ms': 0.0, 'resize_ms': 0.0, 'encode_ms': 0.0, 'write_ms': 0.0, 'bytes': 0}
+        os.makedirs(queue_folder, exist_ok=True)
+
+    def _paths(self, job_id):
+        return (os.path.join(self.queue_folder, f"{job_id}.upload"),
+                os.path.join(self.queue_folder, f"{job_id}.done"),
+                os.path.join(self.queue_folder, f"{job_id}.error"))
+
+    def submit(self, save_raw):
+        """Reserve a slot, let save_raw(path) write the upload there and queue it. Returns the job id.
+
+        Raises PipelineFull when max_pending jobs are already waiting.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PipelineFull()
+            self._pending += 1
+            if self._executor is None:
+                # Created on first use so importing the app does not start processes
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_spawn)
+            executor = self._executor
+
+        job_id = str(uuid.uuid4())
+        raw_path, done_path, error_path = self._paths(job_id)
+        try:
+            save_raw(raw_path)
+            future = executor.submit(run_job, raw_path, done_path, error_path,
+                                     self.upload_folder, self.variants_folder)
+        except Exception:
+            self._release(job_id)
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+            raise
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f, executor))
+        return job_id
+
+    def _release(self, job_id):
+        with self._lock:
+            self._pending -= 1
+            self._futures.pop(job_id, None)
+
+    def _finish(self, job_id, future, executor):
+        self._release(job_id)
+        error = future.exception()
+        if error is not None:
+            self._fail(job_id, error, executor)
+        filename, stats = future.result() if error is None else (None, None)
+        if self.on_done is not None:
+            try:
+                self.on_done(stats)
+            except Exception as e:
+                logging.warning(f"Upload {job_id}: on_done failed: {e}")
+        if stats is None:
+            with self._lock:
+                self._totals['failed'] += 1
+            return
+        if stats.get('duplicate') == 'raw':
+            logging.info(f"Upload {job_id}: duplicate of {filename}, hash {stats['hash_ms']:.0f}ms")
+            with self._lock:
+                self._totals['jobs'] += 1
+                self._totals['duplicates'] += 1
+            return
+        logging.info(f"Upload {job_id}: {stats['encode_attempts']} encodes, q{stats['quality']}, "
+                     f"{stats['bytes']} bytes, decode {stats['decode_ms']:.0f}ms, resize {stats['resize_ms']:.0f}ms, "
+                     f"encode {stats['encode_ms']:.0f}ms, write {stats['write_ms']:.0f}ms")
+        with self._lock:
+            self._totals['jobs'] += 1
+            self._totals['duplicates'] += 'duplicate' in stats
+            for key in ('encode_attempts', 'resizes', 'decode_ms', 'resize_ms', 'encode_ms', 'write_ms', 'bytes'):
+                self._totals[key] += stats[key]
+
+    def _fail(self, job_id, error, executor):
+        raw_path, done_path, error_path = self._paths(job_id)
+        if not os.path.exists(error_path):
+            # The worker died before run_job could record the error and drop the raw file
+            _atomic_write(error_path, (str(error) or type(error).__name__).encode())
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+        if isinstance(error, BrokenProcessPool):
+            # A broken pool refuses new work; the next submit starts a fresh one
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        """Totals over finished jobs plus the current queue depth."""
+        with self._lock:
+            return {**self._totals, 'pending': self._pending}
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job finishes; returns the filename or raises the processing error.
+
+        Raises TimeoutError if it is still running after timeout seconds.
+        """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            try:
+                filename, _ = future.result(timeout)
+            except futures.TimeoutError:
+                raise TimeoutError(job_id)
+            return filename
+        status = self.status(job_id)
+        if status['status'] == 'done':
+            return status['filename']
+        raise RuntimeError(status.get('error', 'Unknown job'))
+
+    def status(self, job_id):
+        raw_path, done_path, error_path = self._paths(job_id)
+        if os.path.exists(raw_path):
+            try:
+                if time.time() - os.path.getmtime(raw_path) <= self.job_timeout:
+                    return {"status": "processing"}
+            except FileNotFoundError:
+                pass # Finished while we looked
+            else:
+                return {"status": "failed", "error": "Processing did not finish"}
+        if os.path.exists(done_path):
+            with open(done_path, encoding='utf-8') as f:
+                return {"status": "done", "filename": f.read()}
+        if os.path.exists(error_path):
+            with open(error_path, encoding='utf-8') as f:
+                return {"status": "failed", "error": f.read()}
+        return {"status": "unknown"}
+
+    def prune(self, max_age=86400):
+        """Remove .done/.error state of jobs finished more than max_age seconds ago,
+        and the raw files of jobs that never finished."""
+        cutoff = time.time() - max(max_age, self.job_timeout)
+        pruned = 0
+        for name in os.listdir(self.queue_folder):
+            path = os.path.join(self.queue_folder, name)
+            if name.endswith(('.done', '.error', '.upload')) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                pruned += 1
+        return pruned
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
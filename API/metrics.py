@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Request metrics in the Prometheus text format (see /metrics).
+# Counters and histograms live in this process; with several workers each
+# one is scraped (or reached through the load balancer) separately.
+# SQL is timed through engine events on every engine (primary and replicas)
+# and charged to the request that issued it via flask.g.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labels, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._lock = threading.Lock()
+        self._values = {} # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    out.append((f'{self.name}_bucket', self.labels + ('le',), key + (_number(bound),), cumulative))
+                out.append((f'{self.name}_sum', self.labels, key, series[-2]))
+                out.append((f'{self.name}_count', self.labels, key, series[-1]))
+        return out
+
+
+class Gauge:
+    """Read at scrape time from collect(), which returns {label values tuple: value}."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels, collect):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            logging.warning(f"Metric {self.name} failed: {e}")
+            return []
+        return [(self.name, self.labels, key, value) for key, value in sorted(values.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, label_names, label_values, value in metric.samples():
+                lines.append(f'{name}{_labels(label_names, label_values)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Per-request SQL accounting
+
+def track_sql(max_statements=50):
+    """Time every statement on every engine; requests see them in g.sql_statements / g.sql_ms."""
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+        if not has_request_context() or 'sql_ms' not in g:
+            return
+        g.sql_count += 1
+        g.sql_ms += ms
+        if len(g.sql_statements) < max_statements:
+            g.sql_statements.append((' '.join(statement.split()), ms))
+
+    @event.listens_for(Engine, 'handle_error')
+    def failed(context):
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+def start_request():
+    g.request_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_ms = 0.0
+    g.sql_statements = []
@@ -0,0 +1,131 @@
+import datetime
+import logging
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+
+# Versioned schema migrations.
+# The models in api.py describe the target schema. Each migration moves an
+# existing database one step towards it and is recorded in schema_version,
+# so `flask --app api migrate` only runs the steps a database has not seen.
+# Steps check before they change anything: a database that was partly
+# migrated by hand (or created by db.create_all()) is safe to run against.
+
+version_metadata = MetaData()
+schema_version = Table(
+    'schema_version', version_metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+def _columns(conn, table):
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+def _index_names(conn, table):
+    inspector = inspect(conn)
+    names = {ix['name'] for ix in inspector.get_indexes(table)}
+    names.update(uc['name'] for uc in inspector.get_unique_constraints(table))
+    return names
+
+def _create_indexes(conn, metadata, table, names):
+    # Indexes are declared once, on the models; this only creates the missing ones
+    existing = _index_names(conn, table)
+    for index in metadata.tables[table].indexes:
+        if index.name in names and index.name not in existing:
+            logging.info(f"Creating index {index.name} on {table}")
+            index.create(conn)
+
+
+@migration(1, "Create tables missing from the database (conversation, ...)")
+def create_tables(conn, metadata):
+    metadata.create_all(conn, checkfirst=True)
+
+@migration(2, "Add user_hobbies.hobbymask")
+def add_hobbymask(conn, metadata):
+    if 'hobbymask' not in _columns(conn, 'user_hobbies'):
+        # The model's type, so migrated and create_all() schemas agree (INT UNSIGNED on MySQL)
+        column_type = metadata.tables['user_hobbies'].c.hobbymask.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE user_hobbies ADD COLUMN hobbymask {column_type} NOT NULL DEFAULT 0"))
+
+@migration(3, "Indexes for the explore, like, chat, login and photo queries")
+def add_hot_path_indexes(conn, metadata):
+    _create_indexes(conn, metadata, 'user_like', {'ix_user_like_target', 'ix_user_like_liker'})
+    _create_indexes(conn, metadata, 'chat_history', {'ix_chat_history_pair', 'ix_chat_history_pair_rev'})
+    _create_indexes(conn, metadata, 'user', {'ix_user_phonenumber'})
+    _create_indexes(conn, metadata, 'user_hobbies', {'ix_user_hobbies_userid'})
+    _create_indexes(conn, metadata, 'user_photos', {'ix_user_photos_userid', *(f'ix_user_photos_photo{i}' for i in range(1, 6))})
+
+@migration(4, "One user_prefs row per user")
+def unique_user_prefs(conn, metadata):
+    if 'uq_user_prefs_userid' in _index_names(conn, 'user_prefs'):
+        return
+    # Every read takes the lowest id per user, so the other rows were never visible.
+    # The derived table is needed for MySQL, which cannot select from the table it deletes from.
+    removed = conn.execute(text(
+        "DELETE FROM user_prefs WHERE userid IS NOT NULL AND id NOT IN "
+        "(SELECT id FROM (SELECT MIN(id) AS id FROM user_prefs GROUP BY userid) AS keep)"
+    )).rowcount
+    if removed:
+        logging.warning(f"Removed {removed} duplicate user_prefs rows")
+    _create_indexes(conn, metadata, 'user_prefs', {'uq_user_prefs_userid'})
+
+@migration(5, "Indexes for the paginated like feeds")
+def add_like_feed_indexes(conn, metadata):
+    _create_indexes(conn, metadata, 'user_like', {'ix_user_like_target_date', 'ix_user_like_liker_date'})
+
+@migration(6, "Per-user version counters for conditional GETs")
+def add_user_versions(conn, metadata):
+    metadata.tables['user_version'].create(conn, checkfirst=True)
+    # Rows are also created on first bump; this saves every existing user that first miss
+    conn.execute(text(
+        "INSERT INTO user_version (userid, profile, chats, likes) "
+        "SELECT id, 0, 0, 0 FROM user WHERE id NOT IN (SELECT userid FROM user_version)"
+    ))
+
+@migration(7, "user_prefs.geolocation POINT and its SPATIAL index (MySQL)")
+def add_geolocation(conn, metadata):
+    # The models cannot declare POINT, so a database made by create_all() has no
+    # geolocation. Other databases answer radius queries from geo.GridIndex.
+    if conn.dialect.name != 'mysql':
+        return
+    if 'geolocation' not in _columns(conn, 'user_prefs'):
+        conn.execute(text("ALTER TABLE user_prefs ADD COLUMN geolocation POINT SRID 4326 NULL"))
+        conn.execute(text(
+            "UPDATE user_prefs SET geolocation = ST_GeomFromText("
+            "CONCAT('POINT(', COALESCE(latitude, 0), ' ', COALESCE(longitude, 0), ')'), 4326)"
+        ))
+        # A SPATIAL index needs NOT NULL, and the optimizer only uses it with the SRID
+        conn.execute(text("ALTER TABLE user_prefs MODIFY geolocation POINT SRID 4326 NOT NULL"))
+    indexed = {c for ix in inspect(conn).get_indexes('user_prefs') for c in ix['column_names']}
+    if 'geolocation' not in indexed:
+        conn.execute(text("CREATE SPATIAL INDEX ix_user_prefs_geolocation ON user_prefs (geolocation)"))
+
+
+def applied_versions(engine):
+    version_metadata.create_all(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {row.version for row in conn.execute(schema_version.select())}
+
+def migrate(engine, metadata, target=None):
+    """Apply pending migrations up to target (default: all); returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in done or (target is not None and version > target):
+            continue
+        logging.info(f"Migration {version}: {description}")
+        # MySQL commits DDL implicitly, which is why every step is idempotent
+        with engine.begin() as conn:
+            fn(conn, metadata)
+            conn.execute(schema_version.insert().values(
+                version=version, description=description, applied_at=datetime.datetime.now()))
+        applied.append(version)
+    return applied
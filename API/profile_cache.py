@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Read-through cache of hydrated profile dicts (user + hobbies + photos +
+# prefs), keyed by user id. Values are opaque here: api.hydrate_profiles
+# stores each profile with its user_version and ignores entries that are
+# behind, so a missed invalidation (another worker process with the memory
+# backend) never serves a stale profile. Writers still invalidate the ids
+# they touched to free them early; the TTL bounds the memory they hold.
+
+class ProfileCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._counter_lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _count(self, **deltas):
+        with self._counter_lock:
+            for key, n in deltas.items():
+                self._counters[key] += n
+
+    def get_many(self, keys):
+        """{key: value} for the keys that are cached and fresh."""
+        raise NotImplementedError
+
+    def set_many(self, items):
+        raise NotImplementedError
+
+    def invalidate(self, *keys):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._counter_lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'backend': type(self).__name__,
+            'size': len(self),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else None,
+        })
+        return stats
+
+
+class MemoryCache(ProfileCache):
+    """Per-process LRU: an OrderedDict of key -> (expires_at, value)."""
+
+    def __init__(self, max_entries=10000, ttl=300):
+        super().__init__(max_entries, ttl)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_many(self, keys):
+        found, expired = {}, 0
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self._entries[key]
+                    expired += 1
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+        self._count(hits=len(found), misses=len(keys) - len(found), expirations=expired)
+        return found
+
+    def set_many(self, items):
+        if not self.max_entries:
+            return
+        evicted = 0
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        self._count(evictions=evicted)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            removed = sum(self._entries.pop(key, None) is not None for key in keys)
+        self._count(invalidations=removed)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache(ProfileCache):
+    """Cache shared by every worker on the host: one JSON file per key.
+
+    Freshness is the file's mtime, so invalidating in one worker is seen by
+    all of them. The directory is pruned back under max_entries (oldest
+    files first) every prune_every writes.
+    """
+
+    def __init__(self, directory, max_entries=10000, ttl=300, prune_every=100):
+        super().__init__(max_entries, ttl)
+        self.directory = directory
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get_many(self, keys):
+        found, expired = {}, 0
+        cutoff = time.time() - self.ttl
+        for key in keys:
+            path = self._path(key)
+            try:
+                if os.path.getmtime(path) <= cutoff:
+                    os.remove(path)
+                    expired += 1
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    found[key] = json.load(f)
+            except (FileNotFoundError, ValueError):
+                # Missing, or removed/replaced by another worker mid-read
+                continue
+        self._count(hits=len(found), misses=len(keys) - len(found), expirations=expired)
+        return found
+
+    def set_many(self, items):
+        for key, value in items.items():
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        self._writes += len(items)
+        if self._writes >= self.prune_every:
+            self._writes = 0
+            self._prune()
+
+    def _prune(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except FileNotFoundError:
+                    continue
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+        evicted = 0
+        for _, name in sorted(entries)[:excess]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+                evicted += 1
+            except FileNotFoundError:
+                continue
+        self._count(evictions=evicted)
+
+    def invalidate(self, *keys):
+        removed = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+                removed += 1
+            except FileNotFoundError:
+                continue
+        self._count(invalidations=removed)
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+
+def create_cache(kind, directory=None, max_entries=10000, ttl=300):
+    if kind == 'memory':
+        return MemoryCache(max_entries, ttl)
+    if kind == 'file':
+        return FileCache(directory, max_entries, ttl)
+    if kind == 'off':
+        return MemoryCache(0, 0)
+    raise ValueError(f"Unknown profile cache: {kind}")
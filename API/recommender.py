@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from geo import haversine_km_array
+from hobbies import popcount
+
+# Precomputed /explore queues.
+# A background worker keeps a columnar snapshot of every user's prefs and
+# hobbies, scores all candidates for one user in a single NumPy pass and
+# stores the best ones as that user's queue. /explore pops from the queue.
+
+WEIGHTS = {
+    'gender': 3.0,          # Candidate is the gender I am interested in
+    'gender_back': 3.0,     # I am the gender the candidate is interested in
+    'relationship': 1.5,
+    'religion': 1.0,
+    'smoke': 0.5,
+    'drink': 0.5,
+    'hobbies': 2.0,         # Share of my hobbies the candidate also has
+    'distance': 2.0,
+    'recency': 1.0,         # How recently the candidate logged in
+}
+DISTANCE_SCALE_KM = 50
+RECENCY_SCALE_DAYS = 14
+UNKNOWN = -1
+EVERYONE = 3 # genderinterest value meaning any gender
+
+
+class CandidateTable:
+    """Columnar snapshot of user prefs, one array per attribute.
+
+    Built from rows of (userid, gender, genderinterest, relationshipinterest,
+    religion, is_smoke, is_drink, latitude, longitude, lastlogin, bondedwith,
+    hobbymask).
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.index = {int(uid): i for i, uid in enumerate(self.ids)}
+
+        def column(pos):
+            return np.array([UNKNOWN if r[pos] is None else int(r[pos]) for r in rows], dtype=np.int16)
+
+        self.gender, self.genderinterest = column(1), column(2)
+        self.relationship, self.religion = column(3), column(4)
+        self.smoke, self.drink = column(5), column(6)
+        self.lat = np.array([np.nan if r[7] is None else r[7] for r in rows], dtype=np.float64)
+        self.lon = np.array([np.nan if r[8] is None else r[8] for r in rows], dtype=np.float64)
+        # create_user stores 0/0 when no location was sent
+        no_location = (self.lat == 0) & (self.lon == 0)
+        self.lat[no_location] = np.nan
+        self.lon[no_location] = np.nan
+        self.lastlogin = np.array([r[9].timestamp() if r[9] else np.nan for r in rows], dtype=np.float64)
+        self.bonded = np.array([r[10] is not None for r in rows], dtype=bool)
+        self.hobbies = np.array([r[11] or 0 for r in rows], dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self, rows):
+        """Overwrite rows for users already in the table; returns False if any are new."""
+        fresh = CandidateTable(rows)
+        for j, uid in enumerate(fresh.ids):
+            i = self.index.get(int(uid))
+            if i is None:
+                return False
+            for name in ('gender', 'genderinterest', 'relationship', 'religion', 'smoke', 'drink',
+                         'lat', 'lon', 'lastlogin', 'bonded', 'hobbies'):
+                getattr(self, name)[i] = getattr(fresh, name)[j]
+        return True
+
+
+def _match(a, b):
+    # 1 when equal, 0 when different, 0.5 when either side is unknown
+    known = (a != UNKNOWN) & (b != UNKNOWN)
+    return np.where(known, (a == b).astype(np.float64), 0.5)
+
+def _interested(interest, gender):
+    # 1 when interest is that gender or everyone, 0 otherwise, 0.5 when either side is unknown
+    known = (interest != UNKNOWN) & (gender != UNKNOWN)
+    wanted = (interest == EVERYONE) | (interest == gender)
+    return np.where(known, wanted.astype(np.float64), 0.5)
+
+def score(table, i, now=None, weights=WEIGHTS):
+    """Scores of every candidate for the user at row i (higher is better)."""
+    now = now or time.time()
+    total = weights['gender'] * _interested(table.genderinterest[i], table.gender)
+    total += weights['gender_back'] * _interested(table.genderinterest, table.gender[i])
+    total += weights['relationship'] * _match(table.relationship, table.relationship[i])
+    total += weights['religion'] * _match(table.religion, table.religion[i])
+    total += weights['smoke'] * _match(table.smoke, table.smoke[i])
+    total += weights['drink'] * _match(table.drink, table.drink[i])
+
+    mine = popcount(table.hobbies[i:i + 1])[0]
+    if mine:
+        total += weights['hobbies'] * popcount(table.hobbies & table.hobbies[i]) / mine
+
+    if not np.isnan(table.lat[i]):
+        distance = haversine_km_array(table.lat[i], table.lon[i], table.lat, table.lon)
+        total += weights['distance'] * np.nan_to_num(np.exp(-distance / DISTANCE_SCALE_KM))
+
+    days_idle = (now - table.lastlogin) / 86400
+    total += weights['recency'] * np.nan_to_num(np.exp(-np.clip(days_idle, 0, None) / RECENCY_SCALE_DAYS))
+
+    total[i] = -np.inf
+    total[table.bonded] = -np.inf
+    return total
+
+
+class RecommendationQueues:
+    """Per-user ranked candidate queues, filled by a background worker.
+
+    load_rows(user_ids=None) returns CandidateTable rows (all users when
+    user_ids is None); load_excluded(user_id) returns ids the user must not
+    be shown (already liked or chatting).
+    """
+
+    def __init__(self, load_rows, load_excluded, queue_size=200, active_ttl=3600, reload_interval=600):
+        self.load_rows = load_rows
+        self.load_excluded = load_excluded
+        self.queue_size = queue_size
+        self.active_ttl = active_ttl
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._table = None
+        self._loaded_at = 0
+        self._queues = {}
+        self._active = {}
+        self._dirty = set()
+        self._changed = set()
+
+    # Request side (cheap, never touches the DB)
+
+    def pop(self, user_id, n):
+        """Up to n candidate ids from the user's queue; [] until the worker has built it."""
+        with self._lock:
+            self._active[user_id] = time.monotonic()
+            queue = self._queues.get(user_id)
+            if queue is None or len(queue) < n:
+                self._dirty.add(user_id)
+                self._wakeup.set()
+            if not queue:
+                return []
+            return [queue.popleft() for _ in range(min(n, len(queue)))]
+
+    def discard(self, user_id, candidate_id):
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue and candidate_id in queue:
+                queue.remove(candidate_id)
+
+    def mark_changed(self, *user_ids):
+        """Prefs/hobbies/bond of these users changed: reload their rows and rebuild their queues.
+
+        They are also dropped from every other queue, since they were scored
+        on their old rows; a queue picks them up again when it is rebuilt.
+        """
+        with self._lock:
+            for user_id in user_ids:
+                self._changed.add(user_id)
+                self._dirty.add(user_id)
+        self._wakeup.set()
+
+    # Worker side
+
+    def refresh(self):
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            cutoff = time.monotonic() - self.active_ttl
+            self._active = {u: t for u, t in self._active.items() if t >= cutoff}
+            for user_id in list(self._queues):
+                if user_id not in self._active:
+                    del self._queues[user_id]
+            dirty = {u for u in self._dirty if u in self._active}
+            self._dirty = set()
+            if changed:
+                for user_id, queue in self._queues.items():
+                    if not changed.isdisjoint(queue):
+                        self._queues[user_id] = deque(u for u in queue if u not in changed)
+
+        table = self._table
+        if table is None or time.monotonic() - self._loaded_at > self.reload_interval \
+                or (changed and not table.update(self.load_rows(sorted(changed)))):
+            table = CandidateTable(self.load_rows())
+            self._table, self._loaded_at = table, time.monotonic()
+
+        for user_id in dirty:
+            queue = self._build(table, user_id)
+            with self._lock:
+                self._queues[user_id] = queue
+
+    def _build(self, table, user_id):
+        i = table.index.get(user_id)
+        if i is None or table.bonded[i]:
+            return deque()
+        scores = score(table, i)
+        excluded = [table.index[u] for u in self.load_excluded(user_id) if u in table.index]
+        scores[excluded] = -np.inf
+
+        k = min(self.queue_size, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k else np.array([], dtype=np.int64)
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        return deque(int(uid) for uid in table.ids[top])
+
+    def start(self, context, interval=30):
+        """Run refresh() in a daemon thread every interval seconds, or sooner when woken."""
+        def run():
+            while True:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+                try:
+                    with context():
+                        self.refresh()
+                except Exception as e:
+                    logging.warning(f"Recommendation refresh failed: {e}")
+
+        thread = threading.Thread(target=run, name='recommendation-worker', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,119 @@
+import gzip
+
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response serialization and compression.
+# JSONProvider replaces Flask's json module behind jsonify: orjson when it is
+# installed (same key order and date handling as the stdlib path), and
+# MessagePack instead of JSON when the client asks for it with
+# Accept: application/msgpack. compress() gzips/brotlis finished bodies
+# above a size threshold. Both optional packages fall back quietly:
+# without msgpack every client gets JSON, without brotli gzip is used.
+
+MSGPACK = 'application/msgpack'
+COMPRESSIBLE = ('application/json', MSGPACK, 'text/plain', 'text/html')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # Text-sized payloads; 11 costs far more CPU for a few percent
+
+def accepts_msgpack(accept_mimetypes):
+    if msgpack is None:
+        return False
+    best = accept_mimetypes.best_match(['application/json', MSGPACK, 'application/x-msgpack'])
+    return best in (MSGPACK, 'application/x-msgpack')
+
+def wants_msgpack():
+    return has_request_context() and accepts_msgpack(request.accept_mimetypes)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider with orjson dumps/loads and MessagePack negotiation in response()."""
+
+    use_orjson = orjson is not None
+
+    def wants_msgpack(self):
+        # Overridden where the current request is not Flask's (see asgi.py)
+        return wants_msgpack()
+
+    def _orjson_default(self, value):
+        # Types orjson leaves to us (dates with OPT_PASSTHROUGH_DATETIME) go through Flask's rules
+        return self.default(value)
+
+    def dumps(self, obj, **kwargs):
+        if not self.use_orjson or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode('utf-8')
+
+    def _orjson_dumps(self, obj):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self._orjson_default, option=option)
+
+    def loads(self, s, **kwargs):
+        if not self.use_orjson or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.wants_msgpack():
+            response = self._app.response_class(msgpack.packb(obj, default=self.default), mimetype=MSGPACK)
+        elif self.use_orjson and not ((self.compact is None and self._app.debug) or self.compact is False):
+            response = self._app.response_class(self._orjson_dumps(obj) + b'\n', mimetype=self.mimetype)
+        else:
+            return super().response(obj)
+        if msgpack is not None:
+            response.vary.add('Accept')
+        return response
+
+
+def negotiate_encoding(accept_encoding):
+    """'br', 'gzip' or None, by the client's preference (brotli wins ties)."""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = accept_encoding.best_match(offered)
+    return best if best and accept_encoding[best] > 0 else None
+
+def compressible(response):
+    return (response.status_code in (200, 201) and 'Content-Encoding' not in response.headers
+            and response.mimetype in COMPRESSIBLE)
+
+def encode_body(body, accept_encoding, min_bytes):
+    """(compressed body, encoding), or (body, None) when it is too small or nothing is accepted."""
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= min_bytes else None
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), encoding
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), encoding
+    return body, None
+
+def mark_encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    # A strong ETag names the uncompressed bytes
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+def compress(response, accept_encoding, min_bytes):
+    """Compress a finished response body in place when it is worth it."""
+    if response.direct_passthrough or response.is_streamed or not compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    body, encoding = encode_body(response.get_data(), accept_encoding, min_bytes)
+    if encoding is not None:
+        response.set_data(body)
+        mark_encoded(response, encoding)
+    return response
@@ -0,0 +1,62 @@
+from flask import Response, current_app, request, stream_with_context
+
+# Streamed JSON bodies for results that are not bounded by a page size.
+# Rows are pulled from a server-side cursor (Query.yield_per) and written
+# out CHUNK_ROWS at a time, so memory per request does not grow with the
+# result. Clients get either one JSON array (same shape as jsonify) or
+# NDJSON, one object per line, with ?format=ndjson or Accept: application/x-ndjson.
+
+NDJSON = 'application/x-ndjson'
+CHUNK_ROWS = 500
+
+def accepts_ndjson(args, accept_mimetypes):
+    if args.get('format') == 'ndjson':
+        return True
+    return accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+def wants_ndjson():
+    return accepts_ndjson(request.args, request.accept_mimetypes)
+
+def _batches(items):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == CHUNK_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _dumps(value, json=None):
+    # Same key order and escaping as jsonify, without the whitespace
+    return (json or current_app.json).dumps(value, separators=(',', ':'))
+
+# Chunk encoders, shared with the async app (asgi.py) which passes its own json provider
+def array_chunk(batch, first, json=None):
+    # One dumps call per batch, minus its brackets
+    return ('' if first else ',') + _dumps(batch, json)[1:-1]
+
+def ndjson_chunk(batch, json=None):
+    return ''.join(_dumps(item, json) + '\n' for item in batch)
+
+def json_array(items):
+    yield '['
+    for i, batch in enumerate(_batches(items)):
+        yield array_chunk(batch, i == 0)
+    yield ']'
+
+def ndjson(items):
+    for batch in _batches(items):
+        yield ndjson_chunk(batch)
+
+def stream(items, as_ndjson=None, headers=None):
+    """Response streaming items (dicts) as a JSON array or NDJSON.
+
+    The request context, and with it the DB session, stays open until the
+    last chunk is sent.
+    """
+    if as_ndjson is None:
+        as_ndjson = wants_ndjson()
+    body = ndjson(items) if as_ndjson else json_array(items)
+    return Response(stream_with_context(body), mimetype=NDJSON if as_ndjson else 'application/json',
+                    headers=headers)
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import time
+from urllib.parse import urlsplit
+
+# Concurrent-connection capacity: the threaded Flask server (api.py) against
+# the ASGI app (asgi.py). At each level, that many clients hold
+# /chat/subscribe long-polls open (idle chat screens) while a fixed set of
+# active clients poll /chat/history and open profiles. Reports how many held
+# connections failed, and the latency and throughput left for active users.
+# Start both servers on the same database, e.g. one seeded by seed.py:
+#   cd API && flask --app api run --with-threads -p 5000
+#   cd API && hypercorn asgi:app -b 127.0.0.1:8000
+# Usage: python benchmarks/async_capacity.py [--sync URL] [--async URL] [--levels 100,500,1000] [--duration S]
+
+parser = argparse.ArgumentParser(description="Held connections vs active request latency, sync vs async server")
+parser.add_argument('--sync', default='http://127.0.0.1:5000', help="threaded Flask server ('' to skip)")
+parser.add_argument('--async', dest='async_url', default='http://127.0.0.1:8000', help="ASGI server ('' to skip)")
+parser.add_argument('--api-key', default=os.getenv('API_KEY', 'CHANGE_ME_TO_SECURE_KEY'))
+parser.add_argument('--users', type=int, default=10000, help="seeded user ids to pick from")
+parser.add_argument('--levels', default='100,500,1000', help="held long-poll connections per run")
+parser.add_argument('--active', type=int, default=16, help="clients issuing normal requests")
+parser.add_argument('--duration', type=float, default=15, help="measured seconds per level")
+parser.add_argument('--hold', type=float, default=10, help="long-poll timeout asked of the server")
+parser.add_argument('--ramp', type=float, default=2, help="seconds over which held connections open")
+args = parser.parse_args()
+
+NO_MESSAGE = 2 ** 31 - 1 # after_id no message reaches, so every poll is held for --hold
+
+async def get(url, path, timeout):
+    """Status code of GET path; one connection per request."""
+    host, port = url.hostname, url.port or 80
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nx-api-key: {args.api_key}\r\n"
+                     f"Connection: close\r\n\r\n".encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1]) if response else 0
+
+def pair():
+    a, b = random.sample(range(1, args.users + 1), 2)
+    return a, b
+
+async def subscriber(url, stats, stop):
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    a, b = pair()
+    while not stop.is_set():
+        try:
+            status = await get(url, f"/chat/subscribe?user1={a}&user2={b}&after_id={NO_MESSAGE}&timeout={args.hold}",
+                               args.hold + 10)
+            stats['held' if status == 200 else 'errors'] += 1
+        except (OSError, asyncio.TimeoutError):
+            stats['errors'] += 1
+            await asyncio.sleep(0.5)
+
+async def active_client(url, latencies, errors, stop, measuring):
+    while not stop.is_set():
+        a, b = pair()
+        path = random.choice([f"/chat/history?user1={a}&user2={b}&limit=20", f"/users/{a}"])
+        start = time.perf_counter()
+        try:
+            ok = await get(url, path, 30) == 200
+        except (OSError, asyncio.TimeoutError):
+            ok = False
+        if measuring.is_set():
+            if ok:
+                latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                errors.append(path)
+
+async def run_level(url, level):
+    stop, measuring = asyncio.Event(), asyncio.Event()
+    stats = {'held': 0, 'errors': 0}
+    latencies, errors = [], []
+    tasks = [asyncio.create_task(subscriber(url, stats, stop)) for _ in range(level)]
+    tasks += [asyncio.create_task(active_client(url, latencies, errors, stop, measuring)) for _ in range(args.active)]
+    await asyncio.sleep(args.ramp) # All held connections opened
+    measuring.set()
+    await asyncio.sleep(args.duration)
+    measuring.clear()
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats, latencies, errors
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100)[p - 1] if len(values) > 1 else (values[0] if values else float('nan'))
+
+async def main():
+    # Every held connection is a socket on this side too
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    levels = [int(n) for n in args.levels.split(',')]
+    servers = [(name, urlsplit(url)) for name, url in (('sync', args.sync), ('async', args.async_url)) if url]
+
+    print(f"{args.active} active clients, {args.duration:.0f}s per level, long-polls held {args.hold:.0f}s")
+    print(f"{'server':>6} {'held':>6} {'polls ok':>9} {'poll err':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'req err':>8}")
+    for level in levels:
+        for name, url in servers:
+            stats, latencies, errors = await run_level(url, level)
+            print(f"{name:>6} {level:>6} {stats['held']:>9} {stats['errors']:>9} {len(latencies) / args.duration:>8.1f} "
+                  f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} {len(errors):>8}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
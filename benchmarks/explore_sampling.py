@@ -0,0 +1,60 @@
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+# Compares the old ORDER BY RANDOM() explore query with explore_random_sample()
+# on a throwaway SQLite database.
+# Usage: python benchmarks/explore_sampling.py [user counts...]   (default 10000 100000 1000000)
+
+SIZES = [int(n) for n in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+RUNS = 5
+ME = 1
+
+db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'API'))
+
+import api
+import migrations
+from api import app, db, User, func
+
+def seed(conn, start, end):
+    rows = ((i, f'user{i}', b'x', '1995-01-01', str(i)) for i in range(start, end + 1))
+    conn.executemany("INSERT INTO user (id, name, passwordhash, dateofbirth, phonenumber) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO user_prefs (userid, bondedwith) VALUES (?, ?)",
+                     ((i, i + 1 if i % 50 == 0 else None) for i in range(start, end + 1)))
+    # Current user has liked and chatted with a few hundred people
+    conn.executemany("INSERT INTO user_like (userid, wholikesid) VALUES (?, ?)",
+                     ((random.randint(2, end), ME) for _ in range(300)))
+    conn.executemany("INSERT INTO chat_history (userid1, userid2, message) VALUES (?, ?, 'hi')",
+                     ((ME, random.randint(2, end)) for _ in range(50)))
+    conn.commit()
+
+def timed(fn):
+    samples = []
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    return statistics.median(samples)
+
+with app.app_context():
+    # The migrated schema: the exclusion subqueries use ix_user_like_liker
+    # (migration 3) and uq_user_prefs_userid (migration 4)
+    migrations.migrate(db.engine, db.metadata)
+    conn = sqlite3.connect(db_path)
+
+    seeded = 0
+    print(f"{'users':>10} {'ORDER BY RANDOM() ms':>22} {'keyset sample ms':>18} {'speedup':>8}")
+    for size in sorted(SIZES):
+        seed(conn, seeded + 1, size)
+        seeded = size
+        exclusions = api.explore_exclusions(ME)
+
+        old = timed(lambda: User.query.filter(*exclusions).order_by(func.random()).limit(api.EXPLORE_LIMIT).all())
+        new = timed(lambda: api.explore_random_sample(exclusions))
+        print(f"{size:>10} {old:>22.1f} {new:>18.1f} {old / new:>7.1f}x")
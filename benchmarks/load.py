@@ -0,0 +1,245 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+# End-to-end load test against a running API seeded with benchmarks/seed.py.
+# Each worker plays one user at a time: it logs in, then runs a session of
+# actions drawn from MIX (browse the deck, like from it, open the chat list,
+# send and poll messages with a partner from it, upload a photo) before
+# switching to another user. Reports p50/p95/p99 latency and throughput per
+# route; --save stores the run as JSON and --baseline compares against one
+# (exit 1 when a route's p95, or the total throughput, regressed by more than
+# --tolerance).
+# Usage: python benchmarks/load.py [--url URL] [--users N] [--duration S] [--concurrency N]
+#                                  [--save FILE] [--baseline FILE]
+
+# Relative weight of each action in a session
+MIX = {
+    'login': 5,
+    'explore': 20,
+    'like': 20,
+    'profile': 8,
+    'chat_list': 15,
+    'chat_send': 10,
+    'chat_poll': 20,
+    'upload': 2,
+}
+SESSION_ACTIONS = 20 # Actions per user before switching to another one
+PASSWORD = 'password' # What seed.py gives every user
+
+parser = argparse.ArgumentParser(description="Replay a realistic request mix against the API")
+parser.add_argument('--url', default='http://127.0.0.1:5000')
+parser.add_argument('--api-key', default=os.getenv('API_KEY', 'CHANGE_ME_TO_SECURE_KEY'))
+parser.add_argument('--users', type=int, default=10000, help="seeded user ids to pick from")
+parser.add_argument('--first-user', type=int, default=1)
+parser.add_argument('--duration', type=float, default=60, help="measured seconds")
+parser.add_argument('--warmup', type=float, default=5, help="unmeasured seconds before that")
+parser.add_argument('--concurrency', type=int, default=16, help="concurrent simulated users")
+parser.add_argument('--mix', default=None, help="override weights, e.g. explore=50,like=50")
+parser.add_argument('--save', help="write the results to this JSON file")
+parser.add_argument('--baseline', help="compare with results saved by --save")
+parser.add_argument('--tolerance', type=float, default=0.10, help="allowed p95/throughput regression (0.10 = 10%%)")
+args = parser.parse_args()
+
+if args.mix:
+    MIX = {name: float(weight) for name, weight in (item.split('=') for item in args.mix.split(','))}
+
+def photo_bytes():
+    buf = io.BytesIO()
+    Image.new('RGB', (1200, 1600), (200, 120, 90)).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+PHOTO = photo_bytes()
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.recording = False
+
+    def add(self, route, ms, ok):
+        if not self.recording:
+            return
+        with self._lock:
+            self.latencies.setdefault(route, []).append(ms)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+class VirtualUser:
+    """One simulated client session with the state a real app would keep."""
+
+    def __init__(self, session, recorder):
+        self.session = session
+        self.recorder = recorder
+        self.user_id = random.randint(args.first_user, args.first_user + args.users - 1)
+        self.deck = []
+        self.partners = []
+        self.last_seen = {}
+
+    def call(self, route, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, args.url + path, timeout=30, **kwargs)
+            ok = response.status_code < 500
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.add(route, (time.perf_counter() - start) * 1000, ok)
+        return response if response is not None and response.status_code < 400 else None
+
+    def login(self):
+        self.call('POST /login', 'POST', '/login',
+                  json={'phonenumber': f'08{self.user_id:09d}', 'password': PASSWORD})
+
+    def explore(self):
+        response = self.call('GET /explore', 'GET', '/explore', params={'current_user_id': self.user_id})
+        cards = response.json() if response is not None else []
+        self.deck = [card['id'] for card in cards] if isinstance(cards, list) else []
+
+    def like(self):
+        if not self.deck:
+            return self.explore()
+        self.call('POST /like', 'POST', '/like',
+                  json={'source_user_id': self.user_id, 'target_user_id': self.deck.pop(0)})
+
+    def profile(self):
+        other = random.choice(self.deck or self.partners or [self.user_id])
+        self.call('GET /users/<id>', 'GET', f'/users/{other}')
+
+    def chat_list(self):
+        response = self.call('GET /chat/list', 'GET', '/chat/list', params={'current_user_id': self.user_id})
+        self.partners = [chat['id'] for chat in response.json()] if response is not None else []
+
+    def chat_send(self):
+        if not self.partners:
+            return self.chat_list()
+        self.call('POST /chat/send', 'POST', '/chat/send',
+                  json={'sender_id': self.user_id, 'receiver_id': random.choice(self.partners), 'message': 'load test'})
+
+    def chat_poll(self):
+        if not self.partners:
+            return self.chat_list()
+        partner = random.choice(self.partners)
+        params = {'user1': self.user_id, 'user2': partner}
+        if partner in self.last_seen:
+            params['after_id'] = self.last_seen[partner]
+        else:
+            # Opening a chat loads the latest page
+            params['limit'] = 50
+        response = self.call('GET /chat/history', 'GET', '/chat/history', params=params)
+        messages = response.json() if response is not None else []
+        if messages:
+            self.last_seen[partner] = messages[-1]['id']
+        else:
+            self.last_seen.setdefault(partner, 0)
+
+    def upload(self):
+        # Unique bytes, as real photos are; identical ones are deduplicated by the pipeline
+        self.call('POST /upload', 'POST', '/upload',
+                  files={'file': ('photo.jpg', PHOTO + os.urandom(16), 'image/jpeg')})
+
+
+def worker(recorder, stop_at):
+    session = requests.Session()
+    session.headers['x-api-key'] = args.api_key
+    actions, weights = list(MIX), list(MIX.values())
+    while time.monotonic() < stop_at:
+        user = VirtualUser(session, recorder)
+        user.login()
+        for action in random.choices(actions, weights, k=SESSION_ACTIONS):
+            if time.monotonic() >= stop_at:
+                break
+            getattr(user, action)()
+
+def percentile(sorted_values, p):
+    # Nearest rank
+    return sorted_values[max(0, int(round(p / 100 * len(sorted_values))) - 1)]
+
+def route_stats(values, errors, elapsed):
+    values.sort()
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'rps': round(len(values) / elapsed, 2),
+        'p50': round(percentile(values, 50), 2),
+        'p95': round(percentile(values, 95), 2),
+        'p99': round(percentile(values, 99), 2),
+        'max': round(values[-1], 2),
+    }
+
+def summarise(recorder, elapsed):
+    routes = {route: route_stats(values, recorder.errors.get(route, 0), elapsed)
+              for route, values in sorted(recorder.latencies.items())}
+    everything = [v for values in recorder.latencies.values() for v in values]
+    if everything:
+        routes['ALL'] = route_stats(everything, sum(recorder.errors.values()), elapsed)
+    return routes
+
+def report(routes, baseline=None):
+    print(f"{'route':<18} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+          + (f" {'p95 vs base':>12} {'req/s vs base':>14}" if baseline else ''))
+    regressions = []
+    for route, r in routes.items():
+        line = (f"{route:<18} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.1f} "
+                f"{r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} {r['max']:>8.1f}")
+        base = (baseline or {}).get(route)
+        if base:
+            p95_change = r['p95'] / base['p95'] - 1 if base['p95'] else 0
+            rps_change = r['rps'] / base['rps'] - 1 if base['rps'] else 0
+            line += f" {p95_change:>+12.0%} {rps_change:>+14.0%}"
+            # Per-route request rates follow the random mix, only the total is compared
+            if p95_change > args.tolerance or (route == 'ALL' and rps_change < -args.tolerance):
+                regressions.append(route)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+def main():
+    recorder = Recorder()
+    start = time.monotonic()
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+    print(f"{args.url}: {args.concurrency} users, {args.warmup:.0f}s warmup + {args.duration:.0f}s, "
+          f"user ids {args.first_user}..{args.first_user + args.users - 1}")
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(worker, recorder, stop_at) for _ in range(args.concurrency)]
+        time.sleep(max(0, measure_from - time.monotonic()))
+        recorder.recording = True
+        for future in futures:
+            future.result()
+    elapsed = time.monotonic() - measure_from
+    routes = summarise(recorder, elapsed)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['routes']
+    regressions = report(routes, baseline)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'url': args.url, 'concurrency': args.concurrency, 'duration': args.duration,
+                'users': args.users, 'mix': MIX, 'routes': routes,
+            }, f, indent=2)
+        print(f"Saved to {args.save}")
+    if regressions:
+        print(f"FAILED: {len(regressions)} route(s) regressed more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
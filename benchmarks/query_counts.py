@@ -0,0 +1,128 @@
+import datetime
+import hashlib
+import os
+import random
+import re
+import sys
+import tempfile
+
+# Query count regression check for the routes that hydrate profile cards:
+# /explore, /matches and /users/<id>. Each route is run against a seeded
+# database with the profile cache off, counting the statements it issues
+# (engine before_cursor_execute, as in query_plans.py). Exits 1 when a route
+# goes over its statement budget, or reads a profile table (user_hobbies,
+# user_photos, user_prefs) more often than a batched read needs, which is
+# what a return to per-card queries looks like.
+# Usage: python benchmarks/query_counts.py [users]   (default 2000)
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+ME, BONDED = 1, (2, 3)
+
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'counts.db')}"
+os.environ['PROFILE_CACHE'] = 'off'
+os.environ['RECOMMENDER_ENABLED'] = '0'
+os.environ['ACTIVITY_FLUSH_INTERVAL'] = '3600' # No background last-seen writes while counting
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'API'))
+
+import api
+import db_config
+import migrations
+from api import app, db
+
+PROFILE_TABLES = ('user_hobbies', 'user_photos', 'user_prefs')
+
+# (path, statement budget, reads allowed per profile table, fewest cards for the run to count)
+ROUTES = [
+    (f'/users/{ME}', 6, 1, 1),
+    (f'/users/{BONDED[0]}', 7, 1, 1), # + the partner's name
+    (f'/explore?current_user_id={ME}&sort=random', 2 + 1 + api.EXPLORE_SAMPLE_PROBES * 4 + 1 + 3, 2, api.EXPLORE_LIMIT),
+    (f'/explore?current_user_id={ME}&sort=hobbies', 8, 2, api.EXPLORE_LIMIT),
+    (f'/explore?current_user_id={ME}&radius_km=200', 8, 2, api.EXPLORE_LIMIT),
+    # One hydration per feed; the same count at any page size
+    (f'/matches?current_user_id={ME}&limit=5', 12, 2, 10),
+    (f'/matches?current_user_id={ME}&limit=50', 12, 2, 100),
+]
+
+def seed():
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    rows = range(1, USERS + 1)
+    db.session.execute(api.User.__table__.insert(), [
+        {'id': i, 'name': f'user{i}', 'passwordhash': hashlib.sha512(b'x').digest(),
+         'dateofbirth': datetime.date(1995, 1, 1), 'phonenumber': f'08{i:09d}'} for i in rows])
+    db.session.execute(api.UserPrefs.__table__.insert(), [
+        {'userid': i, 'gender': i % 2 + 1, 'genderinterest': (i + 1) % 2 + 1, 'religion': i % 10 + 1,
+         'latitude': -6.2 + random.uniform(-0.5, 0.5), 'longitude': 106.8 + random.uniform(-0.5, 0.5),
+         'lastlogin': now, 'bondedwith': None} for i in rows])
+    db.session.execute(api.UserHobbies.__table__.insert(), [
+        {'userid': i, 'hobby1': i % 20 + 1, 'hobby2': (i * 7) % 20 + 1,
+         'hobbymask': (1 << (i % 20)) | (1 << ((i * 7) % 20))} for i in rows])
+    db.session.execute(api.UserPhotos.__table__.insert(), [{'userid': i, 'photo1': f'{i:064x}.jpg'} for i in rows])
+    # 60 likes each way for ME, so both /matches feeds fill a 50 page
+    db.session.execute(api.UserLike.__table__.insert(), [
+        {'userid': ME, 'wholikesid': i, 'likedate': today} for i in range(10, 70)]
+        + [{'userid': i, 'wholikesid': ME, 'likedate': today} for i in range(70, 130)])
+    a, b = BONDED
+    api.UserPrefs.query.filter_by(userid=a).update({'bondedwith': b})
+    api.UserPrefs.query.filter_by(userid=b).update({'bondedwith': a})
+    db.session.commit()
+
+def main_table(statement):
+    # Table of the outermost FROM; hydration reads are "SELECT ... FROM <table> WHERE ..."
+    match = re.search(r'\bFROM\s+"?(\w+)"?', statement)
+    return match.group(1) if match else None
+
+def cards(body):
+    if isinstance(body, list):
+        return len(body)
+    if 'users' in body:
+        return len(body['users'])
+    if 'liked_me' in body:
+        return len(body['liked_me']) + len(body['my_likes'])
+    return 1
+
+def main():
+    with app.app_context():
+        migrations.migrate(db.engine, db.metadata)
+        seed()
+        # In-process indexes are built once per worker, not per request
+        api.get_location_index()
+        api.get_hobby_matrix()
+
+        captured = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            captured.append(statement)
+        db.event.listen(db.engine, 'before_cursor_execute', capture)
+
+        client = app.test_client()
+        headers = {'x-api-key': db_config.API_KEY}
+        failures = 0
+        print(f"{USERS} users, profile cache off")
+        for path, budget, per_table, min_cards in ROUTES:
+            captured.clear()
+            response = client.get(path, headers=headers)
+            statements = list(captured)
+            n_cards = cards(response.get_json())
+            reads = {t: sum(main_table(s) == t for s in statements) for t in PROFILE_TABLES}
+            problems = []
+            if response.status_code != 200:
+                problems.append(f"status {response.status_code}")
+            if n_cards < min_cards:
+                problems.append(f"only {n_cards} cards, too few to tell")
+            if len(statements) > budget:
+                problems.append(f"{len(statements)} statements, budget {budget}")
+            problems += [f"{n} reads of {t}" for t, n in reads.items() if n > per_table]
+            print(f"{path:<50} {n_cards:>4} cards {len(statements):>3} statements  {'; '.join(problems) or 'ok'}")
+            if problems:
+                failures += 1
+                for statement in statements:
+                    print(f"         {' '.join(statement.split())[:160]}")
+        db.event.remove(db.engine, 'before_cursor_execute', capture)
+
+    if failures:
+        print(f"FAILED: {failures} route(s)")
+        sys.exit(1)
+    print("Statement counts within budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import datetime
+import hashlib
+import os
+import random
+import re
+import sys
+import tempfile
+
+# Query plan regression check: runs every endpoint once against a seeded
+# database, EXPLAINs each SELECT/UPDATE/DELETE it issued and exits 1 if any
+# of them does a full table scan.
+# Uses a throwaway SQLite database, or DATABASE_URL if set (it gets seeded,
+# so point it at a scratch MySQL database only).
+# Usage: python benchmarks/query_plans.py [users]   (default 10000; small tables make the planner prefer scans)
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+ME, OTHER = 1, 2
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+# Every request should reach the database
+os.environ['RECOMMENDER_ENABLED'] = '0'
+os.environ['PROFILE_CACHE'] = 'off'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'API'))
+
+import db_config
+import api
+import migrations
+from api import app, db
+
+# Scans that are intended, keyed by (endpoint, table)
+ALLOWED_SCANS = {
+    ('GET /users', 'user'): "LIMIT 20 with no filter, stops after 20 rows",
+}
+
+def seed():
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    pwd = hashlib.sha512(b'password').digest()
+    rows = range(1, USERS + 1)
+    db.session.execute(api.User.__table__.insert(), [
+        {'id': i, 'name': f'user{i}', 'passwordhash': pwd, 'dateofbirth': datetime.date(1995, 1, 1),
+         'phonenumber': f'08{i:09d}'} for i in rows])
+    # Male/female (1/2) each interested in the other, as the app codes them; geolocation on MySQL
+    api.insert_prefs([
+        {'userid': i, 'gender': i % 2 + 1, 'genderinterest': (i + 1) % 2 + 1, 'religion': i % 10 + 1,
+         'latitude': -6.2 + random.uniform(-1, 1), 'longitude': 106.8 + random.uniform(-1, 1),
+         'lastlogin': now} for i in rows])
+    db.session.execute(api.UserHobbies.__table__.insert(), [
+        {'userid': i, 'hobby1': i % 20 + 1, 'hobby2': (i * 7) % 20 + 1,
+         'hobbymask': (1 << (i % 20)) | (1 << ((i * 7) % 20))} for i in rows])
+    db.session.execute(api.UserPhotos.__table__.insert(), [
+        {'userid': i, 'photo1': f'{i:064x}.jpg'} for i in rows])
+    db.session.execute(api.UserLike.__table__.insert(), [
+        {'userid': random.randint(1, USERS), 'wholikesid': random.randint(1, USERS), 'likedate': today}
+        for _ in range(USERS * 5)])
+    db.session.execute(api.UserLike.__table__.insert(), [
+        {'userid': ME, 'wholikesid': i, 'likedate': today} for i in range(3, 40)])
+    db.session.commit()
+
+    pairs = {tuple(sorted(random.sample(range(1, USERS + 1), 2))) for _ in range(USERS)} | {(ME, OTHER)}
+    db.session.execute(api.ChatHistory.__table__.insert(), [
+        {'userid1': a, 'userid2': b, 'message': 'hi', 'datetime': now} for a, b in pairs for _ in range(3)])
+    db.session.commit()
+    for msg in api.ChatHistory.query.filter(api.ChatHistory.id % 3 == 0).all():
+        api.record_conversation_message(msg)
+    db.session.commit()
+
+    # Planner statistics
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text("ANALYZE"))
+    else:
+        for table in db.metadata.tables:
+            db.session.execute(db.text(f"ANALYZE TABLE `{table}`"))
+    db.session.commit()
+
+ENDPOINTS = [
+    ('GET', '/users', None),
+    ('GET', f'/users/{ME}', None),
+    ('POST', '/login', {'phonenumber': f'08{ME:09d}', 'password': 'password'}),
+    ('GET', f'/explore?current_user_id={ME}&sort=random', None),
+    ('GET', f'/explore?current_user_id={ME}&sort=distance&radius_km=50', None),
+    ('GET', f'/explore?current_user_id={ME}&sort=hobbies', None),
+    ('POST', '/like', {'source_user_id': ME, 'target_user_id': 50}),
+    ('POST', '/like/batch', {'source_user_id': ME, 'swipes': [{'target_user_id': t, 'action': 'like'} for t in range(3, 60)]
+                            + [{'target_user_id': 60, 'action': 'pass'}, {'target_user_id': 61}, {'target_user_id': 61}]}),
+    ('POST', '/like/remove', {'source_user_id': ME, 'target_user_id': 50}),
+    ('POST', '/chat/start', {'user_id_1': ME, 'user_id_2': 3}),
+    ('POST', '/chat/send', {'sender_id': ME, 'receiver_id': OTHER, 'message': 'hello'}),
+    ('GET', f'/chat/list?current_user_id={ME}', None),
+    ('GET', f'/chat/history?user1={ME}&user2={OTHER}', None),
+    ('GET', f'/chat/history?user1={ME}&user2={OTHER}&before_id=1000000&limit=20', None),
+    ('GET', f'/chat/subscribe?user1={ME}&user2={OTHER}&after_id=0&timeout=0', None),
+    ('POST', '/chat/read', {'user_id': ME, 'partner_id': OTHER}),
+    ('GET', f'/matches?current_user_id={ME}', None),
+    ('GET', f'/matches/liked_me?current_user_id={ME}&limit=10&cursor={datetime.date.today()}:20', None),
+    ('GET', f'/matches/my_likes?current_user_id={ME}&limit=10&cursor=none:20', None),
+    ('GET', f'/matches/counts?current_user_id={ME}', None),
+    ('PUT', f'/users/{ME}', {'prefs': {'religion': 2}, 'hobbies': {'hobby1': 4}, 'photos': {'photo2': 'b.jpg'}}),
+    ('POST', '/change_password', {'user_id': ME, 'old_password': 'password', 'new_password': 'password'}),
+    ('POST', '/bond/confirm', {'user_id_1': 10, 'user_id_2': 11}),
+    ('POST', '/bond/break', {'user_id': 10}),
+    ('POST', '/delete_user', {'user_id': USERS}),
+]
+
+def explain(statement, parameters):
+    """Names of the tables the statement reads with a full table scan."""
+    with db.engine.connect() as conn:
+        if db.engine.dialect.name == 'sqlite':
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            # "SCAN user" is a table scan; "SCAN user USING INDEX ..." walks an index.
+            # Reading back a materialized subquery (already bounded by its own plan) is not.
+            derived = {m.group(1) for row in plan for m in [re.match(r'MATERIALIZE (\w+)$', row[-1])] if m}
+            return [m.group(1) for row in plan for m in [re.match(r'SCAN (\w+)$', row[-1])]
+                    if m and m.group(1) != 'CONSTANT' and m.group(1) not in derived], plan
+        plan = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+        return [row['table'] for row in plan if row['type'] == 'ALL' and not row['table'].startswith('<derived')], plan
+
+def main():
+    with app.app_context():
+        migrations.migrate(db.engine, db.metadata)
+        seed()
+        # In-process indexes rebuild from a full scan by design; build them before capturing
+        api.get_location_index()
+        api.get_hobby_matrix()
+
+        captured = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                captured.append((statement, parameters))
+        db.event.listen(db.engine, 'before_cursor_execute', capture)
+
+        client = app.test_client()
+        headers = {'x-api-key': db_config.API_KEY}
+        failures = 0
+        print(f"{db.engine.dialect.name}, {USERS} users")
+        for method, path, body in ENDPOINTS:
+            name = f"{method} {path.split('?')[0]}"
+            captured.clear()
+            response = client.open(path, method=method, json=body, headers=headers)
+            response.get_data() # Streamed bodies run their queries as they are read
+            statements = list(dict.fromkeys(
+                (s, tuple(p) if isinstance(p, list) else p) for s, p in captured))
+            captured.clear()
+            scans = []
+            for statement, parameters in statements:
+                tables, plan = explain(statement, parameters)
+                scans.extend((table, statement, plan) for table in tables if (name, table) not in ALLOWED_SCANS)
+            status = f"{len(scans)} full scan(s)" if scans else 'ok'
+            print(f"{method:>6} {path:<60} {response.status_code}  {len(statements):>2} queries  {status}")
+            for table, statement, plan in scans:
+                print(f"         scan of {table}: {' '.join(statement.split())}")
+                for row in plan:
+                    print(f"           | {row[-1] if db.engine.dialect.name == 'sqlite' else dict(row)}")
+            failures += len(scans)
+        db.event.remove(db.engine, 'before_cursor_execute', capture)
+
+    if failures:
+        print(f"FAILED: {failures} full table scan(s)")
+        sys.exit(1)
+    print("No full table scans")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+
+# Scoring check for recommender.py: a user interested in Everyone (3) must
+# rank male and female candidates exactly as a user targeting that gender
+# does, in both directions of the gender match, and distances must agree
+# with the ones /explore reports. Exits 1 on a mismatch.
+# Usage: python benchmarks/recommender_scores.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'API'))
+
+import geo
+import recommender
+
+MALE, FEMALE, OTHER = 1, 2, 3
+MEN, WOMEN, EVERYONE = 1, 2, 3
+NOW = datetime.datetime(2024, 1, 1)
+
+def row(userid, gender, interest):
+    # Everything but gender and interest is the same, so only those two can move a score
+    return (userid, gender, interest, 1, 1, 0, 0, -6.2, 106.8, NOW, None, 0b11)
+
+PEOPLE = {
+    'viewer_everyone': (MALE, EVERYONE),
+    'viewer_men': (MALE, MEN),
+    'viewer_women': (MALE, WOMEN),
+    'male_likes_men': (MALE, MEN),
+    'female_likes_men': (FEMALE, MEN),
+    'female_likes_everyone': (FEMALE, EVERYONE),
+    'female_likes_women': (FEMALE, WOMEN),
+    'other_likes_everyone': (OTHER, EVERYONE),
+}
+ids = {name: i + 1 for i, name in enumerate(PEOPLE)}
+table = recommender.CandidateTable(row(ids[name], *prefs) for name, prefs in PEOPLE.items())
+
+def scored(viewer, candidate):
+    return score_of[viewer][table.index[ids[candidate]]]
+
+score_of = {v: recommender.score(table, table.index[ids[v]], now=NOW.timestamp())
+            for v in ('viewer_everyone', 'viewer_men', 'viewer_women')}
+
+checks = [
+    ("Everyone ranks a man like a Men viewer", scored('viewer_everyone', 'male_likes_men'), scored('viewer_men', 'male_likes_men')),
+    ("Everyone ranks a woman like a Women viewer", scored('viewer_everyone', 'female_likes_men'), scored('viewer_women', 'female_likes_men')),
+    ("Everyone ranks men and women alike", scored('viewer_everyone', 'male_likes_men'), scored('viewer_everyone', 'female_likes_men')),
+    ("A candidate into Everyone matches back", scored('viewer_women', 'female_likes_everyone'), scored('viewer_women', 'female_likes_men')),
+    ("Everyone includes Other", scored('viewer_everyone', 'other_likes_everyone'), scored('viewer_everyone', 'female_likes_men')),
+    ("A woman into women does not match back", scored('viewer_women', 'female_likes_women'), scored('viewer_women', 'female_likes_men') - recommender.WEIGHTS['gender_back']),
+    ("Men viewer does not match a woman", scored('viewer_men', 'female_likes_men'), scored('viewer_men', 'male_likes_men') - recommender.WEIGHTS['gender']),
+]
+
+unknown = recommender._interested(np.array([recommender.UNKNOWN, EVERYONE]), np.array([MALE, recommender.UNKNOWN]))
+checks.append(("Unknown interest or gender scores half", list(unknown), [0.5, 0.5]))
+
+# The distance term uses the same great-circle distance as /explore
+points = [(-6.2, 106.8), (-7.25, 112.75), (51.5, -0.12), (-6.2, -73.2)]
+lats, lons = np.array(points).T
+checks.append(("Distances match /explore's haversine_km", list(geo.haversine_km_array(-6.2, 106.8, lats, lons)),
+               [geo.haversine_km(-6.2, 106.8, lat, lon) for lat, lon in points]))
+
+failures = 0
+for name, got, expected in checks:
+    ok = np.allclose(got, expected)
+    failures += not ok
+    print(f"{name:<45} {'ok' if ok else f'got {got}, expected {expected}'}")
+
+if failures:
+    print(f"FAILED: {failures} check(s)")
+    sys.exit(1)
+print("Recommender scores consistent")
@@ -0,0 +1,241 @@
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+# Synthetic dataset for load tests: users with prefs, hobbies, photos and
+# locations around a few cities, likes (some mutual), chats between matches
+# with their conversation summaries, and a few bonded pairs. Everything goes
+# in with multi-row inserts, appended after the highest existing user id.
+# Every seeded user logs in with phone 08<id, 9 digits> and password "password".
+# Targets DATABASE_URL if set (sqlite:///... or mysql+pymysql://...), otherwise
+# the MySQL database from db_config.
+# Usage: python benchmarks/seed.py [users] [--likes N] [--messages N] [--photos N] [--seed N]
+
+parser = argparse.ArgumentParser(description="Seed the API database with synthetic users")
+parser.add_argument('users', type=int, nargs='?', default=10000)
+parser.add_argument('--likes', type=int, default=20, help="average likes given per user")
+parser.add_argument('--mutual', type=float, default=0.15, help="share of likes that are returned")
+parser.add_argument('--chats', type=float, default=0.6, help="share of matches that have a chat")
+parser.add_argument('--messages', type=int, default=20, help="most messages per chat")
+parser.add_argument('--bonded', type=float, default=0.02, help="share of matches that are bonded")
+parser.add_argument('--photos', type=int, default=24, help="distinct photo files to generate and share")
+parser.add_argument('--seed', type=int, default=None, help="random seed, for a repeatable dataset")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'API'))
+import api
+import image_pipeline
+import migrations
+from api import app, db
+
+BATCH = 5000
+PASSWORD = 'password'
+HOBBIES = 20 # Hobby ids the app offers
+# Codes the app uses (lib/data/model): gender 1 Male, 2 Female, 3 Other;
+# genderinterest 1 Men, 2 Women, 3 Everyone; relationshipinterest 1..3; religion 1..10
+MALE, FEMALE, OTHER = 1, 2, 3
+EVERYONE = 3
+RELATIONSHIP_INTERESTS = 3
+RELIGIONS = 10
+PHOTO_COLUMNS = ('photo1', 'photo2', 'photo3', 'photo4', 'photo5')
+# (name, latitude, longitude, spread in degrees, share of users)
+CITIES = [
+    ('Jakarta', -6.2088, 106.8456, 0.20, 0.40),
+    ('Bandung', -6.9175, 107.6191, 0.10, 0.15),
+    ('Surabaya', -7.2575, 112.7521, 0.12, 0.15),
+    ('Yogyakarta', -7.7956, 110.3695, 0.08, 0.10),
+    ('Denpasar', -8.6705, 115.2126, 0.08, 0.10),
+    ('Medan', 3.5952, 98.6722, 0.12, 0.10),
+]
+BIOS = ["Coffee first.", "Weekend hiker", "Looking for someone to cook with", "Cat person", "Ask me about my playlist",
+        "Beach > mountains", "Learning to surf", "Bookworm", None]
+MESSAGES = ["Hi!", "How was your day?", "Haha same", "Coffee this weekend?", "Sure, where?",
+            "That place near the station", "Sounds good", "See you then!", "What are you up to?", "lol"]
+
+def batched(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def insert(model, rows, insert_rows=None):
+    count = 0
+    for batch in batched(rows):
+        if insert_rows:
+            insert_rows(batch)
+        else:
+            db.session.execute(model.__table__.insert(), batch)
+        count += len(batch)
+    db.session.commit()
+    return count
+
+def synthetic_photos(n):
+    """n distinct portrait JPEGs in the upload folder (with their variants); returns their names."""
+    names = []
+    for _ in range(n):
+        y, x = np.mgrid[0:250, 0:200]
+        colour = np.random.randint(0, 256, 3)
+        base = np.stack([(x + colour[0]) % 256, (y + colour[1]) % 256, (x + y + colour[2]) % 256], axis=-1)
+        img = Image.fromarray(np.clip(base + np.random.normal(0, 10, base.shape), 0, 255).astype(np.uint8))
+        img = img.resize((800, 1000))
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=85)
+        data = buf.getvalue()
+        name = image_pipeline.content_name(data)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+            image_pipeline.write_variants(img, data, app.config['VARIANTS_FOLDER'], name)
+        names.append(name)
+    return names
+
+def make_users(first, count, now):
+    """Per user: (gender, interest, city, mask); plus the rows for user, user_prefs, user_hobbies, user_photos."""
+    pwd = hashlib.sha512(PASSWORD.encode('utf-8')).digest()
+    people, users, prefs, hobbies = {}, [], [], []
+    for uid in range(first, first + count):
+        gender = random.choices((MALE, FEMALE, OTHER), weights=(48, 48, 4))[0]
+        if gender == OTHER:
+            interest = EVERYONE
+        else:
+            # Interest codes line up with gender codes: Men is 1 like Male
+            interest = random.choices((MALE + FEMALE - gender, gender, EVERYONE), weights=(85, 7, 8))[0]
+        city = random.choices(range(len(CITIES)), weights=[c[4] for c in CITIES])[0]
+        _, lat, lon, spread, _ = CITIES[city]
+        picked = random.sample(range(1, HOBBIES + 1), random.randint(1, 5))
+        people[uid] = (gender, interest, city)
+        users.append({'id': uid, 'name': f'user{uid}', 'email': f'user{uid}@example.com', 'passwordhash': pwd,
+                      'dateofbirth': datetime.date(random.randint(1985, 2005), random.randint(1, 12), random.randint(1, 28)),
+                      'phonenumber': f'08{uid:09d}'})
+        prefs.append({'userid': uid, 'gender': gender, 'genderinterest': interest, 'height': int(random.gauss(165, 9)),
+                      'relationshipinterest': random.randint(1, RELATIONSHIP_INTERESTS),
+                      'religion': random.randint(1, RELIGIONS),
+                      'is_smoke': random.random() < 0.25, 'is_drink': random.random() < 0.35,
+                      'bio': random.choice(BIOS), 'openingmove': "What's your favourite food?",
+                      'latitude': random.gauss(lat, spread), 'longitude': random.gauss(lon, spread),
+                      # Most users were active recently, a long tail has gone quiet
+                      'lastlogin': now - datetime.timedelta(days=min(random.expovariate(1 / 5), 90)),
+                      'bondedwith': None})
+        hobbies.append({'userid': uid, **{f'hobby{i}': picked[i - 1] if i <= len(picked) else None for i in range(1, 6)},
+                        'hobbymask': sum(1 << (h - 1) for h in picked)})
+    return people, users, prefs, hobbies
+
+def make_photos(users, photos):
+    # Every row binds all five columns, multi-row inserts need the same keys throughout
+    for user in users:
+        picked = random.sample(photos, random.randint(1, min(3, len(photos))))
+        yield {'userid': user['id'], **{column: picked[i] if i < len(picked) else None
+                                        for i, column in enumerate(PHOTO_COLUMNS)}}
+
+def make_likes(people, today):
+    """Likes mostly within the same city and matching interest; returns (like rows, matched pairs)."""
+    by_city_gender = {}
+    for uid, (gender, _, city) in people.items():
+        by_city_gender.setdefault((city, gender), []).append(uid)
+    likes, matches = set(), []
+    for uid, (_, interest, city) in people.items():
+        wanted = (MALE, FEMALE, OTHER) if interest == EVERYONE else (interest,)
+        pool = [u for gender in wanted for u in by_city_gender.get((city, gender), [])] \
+            or [u for gender in (MALE, FEMALE, OTHER) for u in by_city_gender.get((city, gender), [])]
+        n = min(int(random.expovariate(1 / args.likes)) if args.likes else 0, len(pool))
+        for target in random.sample(pool, n):
+            if target == uid or (target, uid) in likes:
+                continue
+            likes.add((target, uid))
+            if (uid, target) in likes:
+                matches.append((uid, target))
+            elif random.random() < args.mutual:
+                likes.add((uid, target))
+                matches.append((uid, target))
+    rows = [{'userid': target, 'wholikesid': source, 'likedate': today - datetime.timedelta(days=random.randint(0, 60))}
+            for target, source in likes]
+    return rows, matches
+
+def make_chats(matches, first_message_id, now):
+    """chat_history rows with explicit ids, and the matching conversation summaries."""
+    messages, conversations = [], []
+    message_id = first_message_id
+    for a, b in matches:
+        if random.random() >= args.chats:
+            continue
+        at = now - datetime.timedelta(days=random.uniform(0, 30))
+        sender, receiver = a, b
+        for _ in range(random.randint(1, max(args.messages, 1))):
+            at += datetime.timedelta(seconds=random.expovariate(1 / 600))
+            if random.random() < 0.6:
+                sender, receiver = receiver, sender
+            text = random.choice(MESSAGES)
+            messages.append({'id': message_id, 'userid1': sender, 'userid2': receiver, 'message': text,
+                             'datetime': min(at, now)})
+            message_id += 1
+        low, high = sorted((a, b))
+        unread = random.randint(0, 3)
+        conversations.append({'userid1': low, 'userid2': high, 'lastmessageid': message_id - 1,
+                              'lastmessage': text, 'lastmessagetime': min(at, now),
+                              'unread1': unread if receiver == low else 0,
+                              'unread2': unread if receiver == high else 0})
+    return messages, conversations
+
+def analyze():
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text("ANALYZE"))
+    else:
+        for table in db.metadata.tables:
+            db.session.execute(db.text(f"ANALYZE TABLE `{table}`"))
+    db.session.commit()
+
+def main():
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    start = time.perf_counter()
+    now = datetime.datetime.now().replace(microsecond=0)
+
+    with app.app_context():
+        migrations.migrate(db.engine, db.metadata)
+        first = (db.session.query(db.func.max(api.User.id)).scalar() or 0) + 1
+        first_message_id = (db.session.query(db.func.max(api.ChatHistory.id)).scalar() or 0) + 1
+        print(f"{db.engine.dialect.name}: seeding users {first}..{first + args.users - 1}")
+
+        photos = synthetic_photos(max(args.photos, 1))
+        people, users, prefs, hobbies = make_users(first, args.users, now)
+        likes, matches = make_likes(people, now.date())
+        messages, conversations = make_chats(matches, first_message_id, now)
+        # Bonded pairs come out of the matches; a user is bonded to at most one other
+        by_user = {p['userid']: p for p in prefs}
+        for a, b in random.sample(matches, int(len(matches) * args.bonded)):
+            if by_user[a]['bondedwith'] is None and by_user[b]['bondedwith'] is None:
+                by_user[a]['bondedwith'], by_user[b]['bondedwith'] = b, a
+
+        counts = {
+            'user': insert(api.User, users),
+            'user_prefs': insert(api.UserPrefs, prefs, api.insert_prefs), # geolocation on MySQL
+            'user_hobbies': insert(api.UserHobbies, hobbies),
+            'user_photos': insert(api.UserPhotos, make_photos(users, photos)),
+            'user_version': insert(api.UserVersion, ({'userid': u['id'], 'profile': 0, 'chats': 0, 'likes': 0}
+                                                     for u in users)),
+            'user_like': insert(api.UserLike, likes),
+            'chat_history': insert(api.ChatHistory, messages),
+            'conversation': insert(api.Conversation, conversations),
+        }
+        analyze()
+
+    print(", ".join(f"{table} {n}" for table, n in counts.items()))
+    print(f"{len(matches)} matches, {sum(1 for p in prefs if p['bondedwith'])} bonded users, "
+          f"{len(photos)} photo files, {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Serialize time and bytes on the wire for real /explore and /matches
+# payloads: Flask's stdlib JSON encoder vs orjson vs MessagePack, each raw,
+# gzipped and brotli'd. msgpack and brotli are skipped when not installed.
+# Usage: python benchmarks/serialization.py [users] [runs]   (default 2000 users, 500 runs)
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+RUNS = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+ME = 1
+
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'serialize.db')}"
+os.environ['RECOMMENDER_ENABLED'] = '0'
+os.environ['COMPRESS_MIN_BYTES'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'API'))
+
+from flask.json.provider import DefaultJSONProvider
+
+import api
+import db_config
+import migrations
+import serialization
+from api import app, db
+
+def seed():
+    now = datetime.datetime.now()
+    rows = range(1, USERS + 1)
+    db.session.execute(api.User.__table__.insert(), [
+        {'id': i, 'name': f'user{i}', 'email': f'user{i}@example.com', 'passwordhash': hashlib.sha512(b'x').digest(),
+         'dateofbirth': datetime.date(1995, 1, 1), 'phonenumber': f'08{i:09d}'} for i in rows])
+    db.session.execute(api.UserPrefs.__table__.insert(), [
+        {'userid': i, 'gender': i % 2 + 1, 'genderinterest': (i + 1) % 2 + 1, 'height': 165, 'relationshipinterest': 2,
+         'is_smoke': False, 'is_drink': True, 'religion': i % 10 + 1, 'bio': "Coffee first. Weekend hiker.",
+         'openingmove': "What's your favourite food?", 'latitude': -6.2 + random.uniform(-1, 1),
+         'longitude': 106.8 + random.uniform(-1, 1), 'lastlogin': now} for i in rows])
+    db.session.execute(api.UserHobbies.__table__.insert(), [
+        {'userid': i, 'hobby1': i % 20 + 1, 'hobby2': (i * 7) % 20 + 1, 'hobby3': (i * 3) % 20 + 1} for i in rows])
+    db.session.execute(api.UserPhotos.__table__.insert(), [
+        {'userid': i, 'photo1': f'{i:064x}.jpg', 'photo2': f'{i + 1:064x}.jpg'} for i in rows])
+    db.session.execute(api.UserLike.__table__.insert(), [
+        {'userid': ME, 'wholikesid': i, 'likedate': now.date()} for i in range(2, 60)]
+        + [{'userid': i, 'wholikesid': ME, 'likedate': now.date()} for i in range(60, 110)])
+    db.session.commit()
+
+def timed(fn):
+    samples = []
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1e6)
+    return statistics.median(samples)
+
+def main():
+    with app.app_context():
+        migrations.migrate(db.engine, db.metadata)
+        seed()
+    client = app.test_client()
+    headers = {'x-api-key': db_config.API_KEY}
+    payloads = {
+        'explore': client.get(f'/explore?current_user_id={ME}&sort=random', headers=headers).get_json(),
+        'matches': client.get(f'/matches?current_user_id={ME}', headers=headers).get_json(),
+    }
+
+    with app.app_context():
+        stdlib, fast = DefaultJSONProvider(app), serialization.JSONProvider(app)
+        encoders = {'json': lambda obj: stdlib.dumps(obj, separators=(',', ':')).encode('utf-8')}
+        if serialization.orjson is not None:
+            encoders['orjson'] = lambda obj: fast._orjson_dumps(obj)
+        if serialization.msgpack is not None:
+            encoders['msgpack'] = lambda obj: serialization.msgpack.packb(obj)
+        compressors = {'raw': lambda b: b,
+                       'gzip': lambda b: gzip.compress(b, compresslevel=serialization.GZIP_LEVEL)}
+        if serialization.brotli is not None:
+            compressors['br'] = lambda b: serialization.brotli.compress(b, quality=serialization.BROTLI_QUALITY)
+
+        print(f"{RUNS} runs per case, median")
+        header = f"{'payload':>8} {'encoder':>8} {'encode us':>10}" + ''.join(
+            f" {name + ' B':>9} {name + ' us':>9}" for name in compressors)
+        print(header)
+        for name, payload in payloads.items():
+            items = len(payload) if isinstance(payload, list) else sum(len(v) for v in payload.values() if isinstance(v, list))
+            for encoder, encode in encoders.items():
+                body = encode(payload)
+                if encoder != 'msgpack':
+                    assert json.loads(body) == payload
+                line = f"{name:>8} {encoder:>8} {timed(lambda: encode(payload)):>10.0f}"
+                for compress in compressors.values():
+                    line += f" {len(compress(body)):>9} {timed(lambda: compress(body)):>9.0f}"
+                print(line)
+            print(f"{'':>8} ({items} profiles)")
+
+if __name__ == "__main__":
+    main()
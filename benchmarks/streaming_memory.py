@@ -0,0 +1,72 @@
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Peak Python heap while serving a whole conversation from /chat/history:
+# the streamed response (server-side cursor + chunked JSON) against the old
+# .all() + jsonify path, for growing conversation lengths. The streamed peak
+# should stay flat.
+# Usage: python benchmarks/streaming_memory.py [message counts...]   (default 10000 50000 200000)
+
+SIZES = [int(n) for n in sys.argv[1:]] or [10_000, 50_000, 200_000]
+A, B = 1, 2
+
+db_path = os.path.join(tempfile.mkdtemp(), 'stream.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'API'))
+
+import api
+import db_config
+import migrations
+from api import app, db, jsonify
+
+def seed(conn, start, end):
+    now = datetime.datetime.now().isoformat(sep=' ')
+    conn.executemany("INSERT INTO chat_history (id, userid1, userid2, message, datetime) VALUES (?, ?, ?, ?, ?)",
+                     ((i, A if i % 2 else B, B if i % 2 else A, f"message number {i} " + 'x' * 60, now)
+                      for i in range(start, end + 1)))
+    conn.commit()
+
+def measure(fn):
+    tracemalloc.start()
+    t = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024, elapsed * 1000, size
+
+def streamed(client, fmt=''):
+    response = client.get(f'/chat/history?user1={A}&user2={B}{fmt}', headers={'x-api-key': db_config.API_KEY},
+                          buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return size
+
+def legacy():
+    # get_chat_history before streaming
+    with app.test_request_context():
+        messages = api.conversation_query(A, B).order_by(api.ChatHistory.id.asc()).all()
+        body = jsonify([m.to_dict() for m in messages]).get_data()
+        db.session.remove()
+    return len(body)
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrations.migrate(db.engine, db.metadata)
+    client = app.test_client()
+    conn = sqlite3.connect(db_path)
+
+    seeded = 0
+    print(f"{'messages':>9} {'legacy MB':>10} {'ms':>7} {'stream MB':>10} {'ms':>7} {'ndjson MB':>10} {'ms':>7}")
+    for size in sorted(SIZES):
+        seed(conn, seeded + 1, size)
+        seeded = size
+        old_mb, old_ms, _ = measure(legacy)
+        new_mb, new_ms, _ = measure(lambda: streamed(client))
+        nd_mb, nd_ms, _ = measure(lambda: streamed(client, '&format=ndjson'))
+        print(f"{size:>9} {old_mb:>10.1f} {old_ms:>7.0f} {new_mb:>10.1f} {new_ms:>7.0f} {nd_mb:>10.1f} {nd_ms:>7.0f}")
@@ -1,22 +1,67 @@
-
 import requests
+import statistics
 import sys
+import time
+
+# Checks the caching headers of /uploads/<file> and benchmarks the photo
+# serving path against a running API: full downloads, ETag revalidation
+# (304), Range requests and the avatar variant.
+# Usage: python debug_image.py [filename] [requests per case] [base url]
+
+FILENAME = sys.argv[1] if len(sys.argv) > 1 else "eb687676-d686-4fd5-8aeb-ef561bca909c.jpg" # Using one of the existing files
+REQUESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+BASE_URL = sys.argv[3] if len(sys.argv) > 3 else "http://127.0.0.1:5000"
 
-BASE_URL = "http://127.0.0.1:5000"
-FILENAME = "eb687676-d686-4fd5-8aeb-ef561bca909c.jpg" # Using one of the existing files
+def run_case(session, url, headers, expected_status):
+    latencies, transferred = [], 0
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        t = time.perf_counter()
+        response = session.get(url, headers=headers)
+        latencies.append((time.perf_counter() - t) * 1000)
+        if response.status_code != expected_status:
+            raise RuntimeError(f"Expected {expected_status}, got {response.status_code}")
+        transferred += len(response.content)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'rps': REQUESTS / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+        'kb': transferred / REQUESTS / 1024,
+    }
 
 try:
     url = f"{BASE_URL}/uploads/{FILENAME}"
     print(f"Requesting: {url}")
-    response = requests.get(url)
-    
+    session = requests.Session()
+    response = session.get(url)
+
     print(f"Status Code: {response.status_code}")
-    print(f"Headers: {response.headers}")
-    
-    if response.status_code == 200:
-        print(f"Content Length: {len(response.content)}")
-    else:
+    if response.status_code != 200:
         print(f"Response Body: {response.text}")
+        sys.exit(1)
+
+    print(f"Content Length: {len(response.content)}")
+    for header in ('Cache-Control', 'ETag', 'Last-Modified', 'Accept-Ranges', 'Vary', 'X-Accel-Redirect', 'X-Sendfile'):
+        print(f"{header}: {response.headers.get(header, '-')}")
+
+    etag = response.headers.get('ETag')
+    cases = [
+        ('full GET', url, {}, 200),
+        ('If-None-Match', url, {'If-None-Match': etag}, 304),
+        ('Range 16KB', url, {'Range': 'bytes=0-16383'}, 206),
+        ('avatar webp', f"{url}?size=avatar&format=webp", {}, 200),
+    ]
+    print()
+    print(f"{REQUESTS} requests per case")
+    print(f"{'case':>14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'KB/req':>8}")
+    for name, case_url, headers, expected in cases:
+        if expected == 304 and not etag:
+            print(f"{name:>14} skipped (no ETag)")
+            continue
+        r = run_case(session, case_url, headers, expected)
+        print(f"{name:>14} {r['rps']:>8.0f} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['kb']:>8.1f}")
 
 except Exception as e:
     print(f"Error: {e}")
@@ -180,6 +180,27 @@ class AuthRepository {
     }
   }
 
+  // swipes: [{'target_user_id': id, 'action': 'like' | 'pass'}, ...]
+  Future<Map<String, dynamic>> likeUsersBatch(
+    int sourceUserId,
+    List<Map<String, dynamic>> swipes,
+  ) async {
+    try {
+      final response = await _httpService.post(
+        '/like/batch',
+        body: {'source_user_id': sourceUserId, 'swipes': swipes},
+      );
+
+      if (response.statusCode == 200) {
+        return jsonDecode(response.body);
+      } else {
+        throw Exception('Failed to send swipes: ${response.statusCode}');
+      }
+    } catch (e) {
+      throw Exception('Failed to send swipes: $e');
+    }
+  }
+
   Future<void> removeLike(int targetUserId, int sourceUserId) async {
     try {
       final response = await _httpService.post(
@@ -256,10 +277,16 @@ class AuthRepository {
     }
   }
 
-  Future<List<dynamic>> getChatHistory(int user1, int user2) async {
+  Future<List<dynamic>> getChatHistory(
+    int user1,
+    int user2, {
+    int? afterId,
+  }) async {
     try {
+      // With afterId only messages newer than that id are returned
+      final cursor = afterId != null ? '&after_id=$afterId' : '';
       final response = await _httpService.get(
-        '/chat/history?user1=$user1&user2=$user2',
+        '/chat/history?user1=$user1&user2=$user2$cursor',
       );
 
       if (response.statusCode == 200) {
@@ -272,6 +299,39 @@ class AuthRepository {
     }
   }
 
+  // Long-poll: completes when messages newer than afterId arrive (or with an
+  // empty list when the server-side wait times out)
+  Future<List<dynamic>> waitForMessages(int user1, int user2, int afterId) async {
+    try {
+      final response = await _httpService.get(
+        '/chat/subscribe?user1=$user1&user2=$user2&after_id=$afterId',
+      );
+
+      if (response.statusCode == 200) {
+        return jsonDecode(response.body);
+      } else {
+        throw Exception('Failed to wait for messages: ${response.statusCode}');
+      }
+    } catch (e) {
+      throw Exception('Failed to wait for messages: $e');
+    }
+  }
+
+  Future<void> markChatRead(int userId, int partnerId) async {
+    try {
+      final response = await _httpService.post(
+        '/chat/read',
+        body: {'user_id': userId, 'partner_id': partnerId},
+      );
+
+      if (response.statusCode != 200) {
+        throw Exception('Failed to mark chat read: ${response.statusCode}');
+      }
+    } catch (e) {
+      throw Exception('Failed to mark chat read: $e');
+    }
+  }
+
   Future<void> sendMessage(int senderId, int receiverId, String message) async {
     try {
       final response = await _httpService.post(
@@ -93,6 +93,10 @@ class HttpService {
       if (response.statusCode == 201) {
         final data = jsonDecode(response.body);
         return data['filename'];
+      } else if (response.statusCode == 202) {
+        // Processed in the background; poll until the final filename is ready
+        final data = jsonDecode(response.body);
+        return await _waitForUpload(data['job_id']);
       } else {
         throw Exception(
           'Upload failed: ${response.statusCode} ${response.body}',
@@ -102,4 +106,20 @@ class HttpService {
       throw Exception('Failed to upload image: $e');
     }
   }
+
+  Future<String?> _waitForUpload(String jobId) async {
+    for (var attempt = 0; attempt < 120; attempt++) {
+      await Future.delayed(const Duration(milliseconds: 500));
+      final response = await get('/upload/status/$jobId');
+      if (response.statusCode != 200) {
+        throw Exception('Upload status failed: ${response.statusCode}');
+      }
+      final data = jsonDecode(response.body);
+      if (data['status'] == 'done') return data['filename'];
+      if (data['status'] == 'failed') {
+        throw Exception('Image processing failed: ${data['error']}');
+      }
+    }
+    throw Exception('Upload timed out');
+  }
 }
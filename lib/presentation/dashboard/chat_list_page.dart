@@ -92,7 +92,7 @@ class _ChatListPageState extends State<ChatListPage> {
               itemBuilder: (context, index) {
                 final user = _chats[index];
                 final photoUrl = user['photos']?['photo1'] != null
-                    ? '${HttpService().baseUrl}/uploads/${user['photos']['photo1']}'
+                    ? '${HttpService().baseUrl}/uploads/${user['photos']['photo1']}?size=avatar&format=webp'
                     : null;
 
                 // Parse last message time
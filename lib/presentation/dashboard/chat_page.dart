@@ -31,15 +31,57 @@ class _ChatPageState extends State<ChatPage> {
   @override
   void initState() {
     super.initState();
-    _loadMessages();
+    // New messages are pushed through a long-poll once the history is loaded
+    _loadMessages().then((_) => _listenForMessages());
     _checkBondStatus();
-    // Poll every 5 seconds for new messages
+    // Periodically check bonding status
     _timer = Timer.periodic(const Duration(seconds: 5), (timer) {
-      _loadMessages(refresh: true);
-      _checkBondStatus(); // Periodically check bonding status too
+      _checkBondStatus();
     });
   }
 
+  Future<void> _listenForMessages() async {
+    while (mounted) {
+      final myId = UserSession().userId;
+      if (myId == null) return;
+      try {
+        final lastId = _messages.isNotEmpty ? _messages.last['id'] as int : 0;
+        // Held open by the server until a message arrives or it times out
+        final messages = await _authRepository.waitForMessages(
+          myId,
+          widget.partnerId,
+          lastId,
+        );
+        if (mounted && messages.isNotEmpty) {
+          setState(() => _appendMessages(messages));
+          _markRead();
+        }
+      } catch (e) {
+        debugPrint("Error waiting for messages: $e");
+        await Future.delayed(const Duration(seconds: 5));
+      }
+    }
+  }
+
+  Future<void> _markRead() async {
+    try {
+      final myId = UserSession().userId;
+      if (myId == null) return;
+      await _authRepository.markChatRead(myId, widget.partnerId);
+    } catch (e) {
+      debugPrint("Error marking chat read: $e");
+    }
+  }
+
+  void _appendMessages(List<dynamic> messages) {
+    // The long-poll and a refresh after sending may return the same messages
+    final newest = _messages.isNotEmpty ? _messages.last['id'] as int : 0;
+    _messages = [
+      ..._messages,
+      ...messages.where((m) => (m['id'] as int) > newest),
+    ];
+  }
+
   Future<void> _checkBondStatus() async {
     try {
       final myId = UserSession().userId;
@@ -77,16 +119,27 @@ class _ChatPageState extends State<ChatPage> {
       final myId = UserSession().userId;
       if (myId == null) return;
 
+      // On refresh only fetch messages newer than the last one we have
+      final lastId =
+          refresh && _messages.isNotEmpty ? _messages.last['id'] as int : null;
       final messages = await _authRepository.getChatHistory(
         myId,
         widget.partnerId,
+        afterId: lastId,
       );
       if (mounted) {
         setState(() {
-          _messages = messages;
+          if (lastId != null) {
+            _appendMessages(messages);
+          } else {
+            _messages = messages;
+          }
           _isLoading = false;
         });
-        if (!refresh) _scrollToBottom();
+        if (!refresh) {
+          _scrollToBottom();
+          _markRead();
+        }
       }
     } catch (e) {
       debugPrint("Error loading messages: $e");
@@ -124,7 +124,7 @@ class _ExplorePageState extends State<ExplorePage> {
                                       partnerName: user['name'] ?? 'Unknown',
                                       partnerPhoto:
                                           user['photos']?['photo1'] != null
-                                          ? '${HttpService().baseUrl}/uploads/${user['photos']['photo1']}'
+                                          ? '${HttpService().baseUrl}/uploads/${user['photos']['photo1']}?size=avatar&format=webp'
                                           : null,
                                     ),
                                   ),
@@ -124,7 +124,7 @@ class _LikesYouPageState extends State<LikesYouPage> {
       itemBuilder: (context, index) {
         final user = users[index];
         final photoUrl = user['photos']?['photo1'] != null
-            ? '${HttpService().baseUrl}/uploads/${user['photos']['photo1']}'
+            ? '${HttpService().baseUrl}/uploads/${user['photos']['photo1']}?size=card&format=webp'
             : null;
 
         final name = user['name'] ?? 'Unknown';
@@ -363,7 +363,7 @@ class ProfileCard extends StatelessWidget {
     } else if (filename != null) {
       // Network Fallback
       return Image.network(
-        '${HttpService().baseUrl}/uploads/$filename',
+        '${HttpService().baseUrl}/uploads/$filename?size=card&format=webp',
         width: double.infinity,
         height: height,
         fit: BoxFit.cover,